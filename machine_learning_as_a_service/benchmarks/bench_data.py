@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks.harness import benchmark
+from data.models import Data
+
+FRAME_ROWS = (1000, 10000, 100000)
+
+
+def build_frame(n_rows, seed=42):
+    """
+    Build a frame with a mix of column types roughly like an imported business CSV.
+    """
+    random = np.random.RandomState(seed)
+    return pd.DataFrame({
+        'id': np.arange(n_rows),
+        'value': random.normal(size=n_rows),
+        'count': random.randint(0, 100, size=n_rows),
+        'category': random.choice(['alpha', 'beta', 'gamma', 'delta'], size=n_rows),
+        'timestamp': pd.date_range('2017-01-01', periods=n_rows, freq='min'),
+    })
+
+
+@benchmark('data.save', params=FRAME_ROWS, param_name='rows')
+def data_save(n_rows):
+    frame = build_frame(n_rows)
+
+    def save():
+        Data(data_frame=frame, source_url='http://example.com/bench.csv').save()
+
+    return save
+
+
+@benchmark('data.load', params=FRAME_ROWS, param_name='rows')
+def data_load(n_rows):
+    data = Data(data_frame=build_frame(n_rows), source_url='http://example.com/bench.csv')
+    data.save()
+    return lambda: Data.objects.get(pk=data.pk).data_frame
@@ -0,0 +1,145 @@
+import json
+
+from django.test import RequestFactory
+
+from benchmarks.harness import benchmark
+from lepo.api_info import APIInfo
+from lepo.parameters import cast_parameter_value, read_parameters
+from lepo.path_view import PathView
+from lepo.router import Router
+
+PATH_COUNTS = (10, 100, 1000)
+PAYLOAD_SIZES = (100, 1000, 10000)
+
+
+def handler(request, **kwargs):
+    return kwargs
+
+
+def build_api(n_paths):
+    """
+    Build an OpenAPI document with `n_paths` paths, each with a path parameter and a GET and a POST operation.
+    """
+    paths = {}
+    for i in range(n_paths):
+        paths['/resource%d/{id}' % i] = {
+            'parameters': [{'name': 'id', 'in': 'path', 'type': 'integer', 'required': True}],
+            'get': {
+                'operationId': 'getResource%d' % i,
+                'parameters': [{'name': 'limit', 'in': 'query', 'type': 'integer', 'default': 10}],
+            },
+            'post': {
+                'operationId': 'postResource%d' % i,
+                'parameters': [{'name': 'data', 'in': 'body', 'schema': {'type': 'object'}}],
+            },
+        }
+    return {
+        'swagger': '2.0',
+        'basePath': '/',
+        'consumes': ['application/json'],
+        'produces': ['application/json'],
+        'paths': paths,
+    }
+
+
+def build_router(api):
+    router = Router(api)
+    router.add_handlers({
+        operation.id: handler
+        for path in router.get_paths()
+        for operation in path.get_operations()
+    })
+    return router
+
+
+@benchmark('router.construct', params=PATH_COUNTS, param_name='paths')
+def router_construct(n_paths):
+    api = build_api(n_paths)
+    return lambda: build_router(api)
+
+
+@benchmark('router.get_urls', params=PATH_COUNTS, param_name='paths')
+def router_get_urls(n_paths):
+    router = build_router(build_api(n_paths))
+    return router.get_urls
+
+
+# name -> (parameter definition, raw value as it would arrive in the request)
+PARAMETER_CASES = {
+    'integer': ({'type': 'integer'}, '12345'),
+    'integer_bounded': ({'type': 'integer', 'minimum': 0, 'maximum': 100000}, '12345'),
+    'number': ({'type': 'number'}, '3.14159'),
+    'boolean': ({'type': 'boolean'}, 'true'),
+    'string': ({'type': 'string'}, 'hello world'),
+    'string_enum': ({'type': 'string', 'enum': ['red', 'green', 'blue']}, 'green'),
+    'string_pattern': ({'type': 'string', 'pattern': '^[a-z]+$'}, 'helloworld'),
+    'byte': ({'type': 'string', 'format': 'byte'}, 'aGVsbG8gd29ybGQ='),
+    'date': ({'type': 'string', 'format': 'date'}, '2017-10-04'),
+    'dateTime': ({'type': 'string', 'format': 'dateTime'}, '2017-10-04T12:34:56Z'),
+    'array_csv_100': (
+        {'type': 'array', 'collectionFormat': 'csv', 'items': {'type': 'integer'}},
+        ','.join(str(i) for i in range(100)),
+    ),
+    'array_pipes_100': (
+        {'type': 'array', 'collectionFormat': 'pipes', 'items': {'type': 'number'}},
+        '|'.join(str(i / 2) for i in range(100)),
+    ),
+}
+
+
+@benchmark('parameters.cast', params=sorted(PARAMETER_CASES), param_name='type')
+def parameters_cast(name):
+    parameter, value = PARAMETER_CASES[name]
+    parameter = dict(parameter, name='value', **{'in': 'query'})
+    api_info = APIInfo(build_router(build_api(1)).get_path('/resource0/{id}').get_operation('get'))
+    return lambda: cast_parameter_value(api_info, parameter, value)
+
+
+def build_parameter_request(operation_data, path='/', data=None):
+    api = {
+        'swagger': '2.0',
+        'consumes': ['application/json'],
+        'paths': {'/bench': {'post': dict(operation_data, operationId='bench')}},
+    }
+    router = build_router(api)
+    if data is None:
+        request = RequestFactory().post(path)
+    else:
+        request = RequestFactory().post(path, data=json.dumps(data), content_type='application/json')
+    request.api_info = APIInfo(router.get_path('/bench').get_operation('post'))
+    return request
+
+
+@benchmark('parameters.read.query', params=(1, 10, 50), param_name='parameters')
+def parameters_read_query(n_parameters):
+    parameters = [{'name': 'p%d' % i, 'in': 'query', 'type': 'integer'} for i in range(n_parameters)]
+    query = '&'.join('p%d=%d' % (i, i) for i in range(n_parameters))
+    request = build_parameter_request({'parameters': parameters}, path='/bench?%s' % query)
+    return lambda: read_parameters(request, {})
+
+
+@benchmark('parameters.read.body', params=PAYLOAD_SIZES, param_name='items')
+def parameters_read_body(n_items):
+    schema = {
+        'type': 'array',
+        'items': {
+            'type': 'object',
+            'properties': {'id': {'type': 'integer'}, 'value': {'type': 'number'}},
+        },
+    }
+    data = [{'id': i, 'value': i / 3} for i in range(n_items)]
+    request = build_parameter_request(
+        {'parameters': [{'name': 'data', 'in': 'body', 'schema': schema}]},
+        data=data,
+    )
+    return lambda: read_parameters(request, {})
+
+
+@benchmark('path_view.transform_response', params=PAYLOAD_SIZES, param_name='records')
+def path_view_transform_response(n_records):
+    payload = [
+        {'id': i, 'name': 'record %d' % i, 'value': i / 7, 'tags': ['a', 'b', 'c']}
+        for i in range(n_records)
+    ]
+    view = PathView()
+    return lambda: view.transform_response(payload)
@@ -0,0 +1,125 @@
+import json
+import platform
+import statistics
+import sys
+import time
+import timeit
+from collections import OrderedDict
+
+BENCHMARKS = OrderedDict()
+
+
+class Benchmark:
+    def __init__(self, name, setup, params=(None,), param_name=None):
+        """
+        :param name: Benchmark name.
+        :param setup: Function taking a parameter value and returning the zero-argument callable to time.
+        :param params: Parameter values to run the benchmark with.
+        :param param_name: Name of the parameter, for the result key.
+        """
+        self.name = name
+        self.setup = setup
+        self.params = params
+        self.param_name = param_name
+
+    def get_cases(self):
+        for param in self.params:
+            if self.param_name:
+                yield ('%s[%s=%s]' % (self.name, self.param_name, param), param)
+            else:
+                yield (self.name, param)
+
+
+def benchmark(name, params=(None,), param_name=None):
+    """
+    Register the decorated setup function as a benchmark.
+    """
+    def decorator(setup):
+        BENCHMARKS[name] = Benchmark(name, setup, params=params, param_name=param_name)
+        return setup
+
+    return decorator
+
+
+def time_callable(func, repeat=5, min_time=0.2):
+    """
+    Time `func` like `timeit` does: find a loop count that takes at least `min_time` seconds,
+    then repeat that `repeat` times.
+
+    :return: Timing dict, with per-call times in seconds.
+    :rtype: dict
+    """
+    timer = timeit.Timer(func)
+    loops = 1
+    while True:
+        elapsed = timer.timeit(loops)
+        if elapsed >= min_time:
+            break
+        loops *= (10 if elapsed < min_time / 10 else 2)
+    timings = [elapsed / loops] + [timer.timeit(loops) / loops for x in range(repeat - 1)]
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'max': max(timings),
+        'loops': loops,
+        'repeat': repeat,
+    }
+
+
+def run_benchmarks(filter=None, repeat=5, min_time=0.2, stream=sys.stderr):
+    results = OrderedDict()
+    for bench in BENCHMARKS.values():
+        for key, param in bench.get_cases():
+            if filter and filter not in key:
+                continue
+            func = bench.setup(param)
+            results[key] = time_callable(func, repeat=repeat, min_time=min_time)
+            stream.write('%-60s %12.3f us\n' % (key, results[key]['median'] * 1e6))
+    return results
+
+
+def get_environment():
+    import django
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'django': django.get_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+
+
+def save_results(filename, results):
+    with open(filename, 'w') as outfp:
+        json.dump({'environment': get_environment(), 'results': results}, outfp, indent=2, sort_keys=True)
+
+
+def load_results(filename):
+    with open(filename) as infp:
+        return json.load(infp)['results']
+
+
+def compare_results(baseline, results, threshold=0.1):
+    """
+    Compare median timings against a baseline.
+
+    :param threshold: Relative slowdown considered a regression (0.1 = 10% slower).
+    :return: List of (key, baseline median, current median, ratio, is_regression) tuples.
+    :rtype: list[tuple]
+    """
+    comparison = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        ratio = result['median'] / baseline[key]['median']
+        comparison.append((key, baseline[key]['median'], result['median'], ratio, ratio > 1 + threshold))
+    return comparison
+
+
+def format_comparison(comparison):
+    lines = ['%-60s %12s %12s %8s' % ('benchmark', 'baseline us', 'current us', 'ratio')]
+    for key, baseline, current, ratio, is_regression in comparison:
+        lines.append('%-60s %12.3f %12.3f %7.2fx%s' % (
+            key, baseline * 1e6, current * 1e6, ratio, (' REGRESSION' if is_regression else ''),
+        ))
+    return '\n'.join(lines)
@@ -0,0 +1,60 @@
+"""
+Run the benchmark suite.
+
+Run from the project directory (the one containing `manage.py`):
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --baseline results.json --fail-on-regression
+
+Benchmarks run in-process against a throwaway test database, so no server or network access is needed.
+"""
+import argparse
+import os
+import sys
+
+
+def cmdline():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--output', help='write results as JSON to this file')
+    ap.add_argument('--baseline', help='compare results against this JSON file')
+    ap.add_argument('--threshold', type=float, default=0.1,
+                    help='relative slowdown regarded as a regression (default: %(default)s)')
+    ap.add_argument('--fail-on-regression', action='store_true', help='exit with status 1 on regressions')
+    ap.add_argument('--filter', help='only run benchmarks whose name contains this string')
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('--min-time', type=float, default=0.2, help='minimum time per measurement, in seconds')
+    args = ap.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'machine_learning_as_a_service.settings')
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    from benchmarks import bench_data, bench_lepo  # noqa (registers the benchmarks)
+    from benchmarks.harness import compare_results, format_comparison, load_results, run_benchmarks, save_results
+
+    baseline = (load_results(args.baseline) if args.baseline else None)
+
+    setup_test_environment()
+    old_database_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        results = run_benchmarks(filter=args.filter, repeat=args.repeat, min_time=args.min_time)
+    finally:
+        connection.creation.destroy_test_db(old_database_name, verbosity=0)
+        teardown_test_environment()
+
+    if args.output:
+        save_results(args.output, results)
+
+    if baseline is not None:
+        comparison = compare_results(baseline, results, threshold=args.threshold)
+        print(format_comparison(comparison))
+        if args.fail_on_regression and any(row[-1] for row in comparison):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    cmdline()
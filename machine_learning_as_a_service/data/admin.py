@@ -2,6 +2,16 @@ from django.contrib import admin
 
 from .models import Data
 
-admin.site.register(Data)
 
-# Register your models here.
+class DataAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'version', 'row_count', 'column_count', 'byte_size', 'created', 'updated')
+    search_fields = ('source_url',)
+    readonly_fields = ('version', 'parent', 'sample_spec', 'row_count', 'column_count', 'columns', 'byte_size',
+                       'content_hash', 'created', 'updated')
+
+    def get_queryset(self, request):
+        # Never load the pickled frames just to list or show entries
+        return super(DataAdmin, self).get_queryset(request).defer('data_frame')
+
+
+admin.site.register(Data, DataAdmin)
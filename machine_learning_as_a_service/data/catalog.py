@@ -0,0 +1,176 @@
+"""
+The data set catalog.
+
+Every `Data` entry carries metadata about its contents (row and column counts, column names and
+dtypes, stored size and a content hash) that is set when it's imported (`set_metadata()`) and
+updated when rows are appended (`record_append()`), so that browsing the catalog only ever reads
+those fields, never the pickled frames.  The size and hash are those of the pickle that is stored,
+which is made only once (see `data.models.FrameField`).
+
+The content hash of an entry that has been appended to is a hash chained over its segments,
+so it changes with every append without rehashing what was stored before.
+"""
+import hashlib
+import json
+
+from django.db.models import F
+from django.http import JsonResponse
+from django.utils import timezone
+from marshmallow import Schema, fields
+
+from data import segments, sparse
+from data.models import Data
+from lepo.excs import ExceptionalResponse
+from lepo.handlers import ModelHandlerReadMixin
+
+
+def get_column_info(stored):
+    """
+    :type stored: pandas.DataFrame|data.sparse.SparseFrame
+    :return: The name and dtype of every column.
+    :rtype: list[dict]
+    """
+    if isinstance(stored, sparse.SparseFrame):
+        info = [{'name': name, 'dtype': str(stored.matrix.dtype)} for name in stored.feature_names]
+        if stored.target is not None:
+            info.append({'name': stored.target_name, 'dtype': str(stored.target.dtype)})
+        return info
+    return [{'name': str(name), 'dtype': str(dtype)} for (name, dtype) in stored.dtypes.items()]
+
+
+def encode(instance):
+    """
+    Pickle the `data_frame` of a `Data` or `DataSegment` about to be saved (saving stores this very pickle).
+
+    :rtype: picklefield.fields.PickledObject
+    """
+    return instance._meta.get_field('data_frame').encode(instance)
+
+
+def describe(stored, encoded):
+    """
+    Describe a dataset (or a segment of one) as it is about to be stored.
+
+    :type stored: pandas.DataFrame|data.sparse.SparseFrame
+    :param encoded: `stored` as it is stored (see `encode()`).
+    :return: Values for the metadata fields of `Data`.
+    :rtype: dict
+    """
+    column_info = get_column_info(stored)
+    return {
+        'row_count': len(stored),
+        'column_count': len(column_info),
+        'columns': json.dumps(column_info),
+        'byte_size': len(encoded),
+        'content_hash': hashlib.sha1(encoded.encode('ascii')).hexdigest(),
+    }
+
+
+def chain_hash(previous_hash, segment_hash):
+    return hashlib.sha1(('%s:%s' % (previous_hash, segment_hash)).encode('ascii')).hexdigest()
+
+
+def set_metadata(data):
+    """
+    Set the metadata of a new (or rewritten) `Data` entry from its `data_frame`.
+
+    :type data: data.models.Data
+    """
+    for name, value in describe(data.data_frame, encode(data)).items():
+        setattr(data, name, value)
+
+
+def record_append(segment, encoded):
+    """
+    Update the metadata of a dataset for a segment appended to it.
+
+    Must be called in the transaction that adds the segment, once the segment is saved.
+    Entries stored before the catalog was kept are described in full (see `update_metadata()`).
+
+    :type segment: data.models.DataSegment
+    :param encoded: The segment's `data_frame` as it was stored (see `encode()`).
+    """
+    queryset = Data.objects.filter(pk=segment.data_id)
+    previous_hash = queryset.values_list('content_hash', flat=True).get()
+    if not previous_hash:
+        update_metadata(queryset.get())
+        queryset.update(updated=timezone.now())
+        return
+    description = describe(segment.data_frame, encoded)
+    queryset.update(
+        row_count=F('row_count') + description['row_count'],
+        byte_size=F('byte_size') + description['byte_size'],
+        content_hash=chain_hash(previous_hash, description['content_hash']),
+        updated=timezone.now(),
+    )
+
+
+def update_metadata(data):
+    """
+    (Re)compute the metadata of an existing dataset, loading its frame and segments.
+
+    :type data: data.models.Data
+    """
+    set_metadata(data)
+    for segment in segments.get_segments(data):
+        description = describe(segment.data_frame, encode(segment))
+        data.row_count += description['row_count']
+        data.byte_size += description['byte_size']
+        data.content_hash = chain_hash(data.content_hash, description['content_hash'])
+    Data.objects.filter(pk=data.pk).update(
+        **{name: getattr(data, name) for name in ('row_count', 'column_count', 'columns', 'byte_size', 'content_hash')}
+    )
+
+
+class DataCatalogSchema(Schema):
+    id = fields.Integer(attribute='pk')
+    source_url = fields.String(allow_none=True)
+    version = fields.Integer()
+    parent_id = fields.Integer(allow_none=True)
+    sample = fields.Method('get_sample')
+    row_count = fields.Integer(allow_none=True)
+    column_count = fields.Integer(allow_none=True)
+    columns = fields.Method('get_columns')
+    byte_size = fields.Integer(allow_none=True)
+    content_hash = fields.String(allow_none=True)
+    created = fields.DateTime(allow_none=True)
+    updated = fields.DateTime(allow_none=True)
+
+    def get_sample(self, data):
+        return (json.loads(data.sample_spec) if data.sample_spec else None)
+
+    def get_columns(self, data):
+        return (json.loads(data.columns) if data.columns else None)
+
+
+class DataCatalogHandler(ModelHandlerReadMixin):
+    model = Data
+    queryset = Data.objects.defer('data_frame')
+    schema_class = DataCatalogSchema
+    id_data_name = 'data_id'
+    etag_field_name = 'content_hash'
+    last_modified_field_name = 'updated'
+    list_default_limit = 100
+
+    def get_queryset(self, purpose):
+        queryset = super(DataCatalogHandler, self).get_queryset(purpose)
+        if purpose != 'list':
+            return queryset
+        if self.args.get('source'):
+            queryset = queryset.filter(source_url__icontains=self.args['source'])
+        if self.args.get('column'):
+            # The JSON is written by `describe()`, so a column's entry always starts like this
+            queryset = queryset.filter(columns__contains='{"name": %s,' % json.dumps(self.args['column']))
+        if self.args.get('min_row_count') is not None:
+            queryset = queryset.filter(row_count__gte=self.args['min_row_count'])
+        if self.args.get('max_row_count') is not None:
+            queryset = queryset.filter(row_count__lte=self.args['max_row_count'])
+        if self.args.get('parent_id') is not None:
+            queryset = queryset.filter(parent_id=self.args['parent_id'])
+        return queryset
+
+    def retrieve_object(self):
+        try:
+            return super(DataCatalogHandler, self).retrieve_object()
+        except Data.DoesNotExist:
+            raise ExceptionalResponse(JsonResponse({'error': 'No data with ID %s' % self.args['data_id']}, status=404))
@@ -0,0 +1,174 @@
+"""
+Compacting datasets at import time.
+
+`pandas.read_csv` gives every numeric column a 64-bit dtype and keeps strings as Python objects.
+`compact_frame()` downcasts numeric columns to the narrowest dtype that holds every value exactly
+(but no narrower than 16 bits, and keeping signed integers signed, so that arithmetic on the stored
+columns doesn't silently wrap around as easily; `data.pipeline` widens operands before arithmetic anyway),
+and turns string columns with few distinct values into categoricals, which typically shrinks
+business data severalfold both in memory and pickled.
+"""
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from data import sparse
+
+SIGNED_CANDIDATES = (np.int16, np.int32)
+
+UNSIGNED_CANDIDATES = (np.uint16, np.uint32)
+
+
+def get_default_category_threshold():
+    return getattr(settings, 'DATA_COMPACT_CATEGORY_THRESHOLD', 0.5)
+
+
+def get_memory_usage(series):
+    return int(series.memory_usage(index=False, deep=True))
+
+
+def get_array_memory_usage(values):
+    return int(values.nbytes)
+
+
+def downcast_numeric(values):
+    """
+    Downcast a numeric array or series to the narrowest dtype that represents all of its values exactly.
+
+    Returns the input as-is if it can't be made narrower.
+    """
+    kind = values.dtype.kind
+    if kind in 'iu':
+        if len(values) == 0:
+            return values
+        low, high = values.min(), values.max()
+        for dtype in (UNSIGNED_CANDIDATES if kind == 'u' else SIGNED_CANDIDATES):
+            if np.dtype(dtype).itemsize >= values.dtype.itemsize:
+                break
+            info = np.iinfo(dtype)
+            if info.min <= low and high <= info.max:
+                return values.astype(dtype)
+        return values
+    if kind == 'f' and values.dtype.itemsize > 4:
+        narrowed = values.astype(np.float32)
+        # Only if the round trip is lossless (NaNs compare unequal, so they're checked separately)
+        roundtrip = narrowed.astype(values.dtype)
+        if ((roundtrip == values) | (np.isnan(roundtrip) & np.isnan(values))).all():
+            return narrowed
+    return values
+
+
+def should_categorize(series, category_threshold):
+    if not (series.dtype == object or pd.api.types.is_string_dtype(series.dtype)) or len(series) == 0:
+        return False
+    n_unique = series.nunique(dropna=True)
+    return n_unique <= category_threshold * len(series)
+
+
+def compact_series(series, category_threshold):
+    if isinstance(series.dtype, np.dtype) and series.dtype.kind in 'iuf':
+        return downcast_numeric(series)
+    if should_categorize(series, category_threshold):
+        return series.astype('category')
+    return series
+
+
+def compact_frame(frame, category_threshold=None):
+    """
+    Compact the columns of a frame.
+
+    :type frame: pandas.DataFrame
+    :param category_threshold: String columns whose number of distinct values is at most this fraction
+                               of the number of rows become categoricals; 0 disables this.
+    :type category_threshold: float|None
+    :return: The compacted frame, and a memory report (see `get_report()`).
+    :rtype: tuple[pandas.DataFrame, dict]
+    """
+    if category_threshold is None:
+        category_threshold = get_default_category_threshold()
+    entries = []
+    compacted = {}
+    for name in frame.columns:
+        series = frame[name]
+        new_series = compact_series(series, category_threshold)
+        compacted[name] = new_series
+        entries.append(get_entry(name, series, new_series, get_memory_usage))
+    frame = pd.DataFrame(compacted, index=frame.index, columns=frame.columns)
+    return (frame, get_report(entries))
+
+
+def compact_sparse_frame(sparse_frame):
+    """
+    Compact the stored values (and the target) of a sparse frame.
+
+    :type sparse_frame: data.sparse.SparseFrame
+    :return: The compacted sparse frame, and a memory report (see `get_report()`).
+    :rtype: tuple[data.sparse.SparseFrame, dict]
+    """
+    matrix = sparse_frame.matrix
+    data = downcast_numeric(matrix.data)
+    entries = [get_entry('(values)', matrix.data, data, get_array_memory_usage)]
+    matrix = matrix.__class__((data, matrix.indices, matrix.indptr), shape=matrix.shape, copy=False)
+    target = sparse_frame.target
+    if target is not None:
+        new_target = (downcast_numeric(target) if target.dtype.kind in 'iuf' else target)
+        entries.append(get_entry(sparse_frame.target_name, target, new_target, get_array_memory_usage))
+        target = new_target
+    sparse_frame = sparse.SparseFrame(
+        matrix,
+        feature_names=sparse_frame.feature_names,
+        target=target,
+        target_name=sparse_frame.target_name,
+    )
+    return (sparse_frame, get_report(entries))
+
+
+def get_entry(name, before, after, get_usage):
+    return {
+        'column': str(name),
+        'dtype_before': str(before.dtype),
+        'dtype_after': str(after.dtype),
+        'bytes_before': get_usage(before),
+        'bytes_after': get_usage(after),
+    }
+
+
+def get_report(entries):
+    """
+    :return: A dict with per-column `columns` entries and the totals `bytes_before` and `bytes_after`.
+    :rtype: dict
+    """
+    return {
+        'columns': entries,
+        'bytes_before': sum(entry['bytes_before'] for entry in entries),
+        'bytes_after': sum(entry['bytes_after'] for entry in entries),
+    }
+
+
+def compact(stored, category_threshold=None):
+    """
+    Compact a dataset as it is about to be stored in `Data.data_frame`.
+
+    :type stored: pandas.DataFrame|data.sparse.SparseFrame
+    :rtype: tuple[pandas.DataFrame|data.sparse.SparseFrame, dict]
+    """
+    if isinstance(stored, sparse.SparseFrame):
+        return compact_sparse_frame(stored)
+    return compact_frame(stored, category_threshold=category_threshold)
+
+
+def get_memory_report(stored):
+    """
+    Report the memory used by a dataset without changing it, in the same format as `compact()`.
+
+    :rtype: dict
+    """
+    if isinstance(stored, sparse.SparseFrame):
+        entries = [get_entry('(values)', stored.matrix.data, stored.matrix.data, get_array_memory_usage)]
+        if stored.target is not None:
+            entries.append(get_entry(stored.target_name, stored.target, stored.target, get_array_memory_usage))
+        return get_report(entries)
+    return get_report([
+        get_entry(name, stored[name], stored[name], get_memory_usage)
+        for name in stored.columns
+    ])
@@ -0,0 +1,639 @@
+"""
+Cached feature matrices.
+
+Estimators want a numeric matrix, not a `Data` frame: the feature columns picked out, missing
+values imputed, categorical columns one-hot encoded and everything scaled.  `get_feature_matrix()`
+does that once per dataset version and preprocessing spec (see `normalize_spec()`), writes the
+result into `DATA_FEATURE_CACHE_DIR` and memory-maps it from there, so every fit, every
+cross-validation fold and every worker process shares one copy:
+
+* dense matrices are stored as one C-contiguous `.npy` array of the spec's dtype,
+* sparse ones (sparse datasets, or one-hot encoding of many categories) as the three arrays of a CSR matrix,
+* the fitted preprocessing parameters (imputed values, categories, scaling) as `params.json`, so that
+  rows sent in for prediction can be transformed exactly like the training data with `transform()`.
+
+Like `data.sharing`, the directory must only be writable by trusted users.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import warnings
+from collections import Counter, OrderedDict
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from django.conf import settings
+
+from data import sampling, sharing, sparse, storage
+
+DEFAULT_SPEC = {
+    'columns': None,  # Feature columns; None for all of them
+    'exclude': [],  # Columns never to use as features (such as the target)
+    'one_hot': True,  # Whether to one-hot encode non-numeric columns (or else drop them)
+    'max_categories': 100,  # Most frequent categories to encode per column
+    'impute': 'mean',  # 'mean', 'median', 'zero' or None
+    'scale': 'standard',  # 'standard', 'minmax' or None
+    'dtype': 'float64',  # 'float64' or 'float32'
+    'sparse': 'auto',  # True, False or 'auto'
+}
+
+IMPUTE_STRATEGIES = ('mean', 'median', 'zero', None)
+SCALERS = ('standard', 'minmax', None)
+DTYPES = ('float32', 'float64')
+
+KEY_REGEX = re.compile(r'^features-\d+-\d+-[0-9a-f]{40}$')
+
+MANIFEST_NAME = 'manifest.json'
+PARAMS_NAME = 'params.json'
+DENSE_NAME = 'matrix.npy'
+SPARSE_ARRAY_NAMES = ('data', 'indices', 'indptr')
+
+# Feature matrices loaded by this process, by key, least recently used first (guarded by `_loaded_lock`)
+_loaded = OrderedDict()
+_loaded_lock = threading.Lock()
+
+
+class FeatureError(ValueError):
+    pass
+
+
+def get_feature_cache_dir():
+    if sharing.fcntl is None:
+        return None
+    return getattr(settings, 'DATA_FEATURE_CACHE_DIR', None)
+
+
+def normalize_spec(spec):
+    """
+    Fill in the defaults of a preprocessing spec and validate it.
+
+    :type spec: dict|None
+    :raises FeatureError: if the spec is invalid
+    :rtype: dict
+    """
+    unknown = set(spec or {}) - set(DEFAULT_SPEC)
+    if unknown:
+        raise FeatureError('Unknown preprocessing options: %s' % ', '.join(sorted(unknown)))
+    spec = dict(DEFAULT_SPEC, **(spec or {}))
+    if spec['impute'] not in IMPUTE_STRATEGIES:
+        raise FeatureError('Unknown imputation strategy %r' % spec['impute'])
+    if spec['scale'] not in SCALERS:
+        raise FeatureError('Unknown scaler %r' % spec['scale'])
+    if spec['dtype'] not in DTYPES:
+        raise FeatureError('Unknown dtype %r (known dtypes are %s)' % (spec['dtype'], ', '.join(DTYPES)))
+    if spec['sparse'] not in (True, False, 'auto'):
+        raise FeatureError('sparse must be true, false or "auto"')
+    if spec['columns'] is not None:
+        spec['columns'] = [str(column) for column in spec['columns']]
+    spec['exclude'] = sorted(str(column) for column in spec['exclude'])
+    spec['max_categories'] = int(spec['max_categories'])
+    return spec
+
+
+def get_feature_key(data, spec, sample=None):
+    """
+    :type data: data.models.Data
+    :param spec: A normalized spec.
+    :type sample: data.sampling.SampleSpec|None
+    :rtype: str
+    """
+    hashed = (spec if sample is None else [spec, sample.get_key()])
+    spec_hash = hashlib.sha1(json.dumps(hashed, sort_keys=True).encode('utf-8')).hexdigest()
+    return 'features-%d-%d-%s' % (data.pk, data.version, spec_hash)
+
+
+def is_numeric(series):
+    return isinstance(series.dtype, np.dtype) and series.dtype.kind in 'biuf'
+
+
+def get_category_values(series):
+    """
+    Get the values of a column as strings (None for missing values), as categories are matched by them.
+    """
+    return series.astype(object).where(series.notnull(), None).map(lambda value: (None if value is None else str(value)))
+
+
+def get_feature_columns(all_columns, spec):
+    columns = (spec['columns'] if spec['columns'] is not None else all_columns)
+    missing = [column for column in columns if column not in all_columns]
+    if missing:
+        raise FeatureError('Unknown columns: %s' % ', '.join(missing))
+    return [column for column in columns if column not in spec['exclude']]
+
+
+class NumericStatistics:
+    """
+    Running statistics of the numeric columns of a dataset, updated a chunk at a time.
+
+    Means and variances are combined across chunks exactly (with Chan et al.'s pairwise update);
+    medians are taken from a uniform sample of at most `sample_size` rows.
+    """
+
+    def __init__(self, n_columns, sample_size=None, seed=0):
+        self.count = np.zeros(n_columns)  # Of values present
+        self.missing = np.zeros(n_columns)
+        self.mean = np.zeros(n_columns)
+        self.m2 = np.zeros(n_columns)  # Sum of squared differences from the mean
+        self.min = np.full(n_columns, np.nan)
+        self.max = np.full(n_columns, np.nan)
+        self.sample_size = sample_size
+        self.sample = self.sample_keys = None
+        self.rng = np.random.RandomState(seed)
+
+    def update(self, values):
+        """
+        :param values: A chunk of rows.
+        :type values: numpy.ndarray
+        """
+        if not len(values):
+            return
+        present = ~np.isnan(values)
+        count = present.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(present, values, 0).sum(axis=0) / count
+            m2 = np.where(present, values - mean, 0) ** 2
+        m2 = m2.sum(axis=0)
+        total = self.count + count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = mean - self.mean
+            new_mean = self.mean + delta * count / total
+            new_m2 = self.m2 + m2 + delta ** 2 * self.count * count / total
+        has_values = (count > 0)
+        self.mean = np.where(has_values, new_mean, self.mean)
+        self.m2 = np.where(has_values, new_m2, self.m2)
+        self.count = total
+        self.missing += len(values) - count
+        self.min = np.fmin(self.min, np.fmin.reduce(values, axis=0))
+        self.max = np.fmax(self.max, np.fmax.reduce(values, axis=0))
+        if self.sample_size is not None:
+            self.update_sample(values)
+
+    def update_sample(self, values):
+        keys = self.rng.random_sample(len(values))
+        if self.sample is not None:
+            values = np.concatenate([self.sample, values])
+            keys = np.concatenate([self.sample_keys, keys])
+        if len(keys) > self.sample_size:
+            keep = np.argpartition(keys, self.sample_size)[:self.sample_size]
+            values, keys = values[keep], keys[keep]
+        self.sample, self.sample_keys = values, keys
+
+    def get_median(self):
+        if self.sample is None:
+            return np.full(len(self.count), np.nan)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # All-NaN columns
+            return np.nanmedian(self.sample, axis=0)
+
+    def get_filled(self, impute):
+        """
+        Get the count, mean, sum of squared differences, minimum and maximum
+        of the columns after filling missing values with `impute`.
+        """
+        if impute is None:
+            return (self.count, self.mean, self.m2, self.min, self.max)
+        count = self.count + self.missing
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = (self.count * self.mean + self.missing * impute) / count
+        m2 = self.m2 + self.count * (self.mean - mean) ** 2 + self.missing * (impute - mean) ** 2
+        has_missing = (self.missing > 0)
+        low = np.where(has_missing, np.fmin(self.min, impute), self.min)
+        high = np.where(has_missing, np.fmax(self.max, impute), self.max)
+        return (count, mean, m2, low, high)
+
+
+def fit_frames(frames, spec):
+    """
+    Fit the preprocessing of a dense dataset in a single pass over its chunks.
+
+    Only running statistics (and, for median imputation, a sample of `DATA_READ_CHUNK_SIZE` rows)
+    are kept, so datasets of any length can be fitted in bounded memory.
+
+    :param frames: The dataset as consecutive chunks with the same columns (at least one, possibly empty).
+    :type frames: Iterable[pandas.DataFrame]
+    :param spec: A normalized spec.
+    :return: The fitted parameters (see the module docstring).
+    :rtype: dict
+    """
+    numeric = categorical = statistics = None
+    for frame in frames:
+        if numeric is None:
+            numeric = [name for name in frame.columns if is_numeric(frame[name])]
+            categorical = OrderedDict(
+                (name, Counter()) for name in frame.columns
+                if spec['one_hot'] and name not in numeric
+            )
+            statistics = NumericStatistics(
+                len(numeric),
+                sample_size=(getattr(settings, 'DATA_READ_CHUNK_SIZE', 100000) if spec['impute'] == 'median' else None),
+            )
+        statistics.update(frame[numeric].astype(np.float64).values)
+        for name, counts in categorical.items():
+            counts.update(get_category_values(frame[name]).value_counts(dropna=True).to_dict())
+
+    if spec['impute'] == 'mean':
+        impute = statistics.mean
+    elif spec['impute'] == 'median':
+        impute = statistics.get_median()
+    elif spec['impute'] == 'zero':
+        impute = np.zeros(len(numeric))
+    else:
+        impute = None
+    if impute is not None:
+        impute = np.where(statistics.count > 0, impute, 0.0)  # For columns with nothing but missing values
+        impute = np.nan_to_num(impute)
+
+    count, mean, m2, low, high = statistics.get_filled(impute)
+    if spec['scale'] == 'standard':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            center, scale = mean, np.sqrt(m2 / count)
+    elif spec['scale'] == 'minmax':
+        center, scale = low, high - low
+    else:
+        center = scale = None
+
+    def as_series(values):
+        return (None if values is None else pd.Series(values, index=numeric))
+
+    categorical = OrderedDict(
+        (name, sorted(category for (category, n) in counts.most_common(spec['max_categories'])))
+        for (name, counts) in categorical.items()
+    )
+    return get_params(spec, numeric, categorical, as_series(impute), as_series(center), as_series(scale))
+
+
+def fit_frame(frame, spec):
+    """
+    Fit the preprocessing of a dense dataset held in memory.
+
+    :type frame: pandas.DataFrame
+    :param spec: A normalized spec.
+    :rtype: dict
+    """
+    return fit_frames([frame], spec)
+
+
+def fit_sparse_frame(sparse_frame, spec):
+    """
+    Fit the preprocessing of a sparse dataset.
+
+    All of its columns are numeric, and it has no missing values; to keep the matrix sparse,
+    values are only ever scaled, not centered ('standard' divides by the standard deviation,
+    'minmax' by the largest absolute value).
+    """
+    numeric = get_feature_columns(sparse_frame.feature_names, dict(spec, exclude=spec['exclude'] + [sparse_frame.target_name]))
+    matrix = sparse_frame.get_matrix(numeric).astype(np.float64)
+    if spec['scale'] == 'standard':
+        mean = np.asarray(matrix.mean(axis=0)).ravel()
+        mean_square = np.asarray(matrix.multiply(matrix).mean(axis=0)).ravel()
+        scale = pd.Series(np.sqrt(np.maximum(mean_square - mean ** 2, 0)), index=numeric)
+    elif spec['scale'] == 'minmax':
+        scale = pd.Series(abs(matrix).max(axis=0).toarray().ravel(), index=numeric)
+    else:
+        scale = None
+    center = (pd.Series(0.0, index=numeric) if scale is not None else None)
+    return get_params(spec, numeric, OrderedDict(), None, center, scale)
+
+
+def get_params(spec, numeric, categorical, impute, center, scale):
+    feature_names = list(numeric)
+    for name, categories in categorical.items():
+        feature_names.extend('%s=%s' % (name, category) for category in categories)
+    if scale is not None:
+        scale = scale.replace(0, 1.0).fillna(1.0)  # Leave constant columns alone
+        center = center.fillna(0.0)
+    return {
+        'spec': spec,
+        'numeric': [str(name) for name in numeric],
+        'categorical': OrderedDict((str(name), categories) for (name, categories) in categorical.items()),
+        'impute': (None if impute is None else [float(value) for value in impute.values]),
+        'center': (None if center is None else [float(value) for value in center.values]),
+        'scale': (None if scale is None else [float(value) for value in scale.values]),
+        'feature_names': feature_names,
+    }
+
+
+def should_be_sparse(params):
+    if params['spec']['sparse'] != 'auto':
+        return params['spec']['sparse']
+    n_features = len(params['feature_names'])
+    # Each row has (at most) one nonzero per numeric column and one per one-hot encoded column
+    nonzeros = len(params['numeric']) + len(params['categorical'])
+    return bool(n_features) and nonzeros / n_features <= sparse.get_max_density()
+
+
+def transform(frame, params, as_sparse=None):
+    """
+    Transform rows into features with fitted parameters.
+
+    Rows with categories not seen in fitting get zeros in all of that column's one-hot features.
+
+    :type frame: pandas.DataFrame
+    :param params: Fitted parameters, see `fit_frame()`.
+    :param as_sparse: Whether to return a CSR matrix; defaults to what the fitted matrix is stored as.
+    :raises FeatureError: if columns are missing
+    :rtype: numpy.ndarray|scipy.sparse.csr_matrix
+    """
+    missing = [name for name in params['numeric'] + list(params['categorical']) if name not in frame.columns]
+    if missing:
+        raise FeatureError('Missing columns: %s' % ', '.join(missing))
+    dtype = np.dtype(params['spec']['dtype'])
+    if as_sparse is None:
+        as_sparse = should_be_sparse(params)
+
+    values = frame[params['numeric']].astype(np.float64).values
+    if params['impute'] is not None:
+        values = np.where(np.isnan(values), np.asarray(params['impute']), values)
+    if params['scale'] is not None:
+        values = (values - np.asarray(params['center'])) / np.asarray(params['scale'])
+
+    rows = []
+    columns = []
+    offset = 0
+    for name, categories in params['categorical'].items():
+        codes = pd.Categorical(get_category_values(frame[name]), categories=categories).codes
+        known = (codes >= 0)
+        rows.append(np.flatnonzero(known))
+        columns.append(codes[known] + offset)
+        offset += len(categories)
+    one_hot = scipy.sparse.csr_matrix(
+        (
+            np.ones(sum(len(row_indices) for row_indices in rows), dtype=dtype),
+            (np.concatenate(rows or [[]]).astype(int), np.concatenate(columns or [[]]).astype(int)),
+        ),
+        shape=(len(frame), offset),
+    )
+
+    if as_sparse:
+        return scipy.sparse.hstack([scipy.sparse.csr_matrix(values.astype(dtype)), one_hot], format='csr')
+    matrix = np.empty((len(frame), values.shape[1] + offset), dtype=dtype)
+    matrix[:, :values.shape[1]] = values
+    matrix[:, values.shape[1]:] = one_hot.toarray()
+    return matrix
+
+
+def transform_sparse_frame(sparse_frame, params):
+    matrix = sparse_frame.get_matrix(params['numeric'])
+    if params['scale'] is not None:
+        matrix = matrix.multiply(1 / np.asarray(params['scale']))
+    return scipy.sparse.csr_matrix(matrix, dtype=np.dtype(params['spec']['dtype']))
+
+
+class FeatureMatrix:
+    """
+    A feature matrix of a dataset, memory-mapped from the cache (or in memory if there is no cache).
+    """
+
+    def __init__(self, key, matrix, params):
+        self.key = key
+        self.matrix = matrix
+        self.params = params
+
+    @property
+    def feature_names(self):
+        return self.params['feature_names']
+
+    @property
+    def is_sparse(self):
+        return scipy.sparse.issparse(self.matrix)
+
+    def transform(self, frame):
+        """
+        Transform new rows (e.g. for prediction) the way this matrix was built.
+        """
+        return transform(frame, self.params, as_sparse=self.is_sparse)
+
+    def get_info(self):
+        return {
+            'key': self.key,
+            'shape': list(self.matrix.shape),
+            'dtype': str(self.matrix.dtype),
+            'sparse': self.is_sparse,
+            'feature_names': self.feature_names,
+            'params': self.params,
+        }
+
+
+def build(data, spec, directory=None, sample=None):
+    """
+    Fit the preprocessing for a dataset and build its feature matrix, writing it into `directory` if given.
+
+    Dense datasets are read twice in chunks of `DATA_READ_CHUNK_SIZE` rows, once to fit the preprocessing
+    (see `fit_frames()`) and once to transform (and write) the rows, so that no more than one chunk's
+    worth of the dataset and of intermediate arrays is held in memory at a time.
+
+    With a `sample`, the matrix is built from (and the preprocessing fitted on) that sample of the
+    rows only (see `data.sampling`); the sample is drawn in one pass and held in memory.
+
+    :type sample: data.sampling.SampleSpec|None
+    :return: The matrix (memory-mapped, if written) and the fitted parameters.
+    :rtype: tuple[numpy.ndarray|scipy.sparse.csr_matrix, dict]
+    """
+    sparse_frame = storage.get_sparse_frame(data)
+    if sparse_frame is not None:
+        if sample is not None:
+            sparse_frame = sample_sparse_frame(data, sparse_frame, sample)
+        params = fit_sparse_frame(sparse_frame, spec)
+        matrix = transform_sparse_frame(sparse_frame, params)
+    else:
+        columns = get_feature_columns(storage.get_columns(data), spec)
+        if sample is not None:
+            frame = sampling.sample_data(data, sample, columns=columns)
+            params = fit_frame(frame, spec)
+            chunks = [frame]
+        else:
+            params = fit_frames(iterate_chunks(data, columns), spec)
+            chunks = iterate_chunks(data, columns)
+        if should_be_sparse(params):
+            matrix = scipy.sparse.vstack([transform(chunk, params, as_sparse=True) for chunk in chunks], format='csr')
+        elif directory:
+            matrix = write_dense_chunks(chunks, params, os.path.join(directory, DENSE_NAME))
+        else:
+            matrix = np.concatenate([transform(chunk, params, as_sparse=False) for chunk in chunks])
+    if sample is not None:
+        params['sample'] = dict(sample.to_dict(), version=data.version)
+    if directory:
+        if scipy.sparse.issparse(matrix):
+            for name in SPARSE_ARRAY_NAMES:
+                np.save(os.path.join(directory, '%s.npy' % name), getattr(matrix, name), allow_pickle=False)
+        with open(os.path.join(directory, MANIFEST_NAME), 'w') as outfp:
+            json.dump({'shape': list(matrix.shape), 'sparse': scipy.sparse.issparse(matrix)}, outfp)
+        with open(os.path.join(directory, PARAMS_NAME), 'w') as outfp:
+            json.dump(params, outfp)
+    return (matrix, params)
+
+
+def sample_sparse_frame(data, sparse_frame, sample):
+    """
+    :rtype: data.sparse.SparseFrame
+    """
+    frame = sampling.sample_data(data, sample)
+    return sparse.SparseFrame(
+        sparse.to_matrix(frame[list(sparse_frame.feature_names)]),
+        feature_names=sparse_frame.feature_names,
+        target=(frame[sparse_frame.target_name].values if sparse_frame.target is not None else None),
+        target_name=sparse_frame.target_name,
+    )
+
+
+def iterate_chunks(data, columns):
+    """
+    Read the columns of a dataset in chunks (see `storage.iterate_frames()`); an empty dataset is one empty chunk.
+    """
+    empty = True
+    for chunk in storage.iterate_frames(data, columns=columns):
+        empty = False
+        yield chunk
+    if empty:
+        yield storage.read_frame(data, columns=columns)
+
+
+def write_dense_chunks(chunks, params, filename):
+    """
+    Transform chunks of rows into one `.npy` file.
+    """
+    # The number of rows isn't known up front, so the rows go to a raw file first and get a header after
+    n_rows = 0
+    raw_filename = '%s.raw' % filename
+    with open(raw_filename, 'wb') as outfp:
+        for chunk in chunks:
+            matrix = transform(chunk, params, as_sparse=False)
+            outfp.write(np.ascontiguousarray(matrix).tobytes())
+            n_rows += len(matrix)
+    shape = (n_rows, len(params['feature_names']))
+    dtype = np.dtype(params['spec']['dtype'])
+    with open(filename, 'wb') as outfp:
+        np.lib.format.write_array_header_1_0(outfp, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': shape})
+        with open(raw_filename, 'rb') as infp:
+            shutil.copyfileobj(infp, outfp)
+    os.remove(raw_filename)
+    return np.load(filename, mmap_mode='r')
+
+
+def load(directory, key):
+    """
+    Load a cached feature matrix, memory-mapping its arrays.
+
+    :rtype: FeatureMatrix
+    """
+    with open(os.path.join(directory, MANIFEST_NAME)) as infp:
+        manifest = json.load(infp)
+    with open(os.path.join(directory, PARAMS_NAME)) as infp:
+        params = json.load(infp, object_pairs_hook=OrderedDict)
+    if manifest['sparse']:
+        arrays = [np.load(os.path.join(directory, '%s.npy' % name), mmap_mode='r') for name in SPARSE_ARRAY_NAMES]
+        matrix = scipy.sparse.csr_matrix(tuple(arrays), shape=tuple(manifest['shape']), copy=False)
+    else:
+        matrix = np.load(os.path.join(directory, DENSE_NAME), mmap_mode='r')
+    return FeatureMatrix(key, matrix, params)
+
+
+def get_feature_matrix(data, spec=None, sample=None):
+    """
+    Get the feature matrix of a dataset, building and caching it if need be.
+
+    :type data: data.models.Data
+    :param spec: Preprocessing spec; see `DEFAULT_SPEC`.
+    :type spec: dict|None
+    :param sample: Sample of the rows to build the matrix from, if not all of them; see `build()`.
+    :type sample: data.sampling.SampleSpec|None
+    :raises FeatureError: if the spec is invalid or doesn't fit the dataset
+    :rtype: FeatureMatrix
+    """
+    spec = normalize_spec(spec)
+    key = get_feature_key(data, spec, sample)
+    features = get_loaded(key)
+    if features is not None:
+        return features
+
+    cache_dir = get_feature_cache_dir()
+    if not cache_dir:
+        matrix, params = build(data, spec, sample=sample)
+        return FeatureMatrix(key, matrix, params)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    directory = os.path.join(cache_dir, key)
+    with sharing.locked(sharing.get_lock_filename(cache_dir, key)):  # Only one process builds any given matrix
+        if not os.path.isdir(directory):
+            temp_directory = tempfile.mkdtemp(dir=cache_dir, prefix='.build-')
+            try:
+                build(data, spec, directory=temp_directory, sample=sample)
+                os.rename(temp_directory, directory)
+            except Exception:
+                shutil.rmtree(temp_directory, ignore_errors=True)
+                raise
+        features = load(directory, key)
+    return remember(features)
+
+
+def get_loaded(key):
+    with _loaded_lock:
+        features = _loaded.get(key)
+        if features is not None:
+            _loaded.move_to_end(key)
+        return features
+
+
+def remember(features):
+    """
+    Keep a loaded feature matrix around for later calls in this process.
+    """
+    with _loaded_lock:
+        _loaded[features.key] = features
+        while len(_loaded) > getattr(settings, 'DATA_FEATURE_CACHE_MAX_LOADED', 16):
+            _loaded.popitem(last=False)
+    return features
+
+
+def get_cached_feature_matrix(key):
+    """
+    Get a feature matrix built earlier by its key (e.g. to transform rows for prediction).
+
+    :return: The feature matrix, or None if it isn't (or no longer) cached.
+    :rtype: FeatureMatrix|None
+    """
+    if not KEY_REGEX.match(key):
+        return None
+    features = get_loaded(key)
+    if features is not None:
+        return features
+    cache_dir = get_feature_cache_dir()
+    if not cache_dir or not os.path.isdir(cache_dir):
+        return None
+    directory = os.path.join(cache_dir, key)
+    with sharing.locked(sharing.get_lock_filename(cache_dir, key)):  # Not while it's being deleted
+        if not os.path.isdir(directory):
+            return None
+        features = load(directory, key)
+    return remember(features)
+
+
+def cleanup(keep):
+    """
+    Delete cached feature matrices of datasets (or dataset versions) that no longer exist.
+
+    :param keep: Predicate on the dataset key (see `data.sharing.get_dataset_key`) of the matrix.
+    :return: Keys of the deleted matrices.
+    :rtype: list[str]
+    """
+    cache_dir = get_feature_cache_dir()
+    if not cache_dir or not os.path.isdir(cache_dir):
+        return []
+    deleted = []
+    keys = {(name[:-len('.lock')] if name.endswith('.lock') else name) for name in os.listdir(cache_dir)}
+    for key in sorted(keys):
+        if not KEY_REGEX.match(key) or keep('data-%s' % key.split('-', 1)[1].rsplit('-', 1)[0]):
+            continue
+        lock_filename = sharing.get_lock_filename(cache_dir, key)
+        with sharing.locked(lock_filename):
+            shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+            sharing.remove_lock(lock_filename)  # Safe while holding the lock; see `sharing.locked()`
+        with _loaded_lock:
+            _loaded.pop(key, None)
+        deleted.append(key)
+    return deleted
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from data import features, sharing
+from data.models import Data
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete shared datasets that are no longer attached by any process and have been idle for long enough, '
+        'and cached feature matrices of datasets that no longer exist.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-idle', type=float, default=None, help='idle time in seconds')
+
+    def handle(self, *args, **options):
+        current_keys = {sharing.get_dataset_key(data) for data in Data.objects.only('pk', 'version')}
+        deleted = sharing.cleanup(max_idle=options['max_idle'], keep=current_keys.__contains__)
+        deleted += features.cleanup(keep=current_keys.__contains__)
+        for key in deleted:
+            self.stdout.write('Deleted %s' % key)
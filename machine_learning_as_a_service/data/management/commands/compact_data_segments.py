@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from data import segments
+from data.models import Data
+
+
+class Command(BaseCommand):
+    help = 'Merge runs of small segments appended to datasets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('data_ids', nargs='*', type=int, help='datasets to compact (default: all)')
+        parser.add_argument('--max-rows', type=int, default=None, help='segments with fewer rows are merged')
+        parser.add_argument('--min-segments', type=int, default=None, help='minimum number of small segments to merge')
+
+    def handle(self, *args, **options):
+        data_ids = options['data_ids'] or Data.objects.filter(version__gt=1).values_list('pk', flat=True)
+        for data_id in data_ids:
+            merged = segments.compact_segments(
+                data_id,
+                max_rows=options['max_rows'],
+                min_segments=options['min_segments'],
+            )
+            if merged:
+                self.stdout.write('Data %d: merged away %d segments' % (data_id, merged))
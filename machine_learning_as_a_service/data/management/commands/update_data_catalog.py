@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from data import catalog
+from data.models import Data
+
+
+class Command(BaseCommand):
+    help = 'Compute the catalog metadata of datasets stored before it was kept (or of all datasets, with --all).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('data_ids', nargs='*', type=int, help='datasets to update')
+        parser.add_argument('--all', action='store_true', help='update all datasets')
+
+    def handle(self, *args, **options):
+        queryset = Data.objects.all()
+        if options['data_ids']:
+            queryset = queryset.filter(pk__in=options['data_ids'])
+        elif not options['all']:
+            queryset = queryset.filter(content_hash__isnull=True)
+        for data_id in queryset.values_list('pk', flat=True):
+            catalog.update_metadata(Data.objects.get(pk=data_id))
+            self.stdout.write('Data %d: updated' % data_id)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import picklefield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0003_data_source_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='data',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.CreateModel(
+            name='DataSegment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('data_frame', picklefield.fields.PickledObjectField(editable=False)),
+                ('row_count', models.PositiveIntegerField()),
+                ('data', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='data.Data')),
+            ],
+            options={
+                'ordering': ('data', 'version'),
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0004_data_segments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='data',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='samples', to='data.Data'),
+        ),
+        migrations.AddField(
+            model_name='data',
+            name='sample_spec',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
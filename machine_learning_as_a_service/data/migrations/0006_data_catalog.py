@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0005_data_samples'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='data',
+            name='byte_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='data',
+            name='column_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='data',
+            name='columns',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='data',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='data',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='data',
+            name='row_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='data',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0006_data_catalog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasegment',
+            name='first_version',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
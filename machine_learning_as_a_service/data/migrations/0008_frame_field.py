@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+import data.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0007_datasegment_first_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='data',
+            name='data_frame',
+            field=data.models.FrameField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='datasegment',
+            name='data_frame',
+            field=data.models.FrameField(editable=False),
+        ),
+    ]
@@ -1,12 +1,64 @@
 from django.db import models
-from picklefield.fields import PickledObjectField
+from picklefield.fields import PickledObjectField, dbsafe_encode
+
+
+class FrameField(PickledObjectField):
+    """
+    A `PickledObjectField` for (large) frames that can be pickled ahead of saving.
+
+    `encode()` pickles the current value and keeps the result, which the next save stores as it is,
+    so that the stored size and hash (see `data.catalog`) can be had without pickling twice.
+    The value isn't deep-copied before pickling, as frames are never looked up by value.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('copy', False)
+        super(FrameField, self).__init__(*args, **kwargs)
+
+    def get_encoded_name(self):
+        return '_encoded_%s' % self.attname
+
+    def encode(self, model_instance):
+        """
+        :return: The value as it will be stored.
+        :rtype: picklefield.fields.PickledObject
+        """
+        value = getattr(model_instance, self.attname)
+        encoded = dbsafe_encode(value, self.compress, self.protocol, self.copy)
+        setattr(model_instance, self.get_encoded_name(), (value, encoded))
+        return encoded
+
+    def pre_save(self, model_instance, add):
+        value, encoded = model_instance.__dict__.pop(self.get_encoded_name(), (None, None))
+        if encoded is not None and value is getattr(model_instance, self.attname):
+            return encoded
+        return super(FrameField, self).pre_save(model_instance, add)
+
 
 # Create your models here.
 class Data(models.Model):
-    data_frame = PickledObjectField()
+    data_frame = FrameField()
 
     source_url = models.URLField(null=True)
 
+    # Bumped by every append, so that caches (and models) can tell the contents have changed
+    version = models.PositiveIntegerField(default=1)
+
+    # For samples (see `data.sampling`): the sampled data set, and how it was sampled (as JSON,
+    # including the seed and the version sampled), so that the sample can be reproduced
+    parent = models.ForeignKey('self', null=True, blank=True, related_name='samples', on_delete=models.SET_NULL)
+    sample_spec = models.TextField(null=True, blank=True)
+
+    # Catalog metadata (see `data.catalog`), kept up to date on import and append, so that
+    # listing data sets never needs to load `data_frame` (null for entries not yet described)
+    row_count = models.PositiveIntegerField(null=True, blank=True)
+    column_count = models.PositiveIntegerField(null=True, blank=True)
+    columns = models.TextField(null=True, blank=True)  # JSON list of {"name": ..., "dtype": ...}
+    byte_size = models.BigIntegerField(null=True, blank=True)
+    content_hash = models.CharField(max_length=40, null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True, null=True)
+    updated = models.DateTimeField(auto_now=True, null=True)
+
     class Meta:
         verbose_name_plural = "data"
 
@@ -15,3 +67,26 @@ class Data(models.Model):
             return self.source_url
         else:
             return 'unknown source'
+
+
+class DataSegment(models.Model):
+    """
+    Rows appended to a `Data` entry after it was created; see `data.segments`.
+    """
+    data = models.ForeignKey(Data, related_name='segments', on_delete=models.CASCADE)
+
+    # The version of the `Data` entry this segment was added in
+    version = models.PositiveIntegerField()
+
+    # For segments merged from several (see `data.segments.compact_segments`), the version of the first one
+    first_version = models.PositiveIntegerField(blank=True, null=True)
+
+    data_frame = FrameField()
+
+    row_count = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ('data', 'version')
+
+    def __str__(self):
+        return '%s (version %d)' % (self.data, self.version)
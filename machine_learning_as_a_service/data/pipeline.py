@@ -0,0 +1,527 @@
+"""
+Lazy transformation pipelines over stored datasets.
+
+A pipeline is a DAG of nodes (filter, select, derive, aggregate, join) over `Source` nodes.
+Nothing is read until `evaluate()` is called on the final node; evaluation then walks the DAG
+top-down, passing each node the columns and row predicates its consumers need, so that:
+
+* row filters are pushed down past derivations, aggregations (when they filter on the group keys)
+  and joins (when they filter on the join keys) all the way into `storage.read_frame()`, and
+* only the columns that are actually used are read.
+
+(Only datasets shared between processes can actually be read in part; others are unpickled whole
+and cut down right after; see `data.storage`.)
+
+Final results are cached by the hash of the pipeline, and intermediate results by the hash of their
+part of the DAG together with the columns and predicates asked of them (unless
+`DATA_PIPELINE_CACHE_INTERMEDIATE` is off); whole datasets are never cached.
+
+Steps are checked when the pipeline is built, as far as the column dtypes are known from the catalog
+(see `data.catalog`): arithmetic and numeric aggregates need numeric columns, and ordering comparisons
+need values of the column's kind.
+
+Pipelines are usually built from a JSON description with `build_pipeline()`.
+"""
+import hashlib
+import json
+import operator
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.cache import caches
+
+from data import sampling, storage
+from data.storage import Predicate, apply_predicates
+
+DERIVE_OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '**': operator.pow,
+}
+
+AGGREGATE_FUNCTIONS = {'sum', 'mean', 'median', 'min', 'max', 'count', 'std', 'var', 'first', 'last', 'nunique'}
+
+JOIN_TYPES = {'inner', 'left', 'right', 'outer'}
+
+# Aggregate functions that only work on numbers
+NUMERIC_AGGREGATE_FUNCTIONS = {'sum', 'mean', 'median', 'std', 'var'}
+
+ORDERING_OPERATORS = {'<', '<=', '>', '>='}
+
+NUMERIC_KINDS = {'number', 'bool'}
+
+
+class PipelineError(ValueError):
+    pass
+
+
+def get_pipeline_cache():
+    alias = getattr(settings, 'DATA_PIPELINE_CACHE', None)
+    return (caches[alias] if alias else None)
+
+
+def hash_key(key):
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def is_number(value):
+    return isinstance(value, (int, float))
+
+
+def check_columns(node, columns, purpose):
+    missing = set(columns) - set(node.get_columns())
+    if missing:
+        raise PipelineError('Cannot %s %s, which the input does not have' % (purpose, ', '.join(sorted(missing))))
+
+
+def check_predicate(node, predicate):
+    """
+    :raises PipelineError: if `predicate` can't be evaluated on the output of `node`
+    """
+    check_columns(node, predicate.columns, 'filter on')
+    if predicate.operator not in ORDERING_OPERATORS:
+        return
+    kind = node.get_kinds().get(predicate.column)
+    value = predicate.value
+    if value is None or isinstance(value, (list, dict)):
+        raise PipelineError('Cannot compare %s with %r' % (predicate.column, value))
+    if (
+        (kind in NUMERIC_KINDS and not is_number(value)) or
+        (kind in ('string', 'datetime') and not isinstance(value, str)) or
+        kind == 'category'
+    ):
+        raise PipelineError('Cannot compare %s (%s) with %r using %s' % (predicate.column, kind, value, predicate.operator))
+
+
+class Node:
+    inputs = ()
+    cache_result = True
+
+    def get_key(self):
+        """
+        Get a JSON-serializable description of this node and its inputs, for hashing.
+        """
+        raise NotImplementedError('Subclasses must implement this')  # pragma: no cover
+
+    def get_columns(self):
+        """
+        Get the names of the columns this node produces, without evaluating anything.
+
+        :rtype: list[str]
+        """
+        raise NotImplementedError('Subclasses must implement this')  # pragma: no cover
+
+    def get_kinds(self):
+        """
+        Get the kinds (see `storage.get_kind()`) of the columns this node produces, as far as they are known,
+        without evaluating anything.
+
+        :rtype: dict[str, str|None]
+        """
+        return {}
+
+    def compute(self, columns, predicates):
+        """
+        Compute this node's result.
+
+        :param columns: The columns needed by the consumer (None for all). Others may be returned too.
+        :type columns: set[str]|None
+        :param predicates: Row filters that the result must satisfy.
+        :type predicates: list[Predicate]
+        :rtype: pandas.DataFrame
+        """
+        raise NotImplementedError('Subclasses must implement this')  # pragma: no cover
+
+    def evaluate(self, columns=None, predicates=()):
+        """
+        Evaluate this node (and whatever it depends on), or get the result from the cache.
+
+        :rtype: pandas.DataFrame
+        """
+        columns = (set(columns) if columns is not None else None)
+        predicates = list(predicates)
+        cache = (get_pipeline_cache() if self.cache_result else None)
+        if not (cache and getattr(settings, 'DATA_PIPELINE_CACHE_INTERMEDIATE', True)):
+            return self.compute(columns, predicates)
+        cache_key = 'data-pipeline-part:%s' % hash_key([
+            self.get_key(),
+            (sorted(columns) if columns is not None else None),
+            sorted((predicate.get_key() for predicate in predicates), key=hash_key),
+        ])
+        frame = cache.get(cache_key)
+        if frame is None:
+            frame = self.compute(columns, predicates)
+            cache.set(cache_key, frame, timeout=getattr(settings, 'DATA_PIPELINE_CACHE_TIMEOUT', 600))
+        return frame
+
+    def get_result(self):
+        """
+        Evaluate the pipeline and return the final frame with exactly the columns this node produces.
+
+        The result is cached (if `DATA_PIPELINE_CACHE` is set) by the hash of the pipeline.
+        """
+        columns = self.get_columns()
+        cache = (get_pipeline_cache() if self.cache_result else None)
+        if cache:
+            cache_key = 'data-pipeline:%s' % hash_key(self.get_key())
+            frame = cache.get(cache_key)
+            if frame is not None:
+                return frame
+        frame = self.compute(set(columns), [])[columns]  # Not `evaluate()`, which would cache it twice
+        if cache:
+            cache.set(cache_key, frame, timeout=getattr(settings, 'DATA_PIPELINE_CACHE_TIMEOUT', 600))
+        return frame
+
+
+def add_predicate_columns(columns, predicates):
+    if columns is None:
+        return None
+    columns = set(columns)
+    for predicate in predicates:
+        columns |= predicate.columns
+    return columns
+
+
+class Source(Node):
+    cache_result = False  # Caching a whole dataset would only copy it
+
+    def __init__(self, data):
+        """
+        :type data: data.models.Data
+        """
+        self.data = data
+
+    def get_key(self):
+        return ['source', self.data.pk, self.data.version]
+
+    def get_columns(self):
+        return storage.get_columns(self.data)
+
+    def get_kinds(self):
+        return {name: storage.get_kind(dtype) for (name, dtype) in storage.get_column_dtypes(self.data).items()}
+
+    def compute(self, columns, predicates):
+        return storage.read_frame(
+            self.data,
+            columns=add_predicate_columns(columns, predicates),
+            predicates=predicates,
+        )
+
+
+class SampledSource(Source):
+    """
+    A sample of a stored dataset (see `data.sampling`), for fast previews.
+
+    Pushed-down predicates are applied to the sample, so the result is the same as filtering the sample.
+    """
+
+    cache_result = True
+
+    def __init__(self, data, spec):
+        """
+        :type data: data.models.Data
+        :type spec: data.sampling.SampleSpec
+        """
+        super(SampledSource, self).__init__(data)
+        self.spec = spec
+
+    def get_key(self):
+        return super(SampledSource, self).get_key() + [self.spec.get_key()]
+
+    def compute(self, columns, predicates):
+        frame = sampling.sample_data(self.data, self.spec, columns=add_predicate_columns(columns, predicates))
+        return apply_predicates(frame, predicates)
+
+
+class Filter(Node):
+    def __init__(self, input, predicate):
+        check_predicate(input, predicate)
+        self.input = input
+        self.inputs = (input,)
+        self.predicate = predicate
+
+    def get_key(self):
+        return ['filter', self.input.get_key(), self.predicate.get_key()]
+
+    def get_columns(self):
+        return self.input.get_columns()
+
+    def get_kinds(self):
+        return self.input.get_kinds()
+
+    def compute(self, columns, predicates):
+        # Filters are commutative, so this one simply joins the ones being pushed down.
+        predicates = predicates + [self.predicate]
+        return self.input.evaluate(add_predicate_columns(columns, predicates), predicates)
+
+
+class Select(Node):
+    def __init__(self, input, columns):
+        check_columns(input, columns, 'select')
+        self.input = input
+        self.inputs = (input,)
+        self.columns = list(columns)
+
+    def get_key(self):
+        return ['select', self.input.get_key(), self.columns]
+
+    def get_columns(self):
+        return self.columns
+
+    def get_kinds(self):
+        kinds = self.input.get_kinds()
+        return {column: kinds.get(column) for column in self.columns}
+
+    def compute(self, columns, predicates):
+        needed = set(self.columns)
+        if columns is not None:
+            needed &= columns
+        frame = self.input.evaluate(add_predicate_columns(needed, predicates), predicates)
+        return frame[[column for column in self.columns if column in needed]]
+
+
+class Derive(Node):
+    def __init__(self, input, column, left, operator, right):
+        """
+        Add `column` computed as `left <operator> right`.
+
+        Operands are either column names or `{"value": constant}` dicts.
+        """
+        if operator not in DERIVE_OPERATORS:
+            raise PipelineError('Unknown operator %r (known operators are %s)' % (
+                operator,
+                ', '.join(sorted(DERIVE_OPERATORS)),
+            ))
+        kinds = input.get_kinds()
+        for operand in (left, right):
+            if isinstance(operand, dict):
+                if not is_number(operand['value']):
+                    raise PipelineError('Cannot compute with %r, which is not a number' % (operand['value'],))
+                continue
+            check_columns(input, [operand], 'compute with')
+            if kinds.get(operand) not in NUMERIC_KINDS | {None}:
+                raise PipelineError('Cannot compute with %s, which is not numeric (%s)' % (operand, kinds[operand]))
+        self.input = input
+        self.inputs = (input,)
+        self.column = column
+        self.left = left
+        self.operator = operator
+        self.right = right
+
+    @property
+    def operand_columns(self):
+        return {operand for operand in (self.left, self.right) if not isinstance(operand, dict)}
+
+    def get_key(self):
+        return ['derive', self.input.get_key(), self.column, self.left, self.operator, self.right]
+
+    def get_columns(self):
+        return [column for column in self.input.get_columns() if column != self.column] + [self.column]
+
+    def get_kinds(self):
+        return dict(self.input.get_kinds(), **{self.column: 'number'})
+
+    def get_operand(self, frame, operand):
+        if isinstance(operand, dict):
+            return operand['value']
+        return widen(frame[operand])
+
+    def compute(self, columns, predicates):
+        # Predicates on the derived column must wait until it's there; the rest go down.
+        held = [predicate for predicate in predicates if self.column in predicate.columns]
+        pushed = [predicate for predicate in predicates if self.column not in predicate.columns]
+        needed = None
+        if columns is not None:
+            needed = (columns - {self.column}) | self.operand_columns
+        frame = self.input.evaluate(add_predicate_columns(needed, pushed), pushed)
+        frame = frame.assign(**{self.column: DERIVE_OPERATORS[self.operator](
+            self.get_operand(frame, self.left),
+            self.get_operand(frame, self.right),
+        )})
+        return apply_predicates(frame, held)
+
+
+class Aggregate(Node):
+    def __init__(self, input, by, aggregations):
+        """
+        :param by: Columns to group by.
+        :param aggregations: List of `{"column": ..., "function": ..., "as": ...}` dicts
+                             (`as` defaults to `<column>_<function>`).
+        """
+        if not by:
+            raise PipelineError('Aggregating needs at least one column to group by')
+        if not aggregations:
+            raise PipelineError('Aggregating needs at least one aggregation')
+        check_columns(input, by, 'group by')
+        kinds = input.get_kinds()
+        for aggregation in aggregations:
+            if aggregation['function'] not in AGGREGATE_FUNCTIONS:
+                raise PipelineError('Unknown aggregate function %r (known functions are %s)' % (
+                    aggregation['function'],
+                    ', '.join(sorted(AGGREGATE_FUNCTIONS)),
+                ))
+            check_columns(input, [aggregation['column']], 'aggregate')
+            kind = kinds.get(aggregation['column'])
+            if aggregation['function'] in NUMERIC_AGGREGATE_FUNCTIONS and kind not in NUMERIC_KINDS | {None}:
+                raise PipelineError('Cannot take the %s of %s, which is not numeric (%s)' % (
+                    aggregation['function'],
+                    aggregation['column'],
+                    kind,
+                ))
+        self.input = input
+        self.inputs = (input,)
+        self.by = list(by)
+        self.aggregations = [
+            dict(aggregation, **{'as': aggregation.get('as') or '%s_%s' % (aggregation['column'], aggregation['function'])})
+            for aggregation in aggregations
+        ]
+
+    def get_key(self):
+        return ['aggregate', self.input.get_key(), self.by, self.aggregations]
+
+    def get_columns(self):
+        return self.by + [aggregation['as'] for aggregation in self.aggregations]
+
+    def get_kinds(self):
+        input_kinds = self.input.get_kinds()
+        kinds = {column: input_kinds.get(column) for column in self.by}
+        for aggregation in self.aggregations:
+            if aggregation['function'] in NUMERIC_AGGREGATE_FUNCTIONS | {'count', 'nunique'}:
+                kinds[aggregation['as']] = 'number'
+            else:
+                kinds[aggregation['as']] = input_kinds.get(aggregation['column'])
+        return kinds
+
+    def compute(self, columns, predicates):
+        # Filtering on group keys before or after grouping is the same thing; on aggregates it's not.
+        pushed = [predicate for predicate in predicates if predicate.columns <= set(self.by)]
+        held = [predicate for predicate in predicates if not (predicate.columns <= set(self.by))]
+        needed = set(self.by) | {aggregation['column'] for aggregation in self.aggregations}
+        frame = self.input.evaluate(needed, pushed)
+        grouped = frame.groupby(self.by)
+        frame = pd.concat([
+            grouped[aggregation['column']].agg(aggregation['function']).rename(aggregation['as'])
+            for aggregation in self.aggregations
+        ], axis=1).reset_index()
+        return apply_predicates(frame, held)
+
+
+class Join(Node):
+    def __init__(self, left, right, on, how='inner'):
+        if how not in JOIN_TYPES:
+            raise PipelineError('Unknown join type %r (known types are %s)' % (how, ', '.join(sorted(JOIN_TYPES))))
+        check_columns(left, on, 'join on')
+        check_columns(right, on, 'join on')
+        self.left = left
+        self.right = right
+        self.inputs = (left, right)
+        self.on = list(on)
+        self.how = how
+
+    def get_key(self):
+        return ['join', self.left.get_key(), self.right.get_key(), self.on, self.how]
+
+    def get_columns(self):
+        left_columns = self.left.get_columns()
+        right_columns = self.right.get_columns()
+        overlap = (set(left_columns) & set(right_columns)) - set(self.on)
+        if overlap:
+            raise PipelineError('Columns %s exist on both sides of the join; select or rename them first' % (
+                ', '.join(sorted(overlap)),
+            ))
+        return left_columns + [column for column in right_columns if column not in self.on]
+
+    def get_kinds(self):
+        return dict(self.right.get_kinds(), **self.left.get_kinds())
+
+    def compute(self, columns, predicates):
+        # Predicates on the join keys hold on both sides for every join type; others must wait.
+        pushed = [predicate for predicate in predicates if predicate.columns <= set(self.on)]
+        held = [predicate for predicate in predicates if not (predicate.columns <= set(self.on))]
+        needed = add_predicate_columns(columns, held)
+        sides = []
+        for side in (self.left, self.right):
+            side_needed = None
+            if needed is not None:
+                side_needed = (needed & set(side.get_columns())) | set(self.on)
+            sides.append(side.evaluate(side_needed, pushed))
+        frame = pd.merge(sides[0], sides[1], on=self.on, how=self.how)
+        return apply_predicates(frame, held)
+
+
+def widen(series):
+    """
+    Widen a (possibly compacted, see `data.compaction`) numeric column to 64 bits,
+    so that arithmetic on it doesn't overflow or wrap around in the narrow dtype.
+    """
+    dtype = series.dtype
+    if not isinstance(dtype, np.dtype):
+        return series
+    if dtype.kind == 'i' or (dtype.kind == 'u' and dtype.itemsize < 8):
+        return series.astype(np.int64)
+    if dtype.kind == 'u':
+        return series.astype(np.float64)
+    if dtype.kind == 'f' and dtype.itemsize < 8:
+        return series.astype(np.float64)
+    return series
+
+
+def build_operand(step, name):
+    operand = step[name]
+    if isinstance(operand, dict) and 'value' not in operand:
+        raise PipelineError('Operand %s must be a column name or a {"value": ...} object' % name)
+    return operand
+
+
+def build_pipeline(source, steps, get_source):
+    """
+    Build a pipeline from a JSON description.
+
+    Each step is a dict with an `op` key:
+
+    * `{"op": "filter", "column": c, "operator": "==", "value": v}`
+    * `{"op": "select", "columns": [c, ...]}`
+    * `{"op": "derive", "column": c, "left": operand, "operator": "+", "right": operand}`
+      (operands are column names or `{"value": constant}`)
+    * `{"op": "aggregate", "by": [c, ...], "aggregations": [{"column": c, "function": "sum", "as": name}, ...]}`
+    * `{"op": "join", "data_id": id, "steps": [...], "on": [c, ...], "how": "inner"}`
+      (`steps` is an optional pipeline applied to the other dataset before joining)
+
+    :param source: The node to start from.
+    :type source: Node
+    :param steps: Step descriptions.
+    :type steps: list[dict]
+    :param get_source: Function returning a source Node for a data ID (for joins).
+    :rtype: Node
+    """
+    node = source
+    for index, step in enumerate(steps):
+        try:
+            op = step['op']
+            if op == 'filter':
+                node = Filter(node, Predicate(step['column'], step['operator'], step.get('value')))
+            elif op == 'select':
+                node = Select(node, step['columns'])
+            elif op == 'derive':
+                node = Derive(
+                    node,
+                    column=step['column'],
+                    left=build_operand(step, 'left'),
+                    operator=step['operator'],
+                    right=build_operand(step, 'right'),
+                )
+            elif op == 'aggregate':
+                node = Aggregate(node, by=step['by'], aggregations=step['aggregations'])
+            elif op == 'join':
+                other = build_pipeline(get_source(step['data_id']), step.get('steps', ()), get_source)
+                node = Join(node, other, on=step['on'], how=step.get('how', 'inner'))
+            else:
+                raise PipelineError('Unknown op %r' % op)
+        except KeyError as ke:
+            raise PipelineError('Step %d: missing %s' % (index, ke)) from ke
+        except (ValueError, TypeError) as exc:
+            raise PipelineError('Step %d: %s' % (index, exc)) from exc
+    return node
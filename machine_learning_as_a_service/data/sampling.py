@@ -0,0 +1,172 @@
+"""
+Sampling stored datasets.
+
+All sampling methods make a single pass over the dataset in chunks (see `storage.iterate_frames()`),
+holding no more than the sample and one chunk in memory at a time.  Every row is given a random key
+(drawn in row order from a generator seeded with the sample's seed, so the same seed gives the same
+sample of the same data), and:
+
+* `uniform` sampling keeps the `size` rows with the smallest keys (a reservoir sample),
+* `stratified` sampling keeps the `size` rows with the smallest keys for every distinct value of `column`,
+* `time` sampling does the same for every `bucket` of the time (or numeric) `column`,
+  e.g. `1H` or `1D` for datetimes, or a bucket width for numbers.
+
+With a `fraction`, only rows whose key is below it (i.e. that fraction of rows, on average) are
+considered in the first place, so a fraction without a size gives a Bernoulli sample.
+
+Samples can be stored as `Data` entries of their own with `save_sample()`.
+"""
+import json
+import random
+
+import numpy as np
+import pandas as pd
+
+from data import catalog, compaction, segments, sparse, storage
+from data.models import Data
+
+METHODS = ('uniform', 'stratified', 'time')
+
+KEY_COLUMN = '__sample_key'
+
+
+class SampleSpec:
+    def __init__(self, method='uniform', size=None, fraction=None, column=None, bucket=None, seed=None):
+        """
+        :param size: Number of rows to keep (per stratum or bucket, if sampling by column).
+        :type size: int|None
+        :param fraction: Fraction of rows to keep.
+        :type fraction: float|None
+        :param column: Column to stratify by, or time column to bucket by.
+        :param bucket: Bucket size: a pandas frequency string for datetime columns, a number for numeric ones.
+        :param seed: Random seed; one is picked (and can be read back) if not given.
+        :raises ValueError: on invalid combinations
+        """
+        if method not in METHODS:
+            raise ValueError('Unknown method %r (known methods are %s)' % (method, ', '.join(METHODS)))
+        if size is None and fraction is None:
+            raise ValueError('At least one of size and fraction is required')
+        if size is not None and size < 0:
+            raise ValueError('Size must not be negative')
+        if fraction is not None and not (0 <= fraction <= 1):
+            raise ValueError('Fraction must be between 0 and 1')
+        if method != 'uniform' and not column:
+            raise ValueError('The %s method requires a column' % method)
+        if method == 'time' and not bucket:
+            raise ValueError('The time method requires a bucket')
+        self.method = method
+        self.size = size
+        self.fraction = fraction
+        self.column = (column if method != 'uniform' else None)
+        self.bucket = (bucket if method == 'time' else None)
+        self.seed = (seed if seed is not None else random.randrange(2 ** 31))
+
+    @property
+    def columns(self):
+        return ({self.column} if self.column else set())
+
+    def to_dict(self):
+        return {
+            'method': self.method,
+            'size': self.size,
+            'fraction': self.fraction,
+            'column': self.column,
+            'bucket': self.bucket,
+            'seed': self.seed,
+        }
+
+    def get_key(self):
+        return ['sample', self.method, self.size, self.fraction, self.column, self.bucket, self.seed]
+
+
+def get_strata(frame, spec):
+    values = frame[spec.column]
+    if spec.method == 'stratified':
+        return values
+    if isinstance(values.dtype, np.dtype) and values.dtype.kind in 'iuf':
+        return values // float(spec.bucket)
+    return pd.to_datetime(values).dt.floor(spec.bucket)
+
+
+def trim(frame, spec):
+    """
+    Keep the rows of `frame` with the smallest keys (overall, or per stratum).
+    """
+    if spec.size is None or len(frame) <= spec.size:
+        return frame
+    if spec.method == 'uniform':
+        return frame.iloc[np.argsort(frame[KEY_COLUMN].values, kind='mergesort')[:spec.size]]
+    frame = frame.iloc[np.argsort(frame[KEY_COLUMN].values, kind='mergesort')]
+    ranks = frame.groupby(get_strata(frame, spec).values, sort=False).cumcount().values
+    return frame[ranks < spec.size]
+
+
+def sample_frames(frames, spec):
+    """
+    Sample consecutive chunks of a dataset in one pass.
+
+    :type frames: Iterable[pandas.DataFrame]
+    :type spec: SampleSpec
+    :rtype: pandas.DataFrame
+    """
+    rng = np.random.RandomState(spec.seed)
+    sample = None
+    for frame in frames:
+        keys = rng.random_sample(len(frame))
+        if spec.fraction is not None:
+            frame = frame[keys < spec.fraction]
+            keys = keys[keys < spec.fraction]
+        frame = frame.copy(deep=False)
+        frame[KEY_COLUMN] = keys
+        if sample is not None:
+            frame = segments.concat_frames([sample, frame], ignore_index=False)
+        sample = trim(frame, spec)
+    if sample is None:
+        return pd.DataFrame()
+    return sample.sort_index().drop(KEY_COLUMN, axis=1)
+
+
+def sample_data(data, spec, columns=None):
+    """
+    Sample a stored dataset.
+
+    :type data: data.models.Data
+    :type spec: SampleSpec
+    :param columns: Columns to return (None for all); the row selection doesn't depend on them.
+    :raises ValueError: if the column to sample by doesn't exist
+    :rtype: pandas.DataFrame
+    """
+    if spec.column and spec.column not in storage.get_columns(data):
+        raise ValueError('Unknown column %r' % spec.column)
+    read_columns = (set(columns) | spec.columns if columns is not None else None)
+    sample = sample_frames(storage.iterate_frames(data, columns=read_columns), spec)
+    if columns is not None:
+        sample = sample[[column for column in sample.columns if column in set(columns)]]
+    return sample
+
+
+def save_sample(data, spec, frame, compact=True):
+    """
+    Store a sample of a dataset as a new `Data` entry linked to it, recording how it was sampled.
+
+    The sample is stored sparse if it is sparse enough (see `data.sparse.should_be_sparse`).
+
+    :type data: data.models.Data
+    :type spec: SampleSpec
+    :param frame: The sample, with all columns (see `sample_data()`).
+    :type frame: pandas.DataFrame
+    :rtype: data.models.Data
+    """
+    stored = frame.reset_index(drop=True)
+    if sparse.should_be_sparse(stored):
+        stored = sparse.from_frame(stored)
+    if compact:
+        stored = compaction.compact(stored)[0]
+    sample = Data(
+        data_frame=stored,
+        parent_id=data.pk,
+        sample_spec=json.dumps(dict(spec.to_dict(), version=data.version), sort_keys=True),
+    )
+    catalog.set_metadata(sample)
+    sample.save()
+    return sample
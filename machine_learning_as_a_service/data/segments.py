@@ -0,0 +1,286 @@
+"""
+Appending rows to stored datasets.
+
+The `data_frame` of a `Data` entry is never rewritten once stored: rows appended later are stored
+as `DataSegment`s, each of which bumps `Data.version`, so an append costs O(new rows) however long
+the history is.  `data.storage` reads the stored frame and its segments, in order, as one dataset.
+
+A `Data` instance only ever sees the segments up to its own `version`, so rows appended after it
+was read never show up under its (old) version in the caches keyed by it.
+
+As many small segments slow reading down, runs of consecutive small segments are merged by
+`compact_segments()`; this happens in a background thread once enough of them pile up
+(see `schedule_compaction()`), or with `manage.py compact_data_segments`.
+"""
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+
+from data import catalog, compaction, sparse
+from data.models import Data, DataSegment
+
+log = logging.getLogger(__name__)
+
+
+
+class StaleVersion(Exception):
+    """
+    The segments of a dataset's version have since been merged with later ones, so the version
+    can no longer be read; read the `Data` entry again to get its current version.
+    """
+
+
+_compacting = set()
+_compacting_lock = threading.Lock()
+
+
+def get_compaction_options():
+    return {
+        'max_rows': getattr(settings, 'DATA_SEGMENT_COMPACT_MAX_ROWS', 100000),
+        'min_segments': getattr(settings, 'DATA_SEGMENT_COMPACT_MIN_SEGMENTS', 8),
+    }
+
+
+def is_categorical(series):
+    return str(series.dtype) == 'category'
+
+
+def concat_frames(frames, ignore_index=True):
+    """
+    Concatenate frames row-wise, renumbering the rows unless `ignore_index` is off.
+
+    Columns that are categorical in every frame stay categorical (with the union of the categories).
+    """
+    frames = list(frames)
+    for name in frames[0].columns:
+        if not all(is_categorical(frame[name]) for frame in frames):
+            continue
+        categories = []
+        seen = set()
+        for frame in frames:
+            for category in frame[name].cat.categories:
+                if category not in seen:
+                    seen.add(category)
+                    categories.append(category)
+        for index, frame in enumerate(frames):
+            frame = frame.copy(deep=False)
+            frame[name] = frame[name].cat.set_categories(categories)
+            frames[index] = frame
+    return pd.concat(frames, ignore_index=ignore_index)
+
+
+def combine(pieces):
+    """
+    Combine consecutive pieces of a dataset into one.
+
+    :param pieces: All `pandas.DataFrame`s or all `data.sparse.SparseFrame`s, in order.
+    :rtype: pandas.DataFrame|data.sparse.SparseFrame
+    """
+    pieces = list(pieces)
+    if len(pieces) == 1:
+        return pieces[0]
+    first = pieces[0]
+    if isinstance(first, sparse.SparseFrame):
+        return sparse.SparseFrame(
+            scipy.sparse.vstack([piece.matrix for piece in pieces], format='csr'),
+            feature_names=first.feature_names,
+            target=(np.concatenate([piece.target for piece in pieces]) if first.target is not None else None),
+            target_name=first.target_name,
+        )
+    return concat_frames(pieces)
+
+
+def get_segments(data):
+    """
+    Get the segments of a dataset, in order.
+
+    Only the segments up to `data.version` are returned, even if more have been appended since.
+
+    The segments to read are listed up front, in a single query, and then loaded one at a time.
+
+    :type data: data.models.Data
+    :raises StaleVersion: if the segments of `data.version` have been merged with later ones,
+                          even while they were being read
+    :rtype: Iterable[data.models.DataSegment]
+    """
+    if data.version == 1:  # Never appended to, so no need to ask
+        return []
+    listed = DataSegment.objects.filter(
+        Q(version__lte=data.version) | Q(first_version__lte=data.version),
+        data_id=data.pk,
+    ).order_by('version').values_list('pk', 'version')
+    listed = list(listed)
+    if any(version > data.version for (pk, version) in listed):
+        raise StaleVersion('Version %d of data %d has been compacted away' % (data.version, data.pk))
+    return _load_segments(data, [pk for (pk, version) in listed])
+
+
+def _load_segments(data, pks):
+    for pk in pks:
+        segment = DataSegment.objects.filter(pk=pk).first()
+        if segment is None:  # Merged by a compaction since it was listed
+            raise StaleVersion('Version %d of data %d was compacted away while being read' % (data.version, data.pk))
+        yield segment
+
+
+def get_template(data):
+    """
+    Get a stored piece of the dataset to conform appended rows to: the last segment, or the stored frame.
+
+    (Only the very first append reads the whole stored frame.)
+    """
+    segment = DataSegment.objects.filter(data_id=data.pk).order_by('-version').only('data_frame').first()
+    if segment:
+        return segment.data_frame
+    return Data.objects.only('data_frame').get(pk=data.pk).data_frame
+
+
+def conform(template, frame, compact=True, category_threshold=None):
+    """
+    Bring appended rows into the same shape as the stored ones.
+
+    :type template: pandas.DataFrame|data.sparse.SparseFrame
+    :type frame: pandas.DataFrame
+    :raises ValueError: if the columns don't match
+    :rtype: pandas.DataFrame|data.sparse.SparseFrame
+    """
+    columns = list(template.columns)
+    if set(frame.columns) != set(columns):
+        raise ValueError('The rows must have exactly the columns %s (got %s)' % (
+            ', '.join(str(column) for column in columns),
+            ', '.join(str(column) for column in frame.columns),
+        ))
+    frame = frame[columns].copy()
+
+    if isinstance(template, sparse.SparseFrame):
+        features = frame[list(template.feature_names)]
+        if not sparse.is_sparsifiable(features):
+            raise ValueError('Only numeric data can be appended to a sparse dataset')
+        stored = sparse.SparseFrame(
+            sparse.to_matrix(features),
+            feature_names=template.feature_names,
+            target=(frame[template.target_name].values if template.target is not None else None),
+            target_name=template.target_name,
+        )
+        if compact:
+            stored = compaction.compact_sparse_frame(stored)[0]
+        return stored
+
+    if compact:
+        frame = compaction.compact_frame(frame, category_threshold=category_threshold)[0]
+    # Keep categoricals categorical (and nothing else), so that the pieces concatenate cleanly
+    for name in columns:
+        if is_categorical(template[name]) and not is_categorical(frame[name]):
+            frame[name] = frame[name].astype('category')
+        elif is_categorical(frame[name]) and not is_categorical(template[name]):
+            frame[name] = frame[name].astype(template[name].dtype)
+    return frame
+
+
+def append_rows(data, frame, compact=True, category_threshold=None):
+    """
+    Append rows to a dataset as a new segment, bumping its version.
+
+    :type data: data.models.Data
+    :type frame: pandas.DataFrame
+    :raises ValueError: if the rows don't fit the dataset
+    :rtype: data.models.DataSegment
+    """
+    stored = conform(get_template(data), frame, compact=compact, category_threshold=category_threshold)
+    with transaction.atomic():
+        Data.objects.filter(pk=data.pk).update(version=F('version') + 1)
+        version = Data.objects.filter(pk=data.pk).values_list('version', flat=True).get()
+        segment = DataSegment(data_id=data.pk, version=version, data_frame=stored, row_count=len(stored))
+        encoded = catalog.encode(segment)  # Pickled once, for saving and for the catalog
+        segment.save()
+        catalog.record_append(segment, encoded)
+    data.version = version
+    schedule_compaction(data.pk)
+    return segment
+
+
+def compact_segments(data_id, max_rows=None, min_segments=None):
+    """
+    Merge runs of consecutive small segments of a dataset.
+
+    The dataset's contents (and version) stay the same.
+
+    :param max_rows: Segments with fewer rows are small.
+    :param min_segments: Do nothing unless there are at least this many small segments.
+    :return: The number of segments merged away.
+    :rtype: int
+    """
+    options = get_compaction_options()
+    max_rows = (options['max_rows'] if max_rows is None else max_rows)
+    min_segments = (options['min_segments'] if min_segments is None else min_segments)
+    with transaction.atomic():
+        # Lock the dataset so that only one compaction of it runs at a time
+        list(Data.objects.select_for_update().filter(pk=data_id).values_list('pk', flat=True))
+        segments = list(DataSegment.objects.filter(data_id=data_id).defer('data_frame').order_by('version'))
+        if sum(segment.row_count < max_rows for segment in segments) < min_segments:
+            return 0
+
+        runs = [[]]
+        for segment in segments:
+            if segment.row_count < max_rows:
+                runs[-1].append(segment)
+            elif runs[-1]:
+                runs.append([])
+
+        merged = 0
+        for run in runs:
+            if len(run) < 2:
+                continue
+            pieces = DataSegment.objects.filter(pk__in=[segment.pk for segment in run]).order_by('version')
+            DataSegment.objects.create(
+                data_id=data_id,
+                version=run[-1].version,
+                first_version=(run[0].first_version or run[0].version),
+                data_frame=combine(piece.data_frame for piece in pieces.iterator()),
+                row_count=sum(segment.row_count for segment in run),
+            )
+            DataSegment.objects.filter(pk__in=[segment.pk for segment in run]).delete()
+            merged += len(run) - 1
+    return merged
+
+
+def schedule_compaction(data_id):
+    """
+    Compact the segments of a dataset in a background thread, if there are enough small ones.
+
+    Disabled by setting `DATA_SEGMENT_COMPACT_IN_BACKGROUND` to False.
+    """
+    if not getattr(settings, 'DATA_SEGMENT_COMPACT_IN_BACKGROUND', True):
+        return
+    options = get_compaction_options()
+    small_segments = DataSegment.objects.filter(data_id=data_id, row_count__lt=options['max_rows']).count()
+    if small_segments < options['min_segments']:
+        return
+    with _compacting_lock:
+        if data_id in _compacting:
+            return
+        _compacting.add(data_id)
+    thread = threading.Thread(
+        target=_compact_in_background,
+        args=(data_id,),
+        name='compact-data-%d' % data_id,
+        daemon=True,
+    )
+    thread.start()
+
+
+def _compact_in_background(data_id):
+    try:
+        compact_segments(data_id)
+    except Exception:
+        log.exception('Compacting the segments of data %d failed', data_id)
+    finally:
+        with _compacting_lock:
+            _compacting.discard(data_id)
+        connection.close()
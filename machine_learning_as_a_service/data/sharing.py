@@ -0,0 +1,435 @@
+"""
+Sharing loaded datasets between worker processes.
+
+The first process to read a dataset publishes it into `DATA_SHARED_CACHE_DIR`: every column with a
+plain numeric (or datetime) dtype becomes its own `.npy` file, the remaining columns are pickled together.
+Sparse datasets (see `data.sparse`) are published as the three arrays of their CSR matrix (plus the target).
+Every process (including the first) then memory-maps the column files read-only, so the OS keeps
+a single copy of the numeric data in memory no matter how many workers use it.
+Point the setting at a tmpfs (such as a directory in `/dev/shm`) to keep the files in RAM.
+
+A small registry (`registry.json`, guarded by a file lock) tracks which processes have each
+dataset attached; `cleanup()` (also run by `manage.py cleanup_shared_data`) deletes datasets that
+no live process has attached and that haven't been used for a while.  Publishing a dataset also
+cleans up, deleting earlier versions of it and idle datasets.
+
+Locks are only ever nested in one order: a dataset's `<key>.lock` first, then `registry.lock`.
+
+The directory must only be writable by trusted users, as the non-numeric columns are pickled.
+"""
+import atexit
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from django.conf import settings
+
+from data import sparse, storage
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+MANIFEST_NAME = 'manifest.json'
+SPARSE_ARRAY_NAMES = ('data', 'indices', 'indptr', 'target')
+OBJECTS_NAME = 'objects.pickle'
+REGISTRY_NAME = 'registry.json'
+
+# Datasets attached by this process, by key, least recently used first (guarded by `_attached_lock`,
+# as threads such as those of parallel batch requests share it)
+_attached = OrderedDict()
+_attached_lock = threading.RLock()
+
+
+def get_shared_cache_dir():
+    if fcntl is None:
+        return None
+    return getattr(settings, 'DATA_SHARED_CACHE_DIR', None)
+
+
+def get_dataset_key(data):
+    return 'data-%d-%d' % (data.pk, data.version)
+
+
+def is_shareable(series):
+    return isinstance(series.dtype, np.dtype) and series.dtype.kind in 'biufcmM'
+
+
+@contextmanager
+def locked(lock_filename):
+    """
+    Hold an exclusive lock on `lock_filename`.
+
+    The lock file may be deleted (with `remove_lock()`) while the lock is held; processes waiting
+    for the lock then find that the file they locked is no longer there, and lock a new one.
+    """
+    while True:
+        lock_file = open(lock_filename, 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock_filename)):
+                break
+        except FileNotFoundError:
+            pass
+        lock_file.close()  # Also releases the lock
+    try:
+        yield
+    finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+
+def remove_lock(lock_filename):
+    """
+    Delete a lock file; must be called while holding the lock (see `locked()`).
+    """
+    try:
+        os.unlink(lock_filename)
+    except FileNotFoundError:
+        pass
+
+
+def get_lock_filename(cache_dir, key):
+    return os.path.join(cache_dir, '%s.lock' % key)
+
+
+class SharedDataset:
+    """
+    A published dataset, attached (memory-mapped) in this process.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_NAME)) as infp:
+            self.manifest = json.load(infp)
+        self.columns = [column['name'] for column in self.manifest['columns']]
+        self.length = self.manifest['length']
+        self._arrays = {}
+        self._objects = None
+        self._sparse_frame = None
+
+    @property
+    def is_sparse(self):
+        return 'sparse' in self.manifest
+
+    def get_sparse_frame(self):
+        """
+        Get a sparse dataset as a `SparseFrame` over the memory-mapped arrays.
+
+        :rtype: data.sparse.SparseFrame
+        """
+        if self._sparse_frame is None:
+            info = self.manifest['sparse']
+            arrays = {
+                name: np.load(os.path.join(self.directory, info['files'][name]), mmap_mode='r')
+                for name in SPARSE_ARRAY_NAMES
+                if info['files'].get(name)
+            }
+            matrix = scipy.sparse.csr_matrix(
+                (arrays['data'], arrays['indices'], arrays['indptr']),
+                shape=tuple(info['shape']),
+                copy=False,
+            )
+            self._sparse_frame = sparse.SparseFrame(
+                matrix,
+                feature_names=info['feature_names'],
+                target=arrays.get('target'),
+                target_name=info['target_name'],
+            )
+        return self._sparse_frame
+
+    def get_array(self, name):
+        """
+        Get a read-only, memory-mapped view of a shared column.
+
+        :rtype: numpy.ndarray
+        """
+        if name not in self._arrays:
+            column = next(column for column in self.manifest['columns'] if column['name'] == name)
+            self._arrays[name] = np.load(os.path.join(self.directory, column['file']), mmap_mode='r')
+        return self._arrays[name]
+
+    @property
+    def arrays(self):
+        """
+        Read-only views of all the shared (numeric) columns, by name.
+
+        :rtype: dict[str, numpy.ndarray]
+        """
+        return {
+            column['name']: self.get_array(column['name'])
+            for column in self.manifest['columns']
+            if column['file']
+        }
+
+    def get_objects(self):
+        if self._objects is None:
+            with open(os.path.join(self.directory, OBJECTS_NAME), 'rb') as infp:
+                self._objects = pickle.load(infp)
+        return self._objects
+
+    def get_index(self):
+        index = self.manifest['index']
+        if index is None:
+            return self.get_objects().index
+        return pd.RangeIndex(index['start'], index['stop'], index['step'])
+
+    def get_column(self, name):
+        column = next(column for column in self.manifest['columns'] if column['name'] == name)
+        if column['file']:
+            return self.get_array(name)
+        return self.get_objects()[name].values
+
+    def read_frame(self, columns=None, predicates=()):
+        """
+        Read a frame from the shared dataset; only the columns needed are touched.
+
+        See `data.storage.read_frame`.
+        """
+        if self.is_sparse:
+            return self.get_sparse_frame().read_frame(columns=columns, predicates=predicates)
+        wanted = storage.get_needed_columns(self.columns, columns, predicates)
+        frame = pd.DataFrame(
+            {name: self.get_column(name) for name in wanted},
+            index=self.get_index(),
+            columns=wanted,
+            copy=False,
+        )
+        frame = storage.apply_predicates(frame, predicates)
+        if columns is not None:
+            frame = frame[[name for name in wanted if name in columns]]
+        return frame
+
+
+def write_sparse(sparse_frame, directory):
+    files = {}
+    arrays = {
+        'data': sparse_frame.matrix.data,
+        'indices': sparse_frame.matrix.indices,
+        'indptr': sparse_frame.matrix.indptr,
+        'target': sparse_frame.target,
+    }
+    for name, values in arrays.items():
+        if values is not None:
+            files[name] = '%s.npy' % name
+            np.save(os.path.join(directory, files[name]), values, allow_pickle=False)
+    manifest = {
+        'columns': [{'name': name, 'dtype': None, 'file': None} for name in sparse_frame.columns],
+        'length': len(sparse_frame),
+        'index': {'start': 0, 'stop': len(sparse_frame), 'step': 1},
+        'sparse': {
+            'shape': list(sparse_frame.matrix.shape),
+            'feature_names': list(sparse_frame.feature_names),
+            'target_name': sparse_frame.target_name,
+            'files': files,
+        },
+    }
+    with open(os.path.join(directory, MANIFEST_NAME), 'w') as outfp:
+        json.dump(manifest, outfp)
+
+
+def write_dense(frame, directory):
+    columns = []
+    object_columns = []
+    for index, name in enumerate(frame.columns):
+        series = frame[name]
+        if is_shareable(series):
+            file = 'column-%d.npy' % index
+            np.save(os.path.join(directory, file), np.ascontiguousarray(series.values))
+        else:
+            file = None
+            object_columns.append(name)
+        columns.append({'name': name, 'dtype': str(series.dtype), 'file': file})
+
+    range_index = isinstance(frame.index, pd.RangeIndex)
+    if object_columns or not range_index:
+        with open(os.path.join(directory, OBJECTS_NAME), 'wb') as outfp:
+            pickle.dump(frame[object_columns], outfp, protocol=pickle.HIGHEST_PROTOCOL)
+
+    manifest = {
+        'columns': columns,
+        'length': len(frame),
+        'index': (
+            {'start': frame.index.start, 'stop': frame.index.stop, 'step': frame.index.step}
+            if range_index else None
+        ),
+    }
+    with open(os.path.join(directory, MANIFEST_NAME), 'w') as outfp:
+        json.dump(manifest, outfp)
+
+
+def publish(frame, directory):
+    """
+    Write `frame` (a `pandas.DataFrame` or a `data.sparse.SparseFrame`) out in the shared layout
+    into the (new) directory `directory`.
+    """
+    parent = os.path.dirname(directory)
+    temp_directory = tempfile.mkdtemp(dir=parent, prefix='.publish-')
+    try:
+        if isinstance(frame, sparse.SparseFrame):
+            write_sparse(frame, temp_directory)
+        else:
+            write_dense(frame, temp_directory)
+        os.rename(temp_directory, directory)
+    except Exception:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        raise
+
+
+def get_shared_dataset(data):
+    """
+    Get the shared version of a dataset, publishing it first if no process has done so yet.
+
+    :type data: data.models.Data
+    :return: The shared dataset, or None if sharing is not configured.
+    :rtype: SharedDataset|None
+    """
+    cache_dir = get_shared_cache_dir()
+    if not cache_dir:
+        return None
+    key = get_dataset_key(data)
+    with _attached_lock:
+        shared = _attached.get(key)
+        if shared is not None:
+            _attached.move_to_end(key)
+            return shared
+
+    os.makedirs(cache_dir, exist_ok=True)
+    directory = os.path.join(cache_dir, key)
+    # Attach before opening the dataset, so `cleanup()` (which checks the registry while holding
+    # the dataset's lock) can't delete it from under us once we've found it.
+    update_registry(cache_dir, key, attach=True)
+    try:
+        with locked(get_lock_filename(cache_dir, key)):  # Only one process publishes any given dataset
+            published = not os.path.isdir(directory)
+            if published:
+                publish(storage.load_stored(data), directory)
+            shared = SharedDataset(directory)
+    except Exception:
+        update_registry(cache_dir, key, attach=False)
+        raise
+    with _attached_lock:
+        shared = _attached.setdefault(key, shared)  # Another thread may have attached it meanwhile
+        _attached.move_to_end(key)
+        evicted = list(_attached)[:-getattr(settings, 'DATA_SHARED_CACHE_MAX_ATTACHED', 32)]
+    for evicted_key in evicted:
+        detach(evicted_key)
+    if published:
+        prefix = 'data-%d-' % data.pk
+        cleanup(keep=lambda other_key: other_key == key or not other_key.startswith(prefix))
+    return shared
+
+
+def detach(key):
+    cache_dir = get_shared_cache_dir()
+    with _attached_lock:
+        shared = _attached.pop(key, None)
+    if shared is not None and cache_dir:
+        update_registry(cache_dir, key, attach=False)
+
+
+@atexit.register
+def detach_all():
+    with _attached_lock:
+        keys = list(_attached)
+    for key in keys:
+        try:
+            detach(key)
+        except Exception:  # pragma: no cover
+            pass
+
+
+def read_registry(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, REGISTRY_NAME)) as infp:
+            return json.load(infp)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_registry(cache_dir, registry):
+    fd, temp_filename = tempfile.mkstemp(dir=cache_dir, prefix='.registry-')
+    with os.fdopen(fd, 'w') as outfp:
+        json.dump(registry, outfp)
+    os.replace(temp_filename, os.path.join(cache_dir, REGISTRY_NAME))
+
+
+def update_registry(cache_dir, key, attach):
+    with locked(os.path.join(cache_dir, 'registry.lock')):
+        registry = read_registry(cache_dir)
+        entry = registry.setdefault(key, {'pids': [], 'last_used': 0})
+        pids = set(entry['pids'])
+        if attach:
+            pids.add(os.getpid())
+        else:
+            pids.discard(os.getpid())
+        entry['pids'] = sorted(pids)
+        entry['last_used'] = time.time()
+        write_registry(cache_dir, registry)
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # Exists, but isn't ours
+        return True
+    return True
+
+
+def is_removable(entry, now, max_idle, keep, key):
+    if any(is_alive(pid) for pid in entry['pids']):
+        return False
+    return (keep and not keep(key)) or now - entry['last_used'] > max_idle
+
+
+def cleanup(max_idle=None, keep=None):
+    """
+    Delete shared datasets that no live process has attached and that have been idle for `max_idle` seconds.
+
+    Candidates are picked from a snapshot of the registry; each is then checked again while holding
+    its lock (and the registry lock, in that order) before it's deleted along with its lock file.
+
+    :param max_idle: Idle time in seconds; defaults to the `DATA_SHARED_CACHE_MAX_IDLE` setting.
+    :param keep: Optional predicate on the dataset key; datasets for which it returns False are
+                 deleted as soon as they are unattached, regardless of idle time (e.g. for deleted `Data`).
+    :return: Keys of the deleted datasets.
+    :rtype: list[str]
+    """
+    cache_dir = get_shared_cache_dir()
+    if not cache_dir or not os.path.isdir(cache_dir):
+        return []
+    if max_idle is None:
+        max_idle = getattr(settings, 'DATA_SHARED_CACHE_MAX_IDLE', 3600)
+    now = time.time()
+    registry = read_registry(cache_dir)  # Replaced atomically, so it can be read without the lock
+    candidates = [
+        key for key in sorted(os.listdir(cache_dir))
+        if not key.startswith('.') and os.path.isdir(os.path.join(cache_dir, key)) and
+        is_removable(registry.get(key, {'pids': [], 'last_used': 0}), now, max_idle, keep, key)
+    ]
+    deleted = []
+    for key in candidates:
+        lock_filename = get_lock_filename(cache_dir, key)
+        with locked(lock_filename), locked(os.path.join(cache_dir, 'registry.lock')):
+            registry = read_registry(cache_dir)
+            entry = registry.get(key, {'pids': [], 'last_used': 0})
+            if not is_removable(entry, now, max_idle, keep, key):
+                continue
+            shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+            registry.pop(key, None)
+            write_registry(cache_dir, registry)
+            remove_lock(lock_filename)
+        deleted.append(key)
+    return deleted
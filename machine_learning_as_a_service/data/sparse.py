@@ -0,0 +1,365 @@
+"""
+Sparse (mostly-zero) datasets.
+
+One-hot encoded and bag-of-words data is typically well over 90% zeros; holding it as a dense
+frame makes it tens or hundreds of times larger than it needs to be.  Such datasets are stored
+in `Data.data_frame` as a `SparseFrame` (a CSR matrix plus column names) instead of a
+`pandas.DataFrame`, and `storage.read_matrix()` hands the CSR matrix to estimators as it is.
+
+Sparse datasets come from CSV imports whose data turns out to be sparse enough (see `read_csv()`)
+or from svmlight/libsvm text files (see `read_svmlight()`).
+"""
+from array import array
+from collections.abc import Sequence
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from django.conf import settings
+
+from data import storage
+
+REPRESENTATIONS = ('auto', 'dense', 'sparse')
+
+
+def get_max_density():
+    return getattr(settings, 'DATA_SPARSE_MAX_DENSITY', 0.1)
+
+
+def get_max_svmlight_features():
+    return getattr(settings, 'DATA_SVMLIGHT_MAX_FEATURES', 1000000)
+
+
+class IndexNames(Sequence):
+    """
+    The names of the features of an svmlight file, i.e. their indices as strings, generated as they are needed.
+    """
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[index] for index in range(*position.indices(self.length))]
+        if position < 0:
+            position += self.length
+        if not 0 <= position < self.length:
+            raise IndexError('Feature position out of range')
+        return str(position + self.offset)
+
+    def __contains__(self, name):
+        return self.get_position(name) is not None
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __eq__(self, other):
+        if isinstance(other, IndexNames):
+            return (self.offset, self.length) == (other.offset, other.length)
+        return isinstance(other, (list, tuple)) and len(other) == self.length and list(self) == list(other)
+
+    def __repr__(self):
+        return '<IndexNames %d..%d>' % (self.offset, self.offset + self.length - 1)
+
+    def get_position(self, name):
+        """
+        :return: The position of the feature called `name`, or None if there is none.
+        :rtype: int|None
+        """
+        if not isinstance(name, str) or not name.isdigit() or str(int(name)) != name:
+            return None
+        position = int(name) - self.offset
+        return (position if 0 <= position < self.length else None)
+
+
+class SparseFrame:
+    """
+    A two-dimensional numeric dataset held as a CSR matrix.
+
+    The optional `target` is a separate dense column (such as the labels of an svmlight file);
+    it is not part of `matrix`, but is readable like any other column under `target_name`.
+    """
+
+    def __init__(self, matrix, feature_names, target=None, target_name='target'):
+        self.matrix = scipy.sparse.csr_matrix(matrix)
+        if isinstance(feature_names, IndexNames):
+            self.feature_names = feature_names
+        else:
+            self.feature_names = [str(name) for name in feature_names]
+        self.target = (np.asarray(target) if target is not None else None)
+        self.target_name = target_name
+        if len(self.feature_names) != self.matrix.shape[1]:
+            raise ValueError('%d feature names given for %d columns' % (len(self.feature_names), self.matrix.shape[1]))
+        if self.target is not None and len(self.target) != self.matrix.shape[0]:
+            raise ValueError('%d target values given for %d rows' % (len(self.target), self.matrix.shape[0]))
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def columns(self):
+        return list(self.feature_names) + ([self.target_name] if self.target is not None else [])
+
+    @property
+    def density(self):
+        size = self.matrix.shape[0] * self.matrix.shape[1]
+        return (self.matrix.nnz / size if size else 0.0)
+
+    def get_memory_usage(self):
+        """
+        :return: Bytes used by the stored arrays.
+        :rtype: int
+        """
+        usage = self.matrix.data.nbytes + self.matrix.indices.nbytes + self.matrix.indptr.nbytes
+        if self.target is not None:
+            usage += self.target.nbytes
+        return usage
+
+    def slice_rows(self, start, stop):
+        """
+        Get rows `start` to `stop` as a `SparseFrame` of their own.
+
+        :rtype: SparseFrame
+        """
+        return SparseFrame(
+            self.matrix[start:stop],
+            feature_names=self.feature_names,
+            target=(self.target[start:stop] if self.target is not None else None),
+            target_name=self.target_name,
+        )
+
+    def get_feature_indices(self, columns):
+        if isinstance(self.feature_names, IndexNames):
+            positions = {name: self.feature_names.get_position(name) for name in columns}
+            positions = {name: position for (name, position) in positions.items() if position is not None}
+        else:
+            positions = {name: index for (index, name) in enumerate(self.feature_names)}
+        missing = [name for name in columns if name not in positions and name != self.target_name]
+        if missing:
+            raise KeyError('Unknown columns: %s' % ', '.join(missing))
+        return [positions[name] for name in columns if name in positions]
+
+    def get_matrix(self, columns=None):
+        """
+        Get (some of) the columns as a CSR matrix, in the order given.
+
+        If the target is among the columns, it's included as a (sparse) column too.
+
+        :rtype: scipy.sparse.csr_matrix
+        """
+        if columns is None:
+            return self.matrix
+        columns = list(columns)
+        if self.target is None or self.target_name not in columns:
+            return self.matrix[:, self.get_feature_indices(columns)]
+        blocks = []
+        for name in columns:
+            if name == self.target_name:
+                blocks.append(scipy.sparse.csr_matrix(self.target.reshape(-1, 1)))
+            else:
+                blocks.append(self.matrix[:, self.get_feature_indices([name])])
+        return scipy.sparse.hstack(blocks, format='csr')
+
+    def to_frame(self, columns=None):
+        """
+        Densify (some of) the columns into a `pandas.DataFrame`.
+
+        :rtype: pandas.DataFrame
+        """
+        if columns is None:
+            columns = self.columns
+        features = [name for name in columns if name != self.target_name]
+        dense = self.matrix[:, self.get_feature_indices(features)].toarray()
+        data = {name: dense[:, index] for (index, name) in enumerate(features)}
+        if self.target is not None and self.target_name in columns:
+            data[self.target_name] = self.target
+        return pd.DataFrame(data, columns=list(columns))
+
+    def read_frame(self, columns=None, predicates=()):
+        """
+        Read a frame from the dataset; only the columns needed are densified.
+
+        See `data.storage.read_frame`.
+        """
+        wanted = storage.get_needed_columns(self.columns, columns, predicates)
+        frame = storage.apply_predicates(self.to_frame(wanted), predicates)
+        if columns is not None:
+            frame = frame[[name for name in wanted if name in columns]]
+        return frame
+
+
+def is_sparsifiable(frame):
+    """
+    Check whether all of the columns of `frame` are numeric (or boolean), i.e. could go into a sparse matrix.
+    """
+    return all(isinstance(dtype, np.dtype) and dtype.kind in 'biuf' for dtype in frame.dtypes)
+
+
+def get_density(frame):
+    size = frame.shape[0] * frame.shape[1]
+    return (np.count_nonzero(frame.values) / size if size else 1.0)
+
+
+def should_be_sparse(frame, representation='auto', max_density=None):
+    """
+    Decide whether `frame` should be stored as a `SparseFrame`.
+
+    :param representation: 'auto' (sparse if numeric and at most `max_density` of the values are nonzero),
+                           'sparse' or 'dense'.
+    :raises ValueError: if 'sparse' is asked for but the frame can't be stored so.
+    """
+    if representation == 'dense':
+        return False
+    sparsifiable = is_sparsifiable(frame)
+    if representation == 'sparse':
+        if not sparsifiable:
+            raise ValueError('Only numeric data can be stored as sparse')
+        return True
+    if max_density is None:
+        max_density = get_max_density()
+    return sparsifiable and len(frame.columns) > 0 and get_density(frame) <= max_density
+
+
+def to_matrix(frame):
+    return scipy.sparse.csr_matrix(frame.values.astype(np.result_type(*frame.dtypes), copy=False))
+
+
+def from_frame(frame):
+    """
+    :type frame: pandas.DataFrame
+    :rtype: SparseFrame
+    """
+    return SparseFrame(to_matrix(frame), frame.columns)
+
+
+def read_csv(source, representation='auto', max_density=None, chunk_size=None):
+    """
+    Read a CSV file into a `pandas.DataFrame` or, if the data is sparse, a `SparseFrame`.
+
+    The file is read in chunks of `chunk_size` rows and the decision is first made on the first chunk,
+    so sparse data is never held in memory in dense form as a whole.  While reading sparsely, every
+    later chunk is checked too: should one contain non-numeric data after all, or (with 'auto') the
+    density of the data read so far exceed `max_density`, the chunks read so far are densified and
+    reading continues densely.  Once reading densely, it stays dense, so a file whose first chunk is
+    dense is stored dense even if the rest of it is sparse.
+
+    :param source: Anything `pandas.read_csv` accepts.
+    :param representation: See `should_be_sparse()`.
+    :rtype: pandas.DataFrame|SparseFrame
+    """
+    if representation not in REPRESENTATIONS:
+        raise ValueError('Unknown representation %r (known representations are %s)' % (
+            representation,
+            ', '.join(REPRESENTATIONS),
+        ))
+    if chunk_size is None:
+        chunk_size = getattr(settings, 'DATA_CSV_CHUNK_SIZE', 100000)
+    if max_density is None:
+        max_density = get_max_density()
+    frames = []
+    matrices = []
+    nonzero = size = 0
+    columns = dtypes = None
+    for chunk in pd.read_csv(source, chunksize=chunk_size):
+        if columns is None:
+            columns = chunk.columns
+            dtypes = chunk.dtypes
+            sparse = should_be_sparse(chunk, representation, max_density)
+        if sparse and not is_sparsifiable(chunk):
+            if representation == 'sparse':
+                raise ValueError('Only numeric data can be stored as sparse')
+            sparse = False
+        elif sparse and representation == 'auto':
+            nonzero += np.count_nonzero(chunk.values)
+            size += chunk.shape[0] * chunk.shape[1]
+            sparse = (nonzero <= max_density * size)
+        if not sparse and matrices:
+            frames = [
+                pd.DataFrame(matrix.toarray(), columns=columns).astype(dtypes)
+                for matrix in matrices
+            ]
+            matrices = []
+        if sparse:
+            matrices.append(to_matrix(chunk))
+        else:
+            frames.append(chunk)
+    if columns is None:  # No rows at all
+        return pd.DataFrame()
+    if matrices:
+        return SparseFrame(scipy.sparse.vstack(matrices, format='csr'), columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_svmlight(lines, zero_based='auto', n_features=None, max_features=None):
+    """
+    Read svmlight/libsvm formatted text (`<label> [qid:<n>] <index>:<value> ... [# comment]`).
+
+    Query IDs and comments are ignored.  The features are named by their index in the file
+    (see `IndexNames`).  As a file with a single huge index would make a dataset just as wide,
+    the width is limited to `max_features` (by default `DATA_SVMLIGHT_MAX_FEATURES`).
+
+    :param lines: Iterable of lines (str or bytes).
+    :param zero_based: Whether feature indices start at zero; 'auto' assumes so only if a zero index is seen.
+    :type zero_based: bool|str
+    :param n_features: Minimum number of features (for files whose last features are all zero).
+    :type n_features: int|None
+    :type max_features: int|None
+    :raises ValueError: on malformed input, or if the data would have more than `max_features` features
+    :rtype: SparseFrame
+    """
+    if max_features is None:
+        max_features = get_max_svmlight_features()
+    if n_features and n_features > max_features:
+        raise ValueError('At most %d features are allowed (%d asked for)' % (max_features, n_features))
+    labels = array('d')
+    indptr = array('l', [0])
+    indices = array('l')
+    values = array('d')
+    for line_number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        tokens = line.split('#', 1)[0].split()
+        if not tokens:
+            continue
+        try:
+            labels.append(float(tokens[0]))
+            for token in tokens[1:]:
+                index, value = token.split(':', 1)
+                if index == 'qid':
+                    continue
+                indices.append(int(index))
+                values.append(float(value))
+        except ValueError as ve:
+            raise ValueError('Line %d: %s' % (line_number, ve)) from ve
+        indptr.append(len(indices))
+
+    indices = np.array(indices, dtype=np.int64)
+    if zero_based == 'auto':
+        zero_based = (len(indices) > 0 and indices.min() == 0)
+    offset = (0 if zero_based else 1)
+    if len(indices) and indices.min() < offset:
+        raise ValueError('Feature indices must be at least %d' % offset)
+    width = max((int(indices.max()) - offset + 1 if len(indices) else 0), (n_features or 0))
+    if width > max_features:
+        raise ValueError('At most %d features are allowed (the largest feature index is %d)' % (
+            max_features,
+            int(indices.max()),
+        ))
+    matrix = scipy.sparse.csr_matrix(
+        (
+            np.array(values, dtype=np.float64),
+            indices - offset,
+            np.array(indptr, dtype=np.int64),
+        ),
+        shape=(len(labels), width),
+    )
+    matrix.sum_duplicates()  # Also sorts the indices
+    return SparseFrame(
+        matrix,
+        feature_names=IndexNames(offset, width),
+        target=np.array(labels, dtype=np.float64),
+    )
@@ -0,0 +1,312 @@
+"""
+Reading stored datasets.
+
+Everything that needs the contents of a `Data` entry should read it through `read_frame()`,
+passing the columns and row predicates it actually needs.  Only datasets shared between processes
+(see `data.sharing`) are stored column by column, so only they can be read in part; any other
+dataset is unpickled whole, and the columns and predicates merely bound what callers keep of it.
+"""
+import json
+import operator
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from data import segments, sharing, sparse
+from data.models import Data
+
+PREDICATE_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda series, value: series.isin(value),
+    'not in': lambda series, value: ~series.isin(value),
+    'isnull': lambda series, value: series.isnull(),
+    'notnull': lambda series, value: series.notnull(),
+}
+
+
+LIST_OPERATORS = {'in', 'not in'}
+
+
+class Predicate:
+    """
+    A row filter of the form `column <operator> value`.
+    """
+
+    def __init__(self, column, operator, value=None):
+        if operator not in PREDICATE_OPERATORS:
+            raise ValueError('Unknown operator %r (known operators are %s)' % (
+                operator,
+                ', '.join(sorted(PREDICATE_OPERATORS)),
+            ))
+        if operator in LIST_OPERATORS and not isinstance(value, (list, tuple)):
+            raise ValueError('The %r operator takes a list of values, not %r' % (operator, value))
+        self.column = column
+        self.operator = operator
+        self.value = value
+
+    @property
+    def columns(self):
+        return {self.column}
+
+    def get_key(self):
+        return ['predicate', self.column, self.operator, self.value]
+
+    def get_mask(self, frame):
+        return PREDICATE_OPERATORS[self.operator](frame[self.column], self.value)
+
+    def __repr__(self):
+        return '<Predicate %s %s %r>' % (self.column, self.operator, self.value)
+
+
+def apply_predicates(frame, predicates):
+    mask = None
+    for predicate in predicates:
+        predicate_mask = predicate.get_mask(frame)
+        mask = (predicate_mask if mask is None else (mask & predicate_mask))
+    return (frame if mask is None else frame[mask])
+
+
+def get_needed_columns(all_columns, columns, predicates):
+    """
+    Get the columns (of `all_columns`, in order) that must be read to select `columns` and filter by `predicates`.
+    """
+    return [
+        name for name in all_columns
+        if columns is None or name in columns or any(name in predicate.columns for predicate in predicates)
+    ]
+
+
+def get_data(data_id):
+    """
+    Get a `Data` entry without loading its contents.
+
+    :raises Data.DoesNotExist: if there is no such entry
+    :rtype: data.models.Data
+    """
+    return Data.objects.defer('data_frame').get(pk=data_id)
+
+
+def read_frame(data, columns=None, predicates=()):
+    """
+    Read (a part of) a stored dataset.
+
+    When datasets are shared between processes (see `data.sharing`), only the needed columns are
+    touched at all.  Otherwise the whole dataset (with its segments) is unpickled, and the predicates
+    and column selection are applied right after that, so callers never hold on to more of it than
+    they asked for; this saves memory, but no I/O.
+    Sparse datasets (see `data.sparse`) are densified, but only in the needed columns;
+    use `read_matrix()` to keep them sparse.
+
+    :type data: data.models.Data
+    :param columns: Columns to read (in the stored order); None for all of them.
+                    Any columns the predicates need are read in any case.
+    :type columns: Iterable[str]|None
+    :param predicates: Row filters; a row is returned if it matches all of them.
+    :type predicates: Iterable[Predicate]
+    :rtype: pandas.DataFrame
+    """
+    shared = sharing.get_shared_dataset(data)
+    if shared is not None:
+        return shared.read_frame(columns=columns, predicates=predicates)
+    pieces = list(iterate_pieces(data))
+    if len(pieces) == 1:
+        return read_piece(pieces[0], columns, predicates)
+    frames = []
+    offset = 0
+    for piece in pieces:
+        # Number the rows of the dataset as a whole, as `load_stored()` would
+        frames.append(read_piece(piece, columns, predicates, offset=offset))
+        offset += len(piece)
+    return segments.concat_frames(frames, ignore_index=False)
+
+
+def iterate_frames(data, columns=None, chunk_size=None):
+    """
+    Read a whole dataset as consecutive chunks of at most `chunk_size` rows, numbered as by `read_frame()`.
+
+    Only one chunk (of the needed columns) is densified at a time, so this suits single-pass
+    algorithms over datasets too large to read at once (see `data.sampling`).
+
+    :type data: data.models.Data
+    :type columns: Iterable[str]|None
+    :rtype: Iterable[pandas.DataFrame]
+    """
+    if chunk_size is None:
+        chunk_size = getattr(settings, 'DATA_READ_CHUNK_SIZE', 100000)
+    shared = sharing.get_shared_dataset(data)
+    if shared is not None:
+        pieces = [shared.get_sparse_frame() if shared.is_sparse else shared.read_frame(columns=columns)]
+    else:
+        pieces = iterate_pieces(data)
+    offset = 0
+    for piece in pieces:
+        for start in range(0, len(piece), chunk_size):
+            if isinstance(piece, sparse.SparseFrame):
+                chunk = piece.slice_rows(start, start + chunk_size)
+            else:
+                chunk = piece.iloc[start:start + chunk_size]
+            yield read_piece(chunk, columns, (), offset=offset + start)
+        offset += len(piece)
+
+
+def read_piece(stored, columns, predicates, offset=None):
+    if isinstance(stored, sparse.SparseFrame):
+        frame = stored.to_frame(get_needed_columns(stored.columns, columns, predicates))
+    elif columns is None and not predicates:
+        frame = stored
+    else:
+        frame = stored[get_needed_columns(stored.columns, columns, predicates)]
+    if offset is not None:
+        frame = frame.set_index(pd.RangeIndex(offset, offset + len(frame)))
+    frame = apply_predicates(frame, predicates)
+    if columns is not None:
+        columns = set(columns)
+        frame = frame[[column for column in frame.columns if column in columns]]
+    return frame
+
+
+def load_stored(data):
+    """
+    Load a whole dataset, with any appended segments, in the form it is stored in.
+
+    :type data: data.models.Data
+    :rtype: pandas.DataFrame|data.sparse.SparseFrame
+    """
+    return segments.combine(list(iterate_pieces(data)))
+
+
+def iterate_pieces(data):
+    """
+    Iterate over the stored pieces of a dataset: its stored frame, then its segments, in order.
+
+    A compaction running meanwhile (see `segments.compact_segments()`) may merge the segments of
+    `data.version` with later ones.  The `Data` entry is then read again, and reading goes on from its
+    current version, skipping the rows already read; as rows are only ever appended and compaction keeps
+    them in order, these are the same rows.  The rows appended after `data.version` are left out if its
+    row count is known (see `data.catalog`).
+
+    :type data: data.models.Data
+    :raises segments.StaleVersion: if that happens again while reading the current version
+    :rtype: Iterable[pandas.DataFrame|data.sparse.SparseFrame]
+    """
+    yield data.data_frame
+    read_rows = len(data.data_frame)
+    try:
+        for segment in segments.get_segments(data):
+            piece = segment.data_frame
+            yield piece
+            read_rows += len(piece)
+        return
+    except segments.StaleVersion:
+        current = get_data(data.pk)
+    position = len(data.data_frame)
+    for segment in segments.get_segments(current):
+        piece = segment.data_frame
+        start = position
+        position += len(piece)
+        stop = (len(piece) if data.row_count is None else min(len(piece), data.row_count - start))
+        if stop <= 0:
+            return
+        if read_rows - start > 0 or stop < len(piece):
+            piece = slice_piece(piece, max(read_rows - start, 0), stop)
+        if len(piece):
+            yield piece
+
+
+def slice_piece(piece, start, stop):
+    if isinstance(piece, sparse.SparseFrame):
+        return piece.slice_rows(start, stop)
+    return piece.iloc[start:stop]
+
+
+def get_columns(data):
+    """
+    :type data: data.models.Data
+    :rtype: list[str]
+    """
+    if data.columns:  # From the catalog metadata (see `data.catalog`), without reading the dataset
+        return [column['name'] for column in json.loads(data.columns)]
+    shared = sharing.get_shared_dataset(data)
+    if shared is not None:
+        return list(shared.columns)
+    return list(data.data_frame.columns)
+
+
+def get_column_dtypes(data):
+    """
+    Get the dtypes of the columns of a dataset from its catalog metadata (see `data.catalog`), without reading it.
+
+    :type data: data.models.Data
+    :return: Dtype names by column name; empty if the dataset has not been described.
+    :rtype: dict[str, str]
+    """
+    if not data.columns:
+        return {}
+    return {column['name']: column['dtype'] for column in json.loads(data.columns)}
+
+
+def get_kind(dtype_name):
+    """
+    Classify a dtype by what can be done with its values.
+
+    :return: 'number', 'bool', 'datetime', 'string' (including objects), 'category' or None if unknown.
+    :rtype: str|None
+    """
+    if dtype_name == 'category':
+        return 'category'
+    if dtype_name in ('object', 'str') or dtype_name.startswith('string'):
+        return 'string'
+    if dtype_name.startswith('datetime64'):
+        return 'datetime'
+    try:
+        kind = np.dtype(dtype_name).kind
+    except TypeError:
+        return None
+    return {'i': 'number', 'u': 'number', 'f': 'number', 'b': 'bool', 'M': 'datetime', 'U': 'string'}.get(kind)
+
+
+def get_sparse_frame(data):
+    """
+    Get a dataset as a `SparseFrame`, if it is stored as one.
+
+    :type data: data.models.Data
+    :rtype: data.sparse.SparseFrame|None
+    """
+    shared = sharing.get_shared_dataset(data)
+    if shared is not None:
+        return (shared.get_sparse_frame() if shared.is_sparse else None)
+    if not isinstance(data.data_frame, sparse.SparseFrame):
+        return None
+    return load_stored(data)
+
+
+def read_matrix(data, columns=None):
+    """
+    Read (some of) the columns of a dataset as a two-dimensional matrix, as estimators take them.
+
+    Sparse datasets are returned in CSR form as they are stored, never densified;
+    other datasets as a dense array.
+
+    :type data: data.models.Data
+    :param columns: Columns to read (in this order); None for all of them
+                    (for sparse datasets, all but the target column).
+    :type columns: Iterable[str]|None
+    :return: The matrix and the names of its columns.
+    :rtype: tuple[numpy.ndarray|scipy.sparse.csr_matrix, list[str]]
+    """
+    sparse_frame = get_sparse_frame(data)
+    if sparse_frame is not None:
+        if columns is None:
+            return (sparse_frame.matrix, list(sparse_frame.feature_names))
+        columns = list(columns)
+        return (sparse_frame.get_matrix(columns), columns)
+    frame = read_frame(data, columns=columns)
+    if columns is not None:
+        frame = frame[list(columns)]
+    return (frame.values, [str(column) for column in frame.columns])
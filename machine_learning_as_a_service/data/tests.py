@@ -1,3 +1,526 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from data import catalog, compaction, features, sampling, segments, sharing, sparse, storage
+from data.models import Data
+from data.pipeline import PipelineError, Source, build_pipeline
+
+
+def create_data(data_frame, **kwargs):
+    data = Data(data_frame=data_frame, **kwargs)
+    catalog.set_metadata(data)
+    data.save()
+    return data
+
+
+@override_settings(DATA_SEGMENT_COMPACT_IN_BACKGROUND=False)
+class DataTestCase(TestCase):
+    """
+    Runs every test with empty shared data and feature caches of its own.
+    """
+
+    def setUp(self):
+        super(DataTestCase, self).setUp()
+        cache_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_root, ignore_errors=True)
+        self.shared_cache_dir = os.path.join(cache_root, 'shared-data')
+        self.feature_cache_dir = os.path.join(cache_root, 'features')
+        cache_settings = override_settings(
+            DATA_SHARED_CACHE_DIR=self.shared_cache_dir,
+            DATA_FEATURE_CACHE_DIR=self.feature_cache_dir,
+        )
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        # IDs are reused between tests, so nothing may be remembered from earlier ones
+        self.addCleanup(sharing.detach_all)
+        self.addCleanup(self.forget_features)
+        caches['default'].clear()
+
+    def forget_features(self):
+        with features._loaded_lock:
+            features._loaded.clear()
+
+
+class SegmentTest(DataTestCase):
+    def test_append_round_trip(self):
+        data = create_data(pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']}))
+        segments.append_rows(data, pd.DataFrame({'a': [3], 'b': ['z']}))
+        segments.append_rows(data, pd.DataFrame({'a': [4, 5], 'b': ['x', 'x']}))
+        current = storage.get_data(data.pk)
+        self.assertEqual(current.version, 3)
+        frame = storage.read_frame(current)
+        self.assertEqual(list(frame['a']), [1, 2, 3, 4, 5])
+        self.assertEqual(list(frame['b']), ['x', 'y', 'z', 'x', 'x'])
+        self.assertEqual(list(frame.index), [0, 1, 2, 3, 4])
+        self.assertEqual(current.row_count, 5)
+
+    def test_earlier_version_reads_earlier_rows(self):
+        data = create_data(pd.DataFrame({'a': [1, 2]}))
+        segments.append_rows(data, pd.DataFrame({'a': [3]}))
+        snapshot = storage.get_data(data.pk)
+        segments.append_rows(data, pd.DataFrame({'a': [4]}))
+        self.assertEqual(list(storage.read_frame(snapshot)['a']), [1, 2, 3])
+        self.assertEqual(list(storage.read_frame(storage.get_data(data.pk))['a']), [1, 2, 3, 4])
+
+    def test_compacted_version_is_stale(self):
+        data = create_data(pd.DataFrame({'a': [1]}))
+        segments.append_rows(data, pd.DataFrame({'a': [2]}))
+        snapshot = storage.get_data(data.pk)
+        segments.append_rows(data, pd.DataFrame({'a': [3]}))
+        self.assertEqual(segments.compact_segments(data.pk, max_rows=10, min_segments=2), 1)
+        current = storage.get_data(data.pk)
+        self.assertEqual(list(storage.read_frame(current)['a']), [1, 2, 3])
+        with self.assertRaises(segments.StaleVersion):
+            list(segments.get_segments(snapshot))
+        # Reading goes on from the current version, without the rows appended since
+        self.assertEqual(list(storage.read_frame(snapshot)['a']), [1, 2])
+
+    def test_compaction_while_reading(self):
+        data = create_data(pd.DataFrame({'a': [1]}))
+        for value in (2, 3, 4):
+            segments.append_rows(data, pd.DataFrame({'a': [value]}))
+        snapshot = storage.get_data(data.pk)
+        segments.append_rows(data, pd.DataFrame({'a': [5]}))
+        chunks = storage.iterate_frames(snapshot, chunk_size=1)
+        read = [next(chunks), next(chunks)]  # The stored frame and the first segment
+        self.assertEqual(segments.compact_segments(data.pk, max_rows=10, min_segments=2), 3)
+        read.extend(chunks)
+        frame = pd.concat(read)
+        self.assertEqual(list(frame['a']), [1, 2, 3, 4])
+        self.assertEqual(list(frame.index), [0, 1, 2, 3])
+
+    def test_append_from_url(self):
+        data = create_data(pd.DataFrame({'a': [1, 2]}))
+        url = '/api/data/%d/append' % data.pk
+        response = mock.MagicMock(status_code=200)
+        response.__enter__.return_value = response
+        response.iter_content.return_value = [b'a\n', b'3\n4\n']
+
+        def append(csv_url):
+            return self.client.post(url, '', content_type='text/plain', HTTP_CSV_URL=csv_url)
+
+        with mock.patch('requests.get', return_value=response) as get:
+            self.assertEqual(append('http://example.com/rows.csv').status_code, 200)
+        self.assertEqual(get.call_args[1]['timeout'], 30)
+        self.assertEqual(list(storage.read_frame(storage.get_data(data.pk))['a']), [1, 2, 3, 4])
+
+        with override_settings(DATA_FETCH_MAX_BYTES=4), mock.patch('requests.get', return_value=response):
+            self.assertEqual(append('http://example.com/rows.csv').status_code, 400)
+        with mock.patch('requests.get') as get:
+            self.assertEqual(append('file:///etc/passwd').status_code, 400)
+        self.assertFalse(get.called)
+        self.assertEqual(storage.get_data(data.pk).version, 2)
+
+    def test_append_rejects_other_columns(self):
+        data = create_data(pd.DataFrame({'a': [1]}))
+        with self.assertRaises(ValueError):
+            segments.append_rows(data, pd.DataFrame({'c': [2]}))
+        self.assertEqual(storage.get_data(data.pk).version, 1)
+
+
+class SharingTest(DataTestCase):
+    def test_publish(self):
+        data = create_data(pd.DataFrame({'a': [1.5, 2.5], 'b': ['x', 'y']}))
+        shared = sharing.get_shared_dataset(data)
+        self.assertTrue(os.path.isdir(os.path.join(self.shared_cache_dir, 'data-%d-1' % data.pk)))
+        self.assertIs(sharing.get_shared_dataset(data), shared)
+        self.assertFalse(shared.get_array('a').flags.writeable)
+        frame = shared.read_frame(columns=['b'], predicates=[storage.Predicate('a', '>', 2)])
+        self.assertEqual(list(frame.columns), ['b'])
+        self.assertEqual(list(frame['b']), ['y'])
+        self.assertEqual(list(frame.index), [1])
+
+    def test_publish_sparse(self):
+        stored = sparse.SparseFrame(np.eye(3), ['a', 'b', 'c'], target=[0, 1, 0])
+        data = create_data(stored)
+        shared = sharing.get_shared_dataset(data)
+        self.assertTrue(shared.is_sparse)
+        self.assertEqual(shared.get_sparse_frame().matrix.nnz, 3)
+        self.assertEqual(list(shared.read_frame(columns=['b', 'target'])['b']), [0, 1, 0])
+
+    def test_new_version_deletes_detached_old_one(self):
+        data = create_data(pd.DataFrame({'a': [1, 2]}))
+        sharing.get_shared_dataset(data)
+        segments.append_rows(data, pd.DataFrame({'a': [3]}))
+        old_key = 'data-%d-1' % data.pk
+        sharing.detach(old_key)
+        shared = sharing.get_shared_dataset(storage.get_data(data.pk))
+        self.assertEqual(list(shared.read_frame()['a']), [1, 2, 3])
+        self.assertFalse(os.path.exists(os.path.join(self.shared_cache_dir, old_key)))
+        self.assertNotIn(old_key, sharing.read_registry(self.shared_cache_dir))
+
+    def test_cleanup_keeps_attached(self):
+        data = create_data(pd.DataFrame({'a': [1, 2]}))
+        sharing.get_shared_dataset(data)
+        key = 'data-%d-1' % data.pk
+        self.assertEqual(sharing.cleanup(max_idle=0), [])
+        sharing.detach(key)
+        self.assertEqual(sharing.cleanup(max_idle=0), [key])
+        self.assertEqual(
+            sorted(name for name in os.listdir(self.shared_cache_dir) if not name.startswith('registry')),
+            [],
+        )
+
+
+class CompactionTest(DataTestCase):
+    def test_downcast_then_arithmetic(self):
+        frame = pd.DataFrame({'a': [30000, -20000], 'b': [30000, 40000], 'c': [0.5, 1.5]})
+        stored, report = compaction.compact(frame)
+        self.assertEqual(str(stored['a'].dtype), 'int16')
+        self.assertEqual(str(stored['b'].dtype), 'int32')
+        self.assertEqual(str(stored['c'].dtype), 'float32')
+        self.assertLess(report['bytes_after'], report['bytes_before'])
+        data = create_data(stored)
+        node = build_pipeline(Source(data), [
+            {'op': 'derive', 'column': 'sum', 'left': 'a', 'operator': '+', 'right': 'a'},
+            {'op': 'derive', 'column': 'product', 'left': 'b', 'operator': '*', 'right': 'b'},
+            {'op': 'derive', 'column': 'scaled', 'left': 'c', 'operator': '*', 'right': {'value': 1e40}},
+        ], get_source=None)
+        result = node.get_result()
+        self.assertEqual(list(result['sum']), [60000, -40000])
+        self.assertEqual(list(result['product']), [900000000, 1600000000])
+        self.assertEqual(list(result['scaled']), [0.5e40, 1.5e40])
+
+    def test_unsigned_stays_unsigned(self):
+        stored = compaction.compact(pd.DataFrame({'a': np.array([1, 60000], dtype=np.uint64)}))[0]
+        self.assertEqual(str(stored['a'].dtype), 'uint16')
+        stored = compaction.compact(pd.DataFrame({'a': np.array([-1, 60000])}))[0]
+        self.assertEqual(str(stored['a'].dtype), 'int32')
+
+    def test_small_dtypes_stay(self):
+        frame = pd.DataFrame({'a': np.array([1, 2], dtype=np.int8)})
+        self.assertEqual(str(compaction.compact(frame)[0]['a'].dtype), 'int8')
+
+
+def make_csv(rows, header='a,b,c'):
+    return io.StringIO('\n'.join([header] + rows))
+
+
+class SparseTest(DataTestCase):
+    def test_sparse_csv(self):
+        stored = sparse.read_csv(make_csv(['0,0,0'] * 9 + ['0,1,0']), chunk_size=4)
+        self.assertIsInstance(stored, sparse.SparseFrame)
+        self.assertEqual(len(stored), 10)
+        self.assertEqual(stored.matrix.nnz, 1)
+        self.assertEqual(stored.feature_names, ['a', 'b', 'c'])
+
+    def test_dense_csv(self):
+        stored = sparse.read_csv(make_csv(['1,2,3'] * 5), chunk_size=2)
+        self.assertIsInstance(stored, pd.DataFrame)
+        self.assertEqual(len(stored), 5)
+
+    def test_later_non_numeric_chunk_densifies(self):
+        stored = sparse.read_csv(make_csv(['0,0,0'] * 4 + ['x,0,1']), chunk_size=2)
+        self.assertIsInstance(stored, pd.DataFrame)
+        self.assertEqual(list(stored['a']), [0, 0, 0, 0, 'x'])
+        self.assertEqual(list(stored['c']), [0, 0, 0, 0, 1])
+
+    def test_later_dense_chunks_densify(self):
+        stored = sparse.read_csv(make_csv(['0,0,0'] * 2 + ['1,2,3'] * 6), chunk_size=2, max_density=0.5)
+        self.assertIsInstance(stored, pd.DataFrame)
+        self.assertEqual(list(stored['b']), [0, 0] + [2] * 6)
+
+    def test_representation(self):
+        self.assertIsInstance(sparse.read_csv(make_csv(['1,2,3']), representation='sparse'), sparse.SparseFrame)
+        self.assertIsInstance(sparse.read_csv(make_csv(['0,0,0']), representation='dense'), pd.DataFrame)
+        with self.assertRaises(ValueError):
+            sparse.read_csv(make_csv(['x,2,3']), representation='sparse')
+
+    def test_svmlight(self):
+        stored = sparse.read_svmlight(['1 1:0.5 3:2', '0 qid:4 2:1 # comment'])
+        self.assertEqual(stored.feature_names, ['1', '2', '3'])
+        self.assertEqual(list(stored.target), [1, 0])
+        self.assertEqual(stored.matrix.toarray().tolist(), [[0.5, 0, 2], [0, 1, 0]])
+        self.assertEqual(list(stored.to_frame(['3', 'target']).columns), ['3', 'target'])
+        with self.assertRaises(KeyError):
+            stored.get_matrix(['0'])
+
+    def test_svmlight_width_is_limited(self):
+        with override_settings(DATA_SVMLIGHT_MAX_FEATURES=10):
+            with self.assertRaises(ValueError):
+                sparse.read_svmlight(['1 11:1'])
+            with self.assertRaises(ValueError):
+                sparse.read_svmlight(['1 1:1'], n_features=11)
+            self.assertEqual(len(sparse.read_svmlight(['1 10:1']).feature_names), 10)
+            response = self.client.post(
+                '/api/data/save_svmlight_as_dataframe',
+                '1 1:1 5000000000:1',
+                content_type='text/plain',
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Data.objects.exists())
+
+
+class SamplingTest(DataTestCase):
+    def setUp(self):
+        super(SamplingTest, self).setUp()
+        self.data = create_data(pd.DataFrame({'a': np.arange(100), 'group': ['x', 'y', 'y', 'y'] * 25}))
+
+    def sample(self, **kwargs):
+        return sampling.sample_data(self.data, sampling.SampleSpec(**kwargs))
+
+    def test_same_seed_same_sample(self):
+        first = self.sample(size=10, seed=42)
+        self.assertEqual(len(first), 10)
+        self.assertEqual(list(self.sample(size=10, seed=42)['a']), list(first['a']))
+        self.assertNotEqual(list(self.sample(size=10, seed=43)['a']), list(first['a']))
+        self.assertEqual(list(first['a']), sorted(first['a']))  # In the stored order
+
+    def test_sample_does_not_depend_on_chunk_size(self):
+        with override_settings(DATA_READ_CHUNK_SIZE=7):
+            chunked = list(self.sample(size=10, fraction=0.5, seed=1)['a'])
+        self.assertEqual(list(self.sample(size=10, fraction=0.5, seed=1)['a']), chunked)
+
+    def test_stratified(self):
+        sample = self.sample(method='stratified', size=5, column='group', seed=1)
+        self.assertEqual(sample['group'].value_counts().to_dict(), {'x': 5, 'y': 5})
+
+    def test_saved_sample_records_spec(self):
+        spec = sampling.SampleSpec(size=10, seed=3)
+        sample = sampling.save_sample(self.data, spec, sampling.sample_data(self.data, spec))
+        self.assertEqual(sample.parent_id, self.data.pk)
+        self.assertEqual(json.loads(sample.sample_spec)['seed'], 3)
+        self.assertEqual(json.loads(sample.sample_spec)['version'], 1)
+        self.assertEqual(sample.row_count, 10)
+
+    def test_pipeline_sample_is_reproducible(self):
+        url = '/api/data/%d/pipeline?max_rows=10' % self.data.pk
+        body = json.dumps({'steps': [{'op': 'select', 'columns': ['a']}]})
+        first = self.client.post(url, body, content_type='application/json').json()
+        caches['default'].clear()
+        second = self.client.post(url, body, content_type='application/json').json()
+        self.assertEqual(first['row_count'], 10)
+        self.assertEqual(first['rows'], second['rows'])
+
+    def test_feature_matrix_of_sample(self):
+        url = '/api/data/%d/features?max_rows=10&sample_seed=5' % self.data.pk
+        first = self.client.post(url, '{}', content_type='application/json').json()
+        self.assertEqual(first['shape'], [10, 3])
+        self.assertEqual(first['params']['sample']['seed'], 5)
+        self.assertEqual(self.client.post(url, '{}', content_type='application/json').json()['key'], first['key'])
+        whole = self.client.post('/api/data/%d/features' % self.data.pk, '{}', content_type='application/json').json()
+        self.assertEqual(whole['shape'], [100, 3])
+        self.assertNotEqual(whole['key'], first['key'])
+
+
+class FeatureTest(DataTestCase):
+    def setUp(self):
+        super(FeatureTest, self).setUp()
+        self.data = create_data(pd.DataFrame({
+            'a': [1.0, 2.0, np.nan, 4.0, 5.0, 6.0],
+            'color': ['red', 'blue', 'red', None, 'green', 'red'],
+            'target': [0, 1, 0, 1, 0, 1],
+        }))
+        self.spec = {'exclude': ['target']}
+
+    def test_cache_hit_and_miss(self):
+        built = features.get_feature_matrix(self.data, self.spec)
+        self.assertTrue(os.path.isdir(os.path.join(self.feature_cache_dir, built.key)))
+        self.assertIs(features.get_feature_matrix(self.data, self.spec), built)
+
+        # Loaded from the cache directory (as another process would) without building it again
+        self.forget_features()
+        with mock.patch('data.features.build', side_effect=AssertionError('built again')):
+            loaded = features.get_feature_matrix(self.data, self.spec)
+            self.assertIs(features.get_cached_feature_matrix(built.key), loaded)
+        self.assertEqual(loaded.feature_names, built.feature_names)
+        self.assertEqual(np.asarray(loaded.matrix).tolist(), np.asarray(built.matrix).tolist())
+
+        other = features.get_feature_matrix(self.data, dict(self.spec, scale=None))
+        self.assertNotEqual(other.key, built.key)
+        segments.append_rows(self.data, pd.DataFrame({'a': [7.0], 'color': ['blue'], 'target': [0]}))
+        appended = features.get_feature_matrix(storage.get_data(self.data.pk), self.spec)
+        self.assertNotEqual(appended.key, built.key)
+        self.assertEqual(appended.matrix.shape[0], 7)
+
+    def test_unknown_key(self):
+        self.assertIsNone(features.get_cached_feature_matrix('features-1-1-%s' % ('0' * 40)))
+        self.assertIsNone(features.get_cached_feature_matrix('../etc'))
+
+    def test_chunked_build_matches_whole(self):
+        whole = features.get_feature_matrix(self.data, self.spec)
+        self.forget_features()
+        shutil.rmtree(self.feature_cache_dir)
+        with override_settings(DATA_READ_CHUNK_SIZE=2):
+            chunked = features.get_feature_matrix(self.data, self.spec)
+        self.assertEqual(chunked.feature_names, ['a', 'color=blue', 'color=green', 'color=red'])
+        np.testing.assert_allclose(np.asarray(chunked.matrix), np.asarray(whole.matrix))
+
+    def test_transform_like_training(self):
+        feature_matrix = features.get_feature_matrix(self.data, self.spec)
+        rows = storage.read_frame(self.data).to_dict('records')
+        np.testing.assert_allclose(feature_matrix.transform(pd.DataFrame.from_records(rows)), feature_matrix.matrix)
+
+    def test_invalid_spec(self):
+        with self.assertRaises(features.FeatureError):
+            features.get_feature_matrix(self.data, {'scale': 'log'})
+
+
+class CatalogTest(DataTestCase):
+    def setUp(self):
+        super(CatalogTest, self).setUp()
+        self.data = create_data(pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']}), source_url='http://example.com/a.csv')
+        self.other = create_data(pd.DataFrame({'c': np.arange(10)}), source_url='http://example.com/c.csv')
+
+    def list_ids(self, query=''):
+        response = self.client.get('/api/data%s' % query)
+        self.assertEqual(response.status_code, 200)
+        return [entry['id'] for entry in response.json()['results']]
+
+    def test_list(self):
+        self.assertEqual(sorted(self.list_ids()), [self.data.pk, self.other.pk])
+        self.assertEqual(self.list_ids('?column=b'), [self.data.pk])
+        self.assertEqual(self.list_ids('?min_row_count=5'), [self.other.pk])
+        self.assertEqual(self.list_ids('?source=c.csv'), [self.other.pk])
+
+    def test_retrieve(self):
+        response = self.client.get('/api/data/%d' % self.data.pk)
+        self.assertEqual(response.status_code, 200)
+        entry = response.json()
+        self.assertEqual(entry['row_count'], 2)
+        self.assertEqual([column['name'] for column in entry['columns']], ['a', 'b'])
+        self.assertEqual(entry['columns'][0]['dtype'], 'int64')
+        self.assertEqual(response['ETag'], '"%s"' % entry['content_hash'])
+
+        response = self.client.get('/api/data/%d' % self.data.pk, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_retrieve_missing(self):
+        response = self.client.get('/api/data/%d' % (self.other.pk + 1))
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('error', response.json())
+
+    def test_append_updates_metadata(self):
+        etag = self.client.get('/api/data/%d' % self.data.pk)['ETag']
+        segments.append_rows(self.data, pd.DataFrame({'a': [3], 'b': ['z']}))
+        response = self.client.get('/api/data/%d' % self.data.pk, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['row_count'], 3)
+        self.assertEqual(response.json()['version'], 2)
+
+    def test_stored_size_is_that_of_stored_pickle(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT LENGTH(data_frame) FROM data_data WHERE id = %s', [self.data.pk])
+            self.assertEqual(cursor.fetchone()[0], Data.objects.get(pk=self.data.pk).byte_size)
+
+    def test_undescribed_entry_is_described_on_append(self):
+        legacy = Data(data_frame=pd.DataFrame({'a': [1]}))
+        legacy.save()
+        segments.append_rows(legacy, pd.DataFrame({'a': [2]}))
+        legacy = Data.objects.get(pk=legacy.pk)
+        self.assertEqual(legacy.row_count, 2)
+        self.assertTrue(legacy.content_hash)
+        self.assertTrue(self.client.get('/api/data/%d' % legacy.pk).has_header('ETag'))
+
+
+class PipelineTest(DataTestCase):
+    def setUp(self):
+        super(PipelineTest, self).setUp()
+        self.data = create_data(pd.DataFrame({
+            'key': [1, 2, 3, 4],
+            'group': ['x', 'y', 'x', 'y'],
+            'value': [10.0, 20.0, 30.0, 40.0],
+        }))
+        self.other = create_data(pd.DataFrame({'key': [1, 2, 3], 'label': ['a', 'b', 'c']}))
+
+    def run_pipeline(self, steps):
+        return build_pipeline(Source(self.data), steps, get_source=lambda data_id: Source(storage.get_data(data_id)))
+
+    def test_filter_derive_aggregate(self):
+        result = self.run_pipeline([
+            {'op': 'derive', 'column': 'double', 'left': 'value', 'operator': '*', 'right': {'value': 2}},
+            {'op': 'filter', 'column': 'key', 'operator': '>', 'value': 1},
+            {'op': 'aggregate', 'by': ['group'], 'aggregations': [{'column': 'double', 'function': 'sum'}]},
+        ]).get_result()
+        self.assertEqual(list(result.columns), ['group', 'double_sum'])
+        self.assertEqual(dict(zip(result['group'], result['double_sum'])), {'x': 60.0, 'y': 120.0})
+
+    def test_join(self):
+        result = self.run_pipeline([
+            {'op': 'join', 'data_id': self.other.pk, 'on': ['key'], 'how': 'left'},
+            {'op': 'filter', 'column': 'key', 'operator': '<=', 'value': 2},
+        ]).get_result()
+        self.assertEqual(list(result['label']), ['a', 'b'])
+
+    def test_filter_on_unselected_column(self):
+        with self.assertRaises(PipelineError):
+            self.run_pipeline([
+                {'op': 'select', 'columns': ['key']},
+                {'op': 'filter', 'column': 'value', 'operator': '>', 'value': 1},
+            ])
+
+    def test_unknown_op(self):
+        with self.assertRaises(PipelineError):
+            self.run_pipeline([{'op': 'explode'}])
+
+    def test_results_are_cached(self):
+        node = self.run_pipeline([{'op': 'filter', 'column': 'group', 'operator': '==', 'value': 'x'}])
+        with mock.patch('data.storage.read_frame', wraps=storage.read_frame) as read_frame:
+            self.assertEqual(list(node.get_result()['key']), [1, 3])
+            self.assertEqual(list(node.get_result()['key']), [1, 3])
+            self.assertEqual(read_frame.call_count, 1)
+            # A bare source isn't cached, as that would only copy the dataset
+            Source(self.data).get_result()
+            Source(self.data).get_result()
+            self.assertEqual(read_frame.call_count, 3)
+
+    def test_intermediate_results_are_shared(self):
+        steps = [
+            {'op': 'filter', 'column': 'group', 'operator': '==', 'value': 'x'},
+            {'op': 'select', 'columns': ['key']},
+        ]
+        derive = {'op': 'derive', 'column': 'double', 'left': 'key', 'operator': '*', 'right': {'value': 2}}
+        with mock.patch('data.storage.read_frame', wraps=storage.read_frame) as read_frame:
+            self.run_pipeline(steps).get_result()
+            self.assertEqual(list(self.run_pipeline(steps + [derive]).get_result()['double']), [2, 6])
+            self.assertEqual(read_frame.call_count, 1)
+            with override_settings(DATA_PIPELINE_CACHE_INTERMEDIATE=False):
+                self.run_pipeline(steps + [dict(derive, column='other')]).get_result()
+            self.assertEqual(read_frame.call_count, 2)
+
+    def test_invalid_steps(self):
+        for steps in (
+            [{'op': 'derive', 'column': 'd', 'left': 'group', 'operator': '+', 'right': {'value': 1}}],
+            [{'op': 'derive', 'column': 'd', 'left': 'value', 'operator': '+', 'right': {'value': 'x'}}],
+            [{'op': 'filter', 'column': 'group', 'operator': '>', 'value': 1}],
+            [{'op': 'filter', 'column': 'value', 'operator': '>', 'value': 'x'}],
+            [{'op': 'filter', 'column': 'key', 'operator': 'in', 'value': 1}],
+            [{'op': 'aggregate', 'by': ['group'], 'aggregations': []}],
+            [{'op': 'aggregate', 'by': ['key'], 'aggregations': [{'column': 'group', 'function': 'mean'}]}],
+            [{'op': 'aggregate', 'by': ['key'], 'aggregations': [{'column': 'nope', 'function': 'count'}]}],
+        ):
+            with self.assertRaises(PipelineError, msg=steps):
+                self.run_pipeline(steps)
+            response = self.client.post(
+                '/api/data/%d/pipeline' % self.data.pk,
+                json.dumps({'steps': steps}),
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 400, steps)
+            self.assertIn('error', response.json())
+
+    def test_evaluation_errors_are_bad_requests(self):
+        with mock.patch('data.pipeline.Filter.compute', side_effect=TypeError('unorderable')):
+            response = self.client.post(
+                '/api/data/%d/pipeline' % self.data.pk,
+                json.dumps({'steps': [{'op': 'filter', 'column': 'key', 'operator': '>', 'value': 1}]}),
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 400)
+
+    def test_new_version_misses_cache(self):
+        node = self.run_pipeline([{'op': 'select', 'columns': ['key']}])
+        self.assertEqual(len(node.get_result()), 4)
+        segments.append_rows(self.data, pd.DataFrame({'key': [5], 'group': ['x'], 'value': [50.0]}))
+        self.data = storage.get_data(self.data.pk)
+        self.assertEqual(len(self.run_pipeline([{'op': 'select', 'columns': ['key']}]).get_result()), 5)
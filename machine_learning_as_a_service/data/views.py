@@ -1,29 +1,295 @@
+import io
+import json
+
 import pandas as pd
 import requests
-
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
 
+from data import catalog, compaction, features, sampling, segments, sparse, storage
 from data.models import Data
+from data.pipeline import PipelineError, SampledSource, Source, build_pipeline
+from lepo.excs import ExceptionalResponse
+
+
+def compact_for_storage(stored, compact, category_threshold=None):
+    if compact:
+        return compaction.compact(stored, category_threshold=category_threshold)
+    return (stored, compaction.get_memory_report(stored))
+
+
+# Catalog of the stored data sets; see `data.catalog`
+list_data = catalog.DataCatalogHandler.get_view('handle_list')
+retrieve_data = catalog.DataCatalogHandler.get_view('handle_retrieve')
+
 
 # Create your views here.
-def save_csv_as_dataframe(request):
-    print("Save CSV as DataFrame")
+def save_csv_as_dataframe(request, csv_url=None, representation='auto', compact=True, category_threshold=None):
+    """
+    Import a CSV file from an URL.
+
+    Mostly-zero numeric data (such as one-hot or bag-of-words features) is stored sparse
+    unless `representation` says otherwise; see `data.sparse.read_csv`.
+    Unless `compact` is off, the data is compacted before it's stored; see `data.compaction`.
+    """
+    # Get CSV URL from the header parameter, or from a form post; default to None if not provided
+    csv_url = csv_url or request.POST.get('csv_url', None)
+    if not csv_url:
+        return JsonResponse({'error': 'csv_url is required'}, status=400)
+
+    try:
+        csv_data = sparse.read_csv(csv_url, representation=representation)
+    except ValueError as ve:
+        return JsonResponse({'error': str(ve)}, status=400)
+
+    csv_data, memory_report = compact_for_storage(csv_data, compact, category_threshold)
+
+    # Create Data Frame instance
+    data = Data()
+
+    # Add CSV Data to data_frame field
+    data.data_frame = csv_data
+    data.source_url = csv_url
+    catalog.set_metadata(data)
+
+    # Save Data Frame
+    data.save()
+    return {'data_frame_id': data.pk, 'memory': memory_report}
+
+
+def save_svmlight_as_dataframe(
+    request,
+    svmlight_url=None,
+    svmlight=None,
+    zero_based='auto',
+    n_features=None,
+    compact=True,
+):
+    """
+    Import an svmlight/libsvm formatted file, either from an URL or from the request body, as sparse data.
+    """
+    if svmlight_url:
+        lines = fetch_url(svmlight_url).splitlines()
+    elif svmlight:
+        lines = svmlight.splitlines()
+    else:
+        return JsonResponse({'error': 'Either svmlight_url or a body is required'}, status=400)
+
+    try:
+        sparse_frame = sparse.read_svmlight(
+            lines,
+            zero_based=(zero_based if zero_based == 'auto' else zero_based == 'true'),
+            n_features=n_features,
+        )
+    except ValueError as ve:
+        return JsonResponse({'error': str(ve)}, status=400)
+
+    sparse_frame, memory_report = compact_for_storage(sparse_frame, compact)
+    data = Data(data_frame=sparse_frame, source_url=svmlight_url)
+    catalog.set_metadata(data)
+    data.save()
+    return {'data_frame_id': data.pk, 'memory': memory_report}
+
+
+def append_data(request, data_id, csv_url=None, rows=None, compact=True):
+    """
+    Append rows to a stored dataset, from a CSV file at an URL or from the body (CSV text or a JSON list of objects).
+
+    See `data.segments`.
+    """
+    data = get_data_or_404(data_id)
+    try:
+        if csv_url:
+            frame = pd.read_csv(io.BytesIO(fetch_url(csv_url)))
+        elif isinstance(rows, str):
+            frame = pd.read_csv(io.StringIO(rows))
+        elif isinstance(rows, list):
+            frame = pd.DataFrame.from_records(rows)
+        else:
+            return JsonResponse({'error': 'Either csv_url or a body is required'}, status=400)
+        segment = segments.append_rows(data, frame, compact=compact)
+    except ValueError as ve:
+        return JsonResponse({'error': str(ve)}, status=400)
+    return {'data_frame_id': data.pk, 'version': segment.version, 'row_count': segment.row_count}
+
+
+def fetch_url(url):
+    """
+    Download data to import from an HTTP or HTTPS URL.
+
+    The download may take at most `DATA_FETCH_TIMEOUT` seconds between bytes received
+    and be at most `DATA_FETCH_MAX_BYTES` long.
+
+    :rtype: bytes
+    """
+    if not url.lower().startswith(('http://', 'https://')):
+        raise ExceptionalResponse(JsonResponse({'error': 'Only HTTP and HTTPS URLs can be fetched'}, status=400))
+    max_bytes = getattr(settings, 'DATA_FETCH_MAX_BYTES', 100 * 1024 * 1024)
+    try:
+        with requests.get(url, stream=True, timeout=getattr(settings, 'DATA_FETCH_TIMEOUT', 30)) as response:
+            if response.status_code != 200:
+                raise ExceptionalResponse(JsonResponse({'error': 'Fetching %s failed with status %d' % (
+                    url,
+                    response.status_code,
+                )}, status=400))
+            content = bytearray()
+            for chunk in response.iter_content(chunk_size=65536):
+                content.extend(chunk)
+                if len(content) > max_bytes:
+                    raise ExceptionalResponse(JsonResponse({'error': '%s is larger than %d bytes' % (
+                        url,
+                        max_bytes,
+                    )}, status=400))
+    except requests.RequestException as exc:
+        raise ExceptionalResponse(JsonResponse({'error': 'Fetching %s failed: %s' % (url, exc)}, status=400))
+    return bytes(content)
+
+
+def get_data_or_404(data_id):
+    try:
+        return storage.get_data(data_id)
+    except Data.DoesNotExist:
+        raise ExceptionalResponse(JsonResponse({'error': 'No data with ID %s' % data_id}, status=404))
+
+
+def get_pipeline_source(data_id):
+    return Source(get_data_or_404(data_id))
+
+
+def get_sample_spec(max_rows=None, sample_fraction=None, sample_seed=None):
+    """
+    Get the uniform sample that operations taking `max_rows`/`sample_fraction` parameters work on, if any.
+
+    The seed defaults to 0 (rather than a random one), so that repeated requests see the same rows.
+
+    :rtype: data.sampling.SampleSpec|None
+    """
+    if max_rows is None and sample_fraction is None:
+        return None
+    try:
+        return sampling.SampleSpec(
+            size=max_rows,
+            fraction=sample_fraction,
+            seed=(sample_seed if sample_seed is not None else 0),
+        )
+    except ValueError as ve:
+        raise ExceptionalResponse(JsonResponse({'error': str(ve)}, status=400))
+
+
+def render_frame_slice(frame, offset=0, limit=1000, extra=None):
+    """
+    Render rows `offset` to `offset + limit` of a frame as a `FrameSlice` response, with any `extra` properties.
+    """
+    # `DataFrame.to_json` knows how to deal with NaNs, timestamps etc., so splice its output in directly
+    return HttpResponse(
+        '{"columns":%s,"row_count":%d,"rows":%s%s}' % (
+            json.dumps([str(column) for column in frame.columns]),
+            len(frame),
+            frame.iloc[offset:offset + limit].to_json(orient='records', date_format='iso'),
+            ''.join(',%s:%s' % (json.dumps(key), json.dumps(value)) for (key, value) in sorted((extra or {}).items())),
+        ),
+        content_type='application/json',
+    )
+
+
+def sample_data(request, data_id, sample):
+    """
+    Sample a stored dataset in one pass, optionally storing the sample as a new dataset (see `data.sampling`).
+    """
+    data = get_data_or_404(data_id)
+    try:
+        spec = sampling.SampleSpec(
+            method=sample.get('method', 'uniform'),
+            size=sample.get('size'),
+            fraction=sample.get('fraction'),
+            column=sample.get('column'),
+            bucket=sample.get('bucket'),
+            seed=sample.get('seed'),
+        )
+        frame = sampling.sample_data(data, spec)
+    except (ValueError, KeyError) as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+
+    extra = {'sample': dict(spec.to_dict(), version=data.version)}
+    if sample.get('persist'):
+        extra['data_frame_id'] = sampling.save_sample(data, spec, frame, compact=sample.get('compact', True)).pk
+    return render_frame_slice(frame, int(sample.get('offset', 0)), int(sample.get('limit', 1000)), extra)
+
+
+def build_features(request, data_id, preprocessing=None, max_rows=None, sample_fraction=None, sample_seed=None):
+    """
+    Build (or find in the cache) the feature matrix of a stored dataset; see `data.features`.
+
+    With `max_rows` or `sample_fraction`, the matrix is built from a uniform sample of the dataset.
+    """
+    data = get_data_or_404(data_id)
+    spec = get_sample_spec(max_rows, sample_fraction, sample_seed)
+    try:
+        feature_matrix = features.get_feature_matrix(data, preprocessing, sample=spec)
+    except features.FeatureError as fe:
+        return JsonResponse({'error': str(fe)}, status=400)
+    return feature_matrix.get_info()
+
+
+def get_feature_matrix_or_404(feature_key):
+    feature_matrix = features.get_cached_feature_matrix(feature_key)
+    if feature_matrix is None:
+        raise ExceptionalResponse(JsonResponse({'error': 'No feature matrix %s' % feature_key}, status=404))
+    return feature_matrix
+
+
+def render_transformed(feature_matrix, frame):
+    try:
+        matrix = feature_matrix.transform(frame)
+    except features.FeatureError as fe:
+        return JsonResponse({'error': str(fe)}, status=400)
+    if feature_matrix.is_sparse:
+        matrix = matrix.toarray()
+    return {'feature_names': feature_matrix.feature_names, 'rows': matrix.tolist()}
+
+
+def transform_features(request, feature_key, rows):
+    """
+    Transform rows (e.g. for prediction) with the preprocessing fitted for a feature matrix.
+    """
+    feature_matrix = get_feature_matrix_or_404(feature_key)
+    return render_transformed(feature_matrix, pd.DataFrame.from_records(rows))
+
 
-    if (request.POST):
-        # Get CSV URL from post; default to None if not provided
-        csv_url = request.POST.get('csv_url', None)
+def transform_feature_array(request, feature_key, values, columns=None):
+    """
+    Transform numeric rows given as a binary array (see `lepo.ndarray`) like `transform_features`.
 
-        if (csv_url):
-            csv_data = pd.read_csv(csv_url)
+    The array's columns are the feature matrix's numeric input columns, unless `columns` names them.
+    """
+    feature_matrix = get_feature_matrix_or_404(feature_key)
+    if columns is None:
+        columns = feature_matrix.params['numeric']
+    if values.shape[1] != len(columns):
+        return JsonResponse({'error': 'The array has %d columns, but %d are named' % (values.shape[1], len(columns))}, status=400)
+    return render_transformed(feature_matrix, pd.DataFrame(values, columns=columns))
 
-            print(csv_data)
 
-            # Create Data Frame instance
-            data = Data()
+def run_data_pipeline(request, data_id, pipeline, max_rows=None, sample_fraction=None, sample_seed=None):
+    """
+    Evaluate a transformation pipeline over a stored dataset (see `data.pipeline.build_pipeline`).
 
-            # Add CSV Data to data_frame field
-            data.data_frame = csv_data
-            data.source_url = csv_url
+    With `max_rows` or `sample_fraction`, the pipeline runs over a uniform sample of the dataset
+    (joined datasets are not sampled).
+    """
+    spec = get_sample_spec(max_rows, sample_fraction, sample_seed)
+    if spec is not None:
+        source = SampledSource(get_data_or_404(data_id), spec)
+    else:
+        source = get_pipeline_source(data_id)
+    try:
+        node = build_pipeline(source, pipeline.get('steps', []), get_source=get_pipeline_source)
+    except PipelineError as pe:
+        return JsonResponse({'error': str(pe)}, status=400)
+    try:
+        frame = node.get_result()
+    except (KeyError, TypeError, ValueError) as exc:  # Whatever the checks in `build_pipeline` can't foresee
+        return JsonResponse({'error': 'Evaluating the pipeline failed: %s' % exc}, status=400)
 
-            # Save Data Frame
-            data.save()
+    return render_frame_slice(frame, int(pipeline.get('offset', 0)), int(pipeline.get('limit', 1000)))
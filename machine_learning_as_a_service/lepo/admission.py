@@ -0,0 +1,309 @@
+"""
+Admission control: per-operation concurrency limits with bounded wait queues.
+
+Limits are configured per operation ID, either in the `OPERATIONS` key of the `LEPO_ADMISSION` setting
+or with an `x-lepo-concurrency` extension on the operation in the API spec (the setting wins):
+
+    x-lepo-concurrency:
+      concurrency: 2   # at most this many requests run at once (across all worker processes)
+      queue: 8         # at most this many more wait for a slot; others are rejected right away
+      timeout: 30      # seconds to wait in the queue before giving up
+
+(`x-lepo-concurrency: 2` is short for `{concurrency: 2}`.)
+
+The limits hold across processes: every running or waiting request holds an exclusive `flock`
+on one of the operation's slot files in `LOCK_DIR`.  The OS releases the locks of a process that
+dies, so slots never leak.  Rejected requests get a fast `REJECT_STATUS` response with `Retry-After`.
+Streamed responses hold their slot until the whole body has been sent.
+
+Use `get_admission_urls()` to mount a metrics view reporting the in-flight and queued requests.
+The metrics are read from the process IDs that holders write into the slot files, never by
+probing the locks themselves, so reading them can't get in the way of requests.
+Only staff users may read them, or scrapers sending `Authorization: Bearer <METRICS_SECRET>`.
+"""
+import os
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.conf.urls import url
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.utils.crypto import constant_time_compare
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+DEFAULTS = {
+    'LOCK_DIR': None,  # Where the slot files live; admission control is off if unset
+    'OPERATIONS': {},  # Mapping of operation ID to limits (overrides the spec)
+    'QUEUE': 0,  # Default queue size
+    'TIMEOUT': 10,  # Default seconds to wait in the queue
+    'REJECT_STATUS': 503,
+    'RETRY_AFTER': 1,  # Seconds, for the `Retry-After` header
+    'POLL_INTERVAL': 0.05,  # Longest time between attempts to get a slot while queued
+    'METRICS_SECRET': None,  # Bearer token that allows reading the metrics without being staff
+}
+
+SPEC_EXTENSION = 'x-lepo-concurrency'
+
+_created_directories = set()
+
+
+def get_admission_options():
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'LEPO_ADMISSION', None) or {})
+    return options
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, operation_id, reason, options):
+        self.operation_id = operation_id
+        self.reason = reason
+        self.options = options
+        super(AdmissionRejected, self).__init__('%s: %s' % (operation_id, reason))
+
+    def get_response(self):
+        response = JsonResponse({'error': self.reason}, status=self.options['REJECT_STATUS'])
+        response['Retry-After'] = str(self.options['RETRY_AFTER'])
+        return response
+
+
+class Slot:
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = None
+
+    def try_acquire(self):
+        file = open(self.filename, 'a')
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return False
+        # Record the holder for `is_held()`
+        file.truncate(0)
+        file.write(str(os.getpid()))
+        file.flush()
+        self.file = file
+        return True
+
+    def is_held(self):
+        """
+        Check whether some live process holds this slot, going by the process ID the holder wrote into it.
+
+        The lock itself isn't touched.  (A holder that died without releasing the slot left its
+        process ID behind, but its lock is gone, so it is not counted.)
+        """
+        try:
+            with open(self.filename) as file:
+                pid = file.read().strip()
+        except FileNotFoundError:
+            return False
+        return bool(pid.isdigit() and is_alive(int(pid)))
+
+    def release(self):
+        if self.file:
+            self.file.truncate(0)
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # Exists, but isn't ours
+        return True
+    return True
+
+
+class OperationLimiter:
+    def __init__(self, operation_id, concurrency, queue, timeout, options):
+        self.operation_id = operation_id
+        self.concurrency = concurrency
+        self.queue = queue
+        self.timeout = timeout
+        self.options = options
+        directory = options['LOCK_DIR']
+        if directory not in _created_directories:
+            os.makedirs(directory, exist_ok=True)
+            _created_directories.add(directory)
+        self.running_slots = [self.get_slot('running', index) for index in range(concurrency)]
+        self.queue_slots = [self.get_slot('queued', index) for index in range(queue)]
+
+    def get_slot(self, kind, index):
+        return Slot(os.path.join(self.options['LOCK_DIR'], '%s.%s-%d' % (self.operation_id, kind, index)))
+
+    def try_acquire_any(self, slots):
+        # Starting at a random slot keeps concurrent requests from all contending for the first one
+        offset = random.randrange(len(slots)) if slots else 0
+        for slot in slots[offset:] + slots[:offset]:
+            if slot.try_acquire():
+                return slot
+        return None
+
+    def wait_for_slot(self):
+        deadline = time.time() + self.timeout
+        interval = 0.001
+        while True:
+            slot = self.try_acquire_any(self.running_slots)
+            if slot or time.time() >= deadline:
+                return slot
+            time.sleep(min(interval, max(deadline - time.time(), 0)))
+            interval = min(interval * 2, self.options['POLL_INTERVAL'])
+
+    def acquire(self):
+        """
+        Wait for a free slot (in the queue, if there's room).
+
+        :raises AdmissionRejected: if the queue is full or the wait times out.
+        :return: The slot; the caller must `release()` it.
+        :rtype: Slot
+        """
+        slot = self.try_acquire_any(self.running_slots)
+        if not slot:
+            queue_slot = self.try_acquire_any(self.queue_slots)
+            if not queue_slot:
+                raise AdmissionRejected(self.operation_id, 'Too many concurrent requests; try again later', self.options)
+            try:
+                slot = self.wait_for_slot()
+            finally:
+                queue_slot.release()
+            if not slot:
+                raise AdmissionRejected(self.operation_id, 'Timed out waiting for a free slot', self.options)
+        return slot
+
+    @contextmanager
+    def admit(self):
+        """
+        Run the body of the `with` statement once a slot is free.
+
+        :raises AdmissionRejected: if the queue is full or the wait times out.
+        """
+        slot = self.acquire()
+        try:
+            yield
+        finally:
+            slot.release()
+
+    def admit_response(self, get_response):
+        """
+        Get a response once a slot is free, holding the slot until a streamed response's body is sent.
+
+        :param get_response: Function returning the response.
+        :raises AdmissionRejected: if the queue is full or the wait times out.
+        """
+        slot = self.acquire()
+        try:
+            response = get_response()
+        except BaseException:
+            slot.release()
+            raise
+        if getattr(response, 'streaming', False):
+            # Django closes the content iterator once the response is done with, even if it wasn't exhausted
+            response.streaming_content = release_after(response.streaming_content, slot)
+        else:
+            slot.release()
+        return response
+
+    def get_metrics(self):
+        return {
+            'concurrency': self.concurrency,
+            'queue': self.queue,
+            'running': sum(slot.is_held() for slot in self.running_slots),
+            'queued': sum(slot.is_held() for slot in self.queue_slots),
+        }
+
+
+def release_after(content, slot):
+    try:
+        for chunk in content:
+            yield chunk
+    finally:
+        slot.release()
+
+
+def get_limits(operation, options):
+    limits = options['OPERATIONS'].get(operation.id)
+    if limits is None:
+        limits = operation.data.get(SPEC_EXTENSION)
+    if isinstance(limits, int):
+        limits = {'concurrency': limits}
+    return limits
+
+
+def get_operation_limiter(operation):
+    """
+    Get the limiter for an operation, if it is limited at all.
+
+    :type operation: lepo.operation.Operation
+    :rtype: OperationLimiter|None
+    """
+    options = get_admission_options()
+    if fcntl is None or not options['LOCK_DIR']:
+        return None
+    limits = get_limits(operation, options)
+    if not limits:
+        return None
+    return OperationLimiter(
+        operation_id=operation.id,
+        concurrency=int(limits['concurrency']),
+        queue=int(limits.get('queue', options['QUEUE'])),
+        timeout=float(limits.get('timeout', options['TIMEOUT'])),
+        options=options,
+    )
+
+
+def format_metrics(metrics):
+    """
+    Format metrics in the Prometheus text exposition format.
+
+    :param metrics: Mapping of operation ID to `OperationLimiter.get_metrics()` output.
+    :rtype: str
+    """
+    lines = []
+    for key, description in (
+        ('running', 'Requests currently running'),
+        ('queued', 'Requests currently waiting for a slot'),
+        ('concurrency', 'Maximum number of requests running at once'),
+        ('queue', 'Maximum number of requests waiting for a slot'),
+    ):
+        name = 'lepo_admission_%s' % key
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s gauge' % name)
+        for operation_id, values in sorted(metrics.items()):
+            lines.append('%s{operation="%s"} %d' % (name, operation_id, values[key]))
+    return '\n'.join(lines) + '\n'
+
+
+def is_authorized(request, options):
+    if getattr(getattr(request, 'user', None), 'is_staff', False):
+        return True
+    secret = options['METRICS_SECRET']
+    value = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(secret and value.startswith('Bearer ') and constant_time_compare(value[len('Bearer '):], secret))
+
+
+def get_admission_metrics(request, router):
+    if not is_authorized(request, get_admission_options()):
+        return HttpResponseForbidden('Staff access or the metrics secret is required')
+    metrics = {}
+    for path in router.get_paths():
+        for operation in path.get_operations():
+            limiter = get_operation_limiter(operation)
+            if limiter:
+                metrics[operation.id] = limiter.get_metrics()
+    if request.GET.get('format') == 'json':
+        return JsonResponse(metrics)
+    return HttpResponse(format_metrics(metrics), content_type='text/plain; version=0.0.4')
+
+
+def get_admission_urls(router, metrics_url='_admission/metrics'):
+    return [
+        url(r'%s$' % metrics_url, get_admission_metrics, kwargs={'router': router}, name='lepo_admission_metrics'),
+    ]
@@ -0,0 +1,247 @@
+"""
+Running many API operations in one HTTP request.
+
+`execute_batch` is a handler for an operation taking a body like
+
+    {
+      "parallel": false,
+      "requests": [
+        {"id": "a", "operation_id": "run_data_pipeline", "parameters": {"data_id": 3}, "body": {...}},
+        {"id": "b", "method": "POST", "path": "/data/3/pipeline", "body": {...}},
+        ...
+      ]
+    }
+
+Every sub-request is turned into a request of its own and dispatched through the operation's
+`PathView`, so parameters are read and validated, handlers are called and responses are
+transformed exactly as if they had come in over HTTP (admission control and all).
+Parameters are given by name with JSON values; the body goes in `body`.
+
+The response lists a `{"id", "status", "headers", "body"}` result for every sub-request, in order.
+
+Add the handler with `router.add_handlers({'execute_batch': execute_batch})`.
+"""
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest, JsonResponse, QueryDict
+from django.utils.encoding import force_text
+
+from lepo.excs import InvalidOperation
+from lepo.path import PATH_PLACEHOLDER_REGEX
+from lepo.profiling import get_header_meta_name, get_profiling_options
+
+log = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MAX_REQUESTS': 100,  # Sub-requests per batch
+    'MAX_WORKERS': 8,  # Threads per batch when running in parallel
+}
+
+COLLECTION_FORMAT_SEPARATORS = {
+    'csv': ',',
+    'ssv': ' ',
+    'tsv': '\t',
+    'pipes': '|',
+}
+
+# Headers of the batch request that mustn't carry over to its sub-requests: the body's, conditional
+# request headers, and credentials (sub-requests get the batch request's `user` and `session` instead).
+# The profiling header (see `lepo.profiling`) is skipped too, so the batch is profiled as a whole.
+SKIPPED_META_KEYS = {'CONTENT_TYPE', 'CONTENT_LENGTH', 'HTTP_IF_MATCH', 'HTTP_IF_NONE_MATCH',
+                     'HTTP_IF_MODIFIED_SINCE', 'HTTP_IF_UNMODIFIED_SINCE',
+                     'HTTP_AUTHORIZATION', 'HTTP_PROXY_AUTHORIZATION', 'HTTP_COOKIE', 'HTTP_X_CSRFTOKEN'}
+
+
+def get_skipped_meta_keys():
+    return SKIPPED_META_KEYS | {get_header_meta_name(get_profiling_options()['HEADER'])}
+
+
+def get_batch_options():
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'LEPO_BATCH', None) or {})
+    return options
+
+
+class BatchItemError(Exception):
+    def __init__(self, status, message):
+        self.status = status
+        self.message = message
+        super(BatchItemError, self).__init__(message)
+
+
+def format_parameter_value(parameter, value):
+    """
+    Format a JSON value the way it'd appear in a query string or header.
+    """
+    if parameter.get('type') == 'array' and isinstance(value, (list, tuple)):
+        collection_format = parameter.get('collectionFormat', 'csv')
+        if collection_format == 'multi':
+            return [format_parameter_value(parameter['items'], item) for item in value]
+        separator = COLLECTION_FORMAT_SEPARATORS[collection_format]
+        return separator.join(format_parameter_value(parameter['items'], item) for item in value)
+    if isinstance(value, bool):
+        return ('true' if value else 'false')
+    return force_text(value)
+
+
+class BatchResolver:
+    """
+    Finds the path and operation for sub-requests.
+    """
+
+    def __init__(self, router):
+        self.router = router
+        self.paths = list(router.get_paths())
+        self.operations = {}
+        for path in self.paths:
+            for operation in path.get_operations():
+                self.operations[operation.id] = (path, operation.method)
+
+    def resolve(self, item):
+        """
+        :return: The Path, method, path kwargs and request path for a sub-request.
+        :rtype: tuple[lepo.path.Path, str, dict, str]
+        """
+        if item.get('operation_id'):
+            if item['operation_id'] not in self.operations:
+                raise BatchItemError(404, 'No operation %s' % item['operation_id'])
+            path, method = self.operations[item['operation_id']]
+            method = method.upper()
+            kwargs = {}
+            for parameter in path.get_operation(method).parameters:
+                if parameter['in'] == 'path' and parameter['name'] in item.get('parameters', {}):
+                    kwargs[parameter['name']] = force_text(item['parameters'][parameter['name']])
+            request_path = re.sub(PATH_PLACEHOLDER_REGEX, lambda m: kwargs.get(m.group(1), ''), path.path)
+            return (path, method, kwargs, request_path)
+        if item.get('path'):
+            request_path = item['path'].split('?', 1)[0].lstrip('/')
+            for path in self.paths:
+                match = re.match(path.regex, request_path)
+                if match:
+                    return (path, item.get('method', 'GET').upper(), match.groupdict(), '/%s' % request_path)
+            raise BatchItemError(404, 'No path matches %s' % item['path'])
+        raise BatchItemError(400, 'Either operation_id or path is required')
+
+
+def build_sub_request(parent, path, method, request_path, item):
+    """
+    Build a request for a sub-request of the batch request `parent`.
+
+    :type parent: HttpRequest
+    :rtype: HttpRequest
+    """
+    request = HttpRequest()
+    request.method = method
+    request.path = request.path_info = request_path
+    skipped_meta_keys = get_skipped_meta_keys()
+    request.META = {key: value for (key, value) in parent.META.items() if key not in skipped_meta_keys}
+    request.META['REQUEST_METHOD'] = method
+    for attribute in ('user', 'session'):
+        if hasattr(parent, attribute):
+            setattr(request, attribute, getattr(parent, attribute))
+
+    query = QueryDict(item['path'].split('?', 1)[1] if '?' in item.get('path', '') else '', mutable=True)
+    form = QueryDict('', mutable=True)
+    try:
+        operation = path.get_operation(method)
+    except InvalidOperation as io:
+        raise BatchItemError(405, str(io))
+    parameters = item.get('parameters', {})
+    for parameter in operation.parameters:
+        if parameter['name'] not in parameters or parameter['in'] in ('path', 'body'):
+            continue
+        value = format_parameter_value(parameter, parameters[parameter['name']])
+        if parameter['in'] == 'header':
+            request.META['HTTP_%s' % parameter['name'].upper().replace('-', '_')] = value
+        else:
+            target = (form if parameter['in'] == 'formData' else query)
+            if isinstance(value, list):
+                target.setlist(parameter['name'], value)
+            else:
+                target[parameter['name']] = value
+    request.GET = query
+    request.POST = form
+
+    body = item.get('body')
+    request._body = b''
+    if body is not None:
+        request.content_type = item.get('content_type') or ('text/plain' if isinstance(body, str) else 'application/json')
+        request.content_params = {'charset': 'UTF-8'}
+        request._body = (body if isinstance(body, str) else json.dumps(body)).encode('utf-8')
+        request.META['CONTENT_TYPE'] = '%s; charset=UTF-8' % request.content_type
+        request.META['CONTENT_LENGTH'] = str(len(request._body))
+    return request
+
+
+def get_response_body(response):
+    if response.streaming:
+        content = b''.join(response.streaming_content)
+    else:
+        content = response.content
+    if not content:
+        return None
+    content_type = response.get('Content-Type', '')
+    text = content.decode(response.charset)
+    if content_type.startswith('application/json'):
+        return json.loads(text)
+    return text
+
+
+def execute_item(parent, resolver, item):
+    """
+    Execute one sub-request of a batch.
+
+    :rtype: dict
+    """
+    result = {'id': item.get('id')}
+    try:
+        path, method, kwargs, request_path = resolver.resolve(item)
+        request = build_sub_request(parent, path, method, request_path, item)
+        operation_id = path.get_operation(method).id
+        if operation_id == parent.api_info.operation.id:
+            raise BatchItemError(400, 'Batches may not be nested')
+        response = path.view_class.as_view()(request, **kwargs)
+        result.update(
+            status=response.status_code,
+            headers=dict(response.items()),
+            body=get_response_body(response),
+        )
+    except BatchItemError as bie:
+        result.update(status=bie.status, headers={}, body={'error': bie.message})
+    except Exception:
+        log.exception('Batch item %r failed', item.get('id'))
+        result.update(status=500, headers={}, body={'error': 'Internal error'})
+    return result
+
+
+def execute_item_in_thread(parent, resolver, item):
+    try:
+        return execute_item(parent, resolver, item)
+    finally:
+        # Worker threads get database connections of their own; don't leave them open
+        connections.close_all()
+
+
+def execute_batch(request, batch):
+    """
+    Execute the sub-requests of a batch, in order or in parallel.
+
+    :param batch: `{"requests": [...], "parallel": bool}`, see the module docstring.
+    :type batch: dict
+    """
+    options = get_batch_options()
+    items = batch.get('requests') or []
+    if len(items) > options['MAX_REQUESTS']:
+        return JsonResponse({'error': 'At most %d requests are allowed per batch' % options['MAX_REQUESTS']}, status=400)
+    resolver = BatchResolver(request.api_info.router)
+    if batch.get('parallel') and len(items) > 1:
+        with ThreadPoolExecutor(max_workers=min(options['MAX_WORKERS'], len(items))) as executor:
+            results = list(executor.map(lambda item: execute_item_in_thread(request, resolver, item), items))
+    else:
+        results = [execute_item(request, resolver, item) for item in items]
+    return JsonResponse({'results': results})
@@ -13,13 +13,24 @@ def {func_name}(request, {parameters}):
 '''.strip()
 
 
+def iterate_operations(router):
+    """
+    Iterate over every operation of every path in the router's API.
+
+    :type router: lepo.router.Router
+    :rtype: Iterable[lepo.operation.Operation]
+    """
+    for path in router.get_paths():
+        for operation in path.get_operations():
+            yield operation
+
+
 def generate_handler_stub(router, handler_template=HANDLER_TEMPLATE):
     output = StringIO()
     func_name_to_operation = {}
-    for path in router.get_paths():
-        for operation in path.get_operations():
-            snake_operation_id = camel_case_to_spaces(operation.id).replace(' ', '_')
-            func_name_to_operation[snake_operation_id] = operation
+    for operation in iterate_operations(router):
+        snake_operation_id = camel_case_to_spaces(operation.id).replace(' ', '_')
+        func_name_to_operation[snake_operation_id] = operation
     for func_name, operation in sorted(func_name_to_operation.items()):
         parameter_names = [p['name'] for p in operation.parameters]
         handler = handler_template.format(
@@ -1,3 +1,26 @@
 def csrf_exempt(view):
     view.csrf_exempt = True
     return view
+
+
+def condition(etag_func=None, last_modified_func=None):
+    """
+    Enable conditional request handling (ETag/Last-Modified, 304/412) for a handler.
+
+    The functions are called with the same arguments as the handler, but before it;
+    they should be cheap (e.g. read a version number or content hash, not the object itself)
+    and may return None if there's nothing to compare against.
+
+    `last_modified_func` should return a datetime.
+    """
+    def condition_func(request, **kwargs):
+        return (
+            (etag_func(request, **kwargs) if etag_func else None),
+            (last_modified_func(request, **kwargs) if last_modified_func else None),
+        )
+
+    def decorator(handler):
+        handler.condition_func = condition_func
+        return handler
+
+    return decorator
@@ -15,6 +15,13 @@ class ErroneousParameters(Exception):
         self.errors = error_map
         self.parameters = parameters
 
+    def get_response(self):
+        from django.http import JsonResponse
+        return JsonResponse({
+            'error': 'Invalid parameters',
+            'parameters': {name: str(error) for (name, error) in self.errors.items()},
+        }, status=400)
+
 
 class InvalidBodyFormat(ValueError):
     pass
@@ -24,6 +31,10 @@ class InvalidBodyContent(ValueError):
     pass
 
 
+class InvalidArray(ValueError):
+    pass
+
+
 class RouterValidationError(Exception):
     def __init__(self, error_map):
         self.errors = error_map
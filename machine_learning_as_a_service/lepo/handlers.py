@@ -1,13 +1,34 @@
-from copy import deepcopy
+import base64
+import itertools
+import json
+import threading
 from functools import wraps
 
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils.module_loading import import_string
 
+from lepo.excs import ExceptionalResponse
+
+# (schema class, schema kwargs) -> schema instance, per thread (as schema instances aren't thread-safe)
+_schema_cache = threading.local()
+
+
+def get_schema_cache():
+    try:
+        return _schema_cache.schemas
+    except AttributeError:
+        _schema_cache.schemas = {}
+        return _schema_cache.schemas
+
 
 class BaseHandler:
     def __init__(self, request, args):
         self.request = request
         self.args = args
+        self.prepared = set()
 
     @classmethod
     def get_view(cls, method_name):
@@ -18,10 +39,22 @@ class BaseHandler:
         :return: View function
         """
         method = getattr(cls, method_name)
+        purpose = method_name.replace('handle_', '', 1)
+
+        def condition_func(request, **kwargs):
+            # The validators tell whether (and in which version) the object exists, so they may only be
+            # looked at once the processors (e.g. for authorization) the request would go through have passed;
+            # the handler is kept for the view, so they aren't called twice.
+            handler = cls(request, kwargs)
+            handler.prepare('view', purpose)
+            request._lepo_prepared_handler = handler
+            return handler.get_condition(purpose)
 
         @wraps(method)
         def view(request, **kwargs):
-            handler = cls(request, kwargs)
+            handler = request.__dict__.pop('_lepo_prepared_handler', None)
+            if not (isinstance(handler, cls) and handler.args == kwargs):
+                handler = cls(request, kwargs)
             handler.call_processors('view')
             response = None
             try:
@@ -30,18 +63,41 @@ class BaseHandler:
             finally:
                 handler.call_processors('post_view', response=response)
 
+        view.condition_func = condition_func
         return view
 
+    def get_condition(self, purpose):
+        """
+        Get validators for conditional requests (see `lepo.decorators.condition`).
+
+        This is called before the handler method itself (but after the `view` processors
+        and those for `purpose`), so it should be cheap.
+
+        :return: (ETag, last modified datetime), either of which may be None
+        :rtype: tuple[str|None, datetime.datetime|None]
+        """
+        return (None, None)
+
     def get_processors(self, purpose):
         return getattr(self, '%s_processors' % purpose, ())
 
     def call_processors(self, purpose, **kwargs):
+        if purpose in self.prepared:  # Already called by `prepare()`
+            return
         for proc in self.get_processors(purpose):
             if isinstance(proc, str):
                 proc = getattr(self, proc, None) or import_string(proc)
             kwargs['purpose'] = purpose
             proc(**kwargs)
 
+    def prepare(self, *purposes):
+        """
+        Call the processors for `purposes` ahead of time; they won't be called again by this handler.
+        """
+        for purpose in purposes:
+            self.call_processors(purpose)
+            self.prepared.add(purpose)
+
 
 class BaseModelHandler(BaseHandler):
     model = None
@@ -51,20 +107,54 @@ class BaseModelHandler(BaseHandler):
     id_data_name = 'id'
     id_field_name = 'pk'
 
+    # Fields to read the validators for conditional requests on single objects from
+    # (e.g. a content hash or version field, and a modification timestamp field).
+    etag_field_name = None
+    last_modified_field_name = None
+
+    # Whether schema instances may be reused between requests (served by the same thread).
+    # Turn this off if your schemas keep per-request state (such as `context`).
+    cache_schemas = True
+
     def get_schema(self, purpose, object=None):
         schema_class = getattr(self, '%s_schema_class' % purpose, None)
         if schema_class is None:
             schema_class = self.schema_class
         kwargs = {}
-        if purpose == 'update':
+        if purpose in ('update', 'bulk_update'):
             kwargs['partial'] = True
-        return schema_class(**kwargs)
+        if not self.cache_schemas:
+            return schema_class(**kwargs)
+        key = (schema_class, tuple(sorted(kwargs.items())))
+        schemas = get_schema_cache()
+        schema = schemas.get(key)
+        if schema is None:
+            schema = schemas[key] = schema_class(**kwargs)
+        return schema
 
     def get_queryset(self, purpose):
         queryset = getattr(self, '%s_queryset' % purpose, None)
         if queryset is None:
             queryset = self.queryset
-        return deepcopy(queryset)
+        return queryset.all()  # A fresh clone, so nothing done to it leaks into the class attribute
+
+    def get_condition(self, purpose):
+        """
+        Read the validator fields for the object addressed by the request, without loading the object itself.
+        """
+        fields = [field for field in (self.etag_field_name, self.last_modified_field_name) if field]
+        if not fields or self.id_data_name not in self.args:
+            return (None, None)
+        values = self.get_queryset('retrieve').filter(
+            **{self.id_field_name: self.args[self.id_data_name]}
+        ).values_list(*fields).first()
+        if values is None:  # Nonexistent; let the handler deal with it
+            return (None, None)
+        values = dict(zip(fields, values))
+        return (
+            values.get(self.etag_field_name),
+            values.get(self.last_modified_field_name),
+        )
 
     def process_object_list(self, purpose, object_list):
         return object_list
@@ -76,13 +166,152 @@ class BaseModelHandler(BaseHandler):
         return object
 
 
+def encode_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value, cls=DjangoJSONEncoder).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+
+
+def stream_json(prefix, records, suffix, chunk_size=500):
+    """
+    Generate the JSON encoding of `records` as a list, between `prefix` and `suffix`.
+
+    Records are encoded one at a time and yielded in chunks of `chunk_size` records,
+    except for the first one, which is yielded on its own (see `start_streaming()`).
+    `suffix` may be a callable, in which case it's called once the records have been exhausted.
+    """
+    encoder = DjangoJSONEncoder()
+    chunk = [prefix, '[']
+    for index, record in enumerate(records):
+        if index:
+            chunk.append(',')
+        chunk.append(encoder.encode(record))
+        if index == 0 or len(chunk) >= chunk_size * 2:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append(']')
+    chunk.append(suffix() if callable(suffix) else suffix)
+    yield ''.join(chunk)
+
+
+def start_streaming(content):
+    """
+    Produce the first chunk of streamed `content` (such as `stream_json()`'s) right away.
+
+    Errors producing it (e.g. serializing the first record) are thus raised before the response starts,
+    and turn into error responses as usual.  Once the response has started, its status has been sent,
+    so an error producing a later chunk can only cut the response short.
+
+    :rtype: Iterable[str]
+    """
+    content = iter(content)
+    return itertools.chain([next(content, '')], content)
+
+
 class ModelHandlerReadMixin(BaseModelHandler):
+    """
+    Listing supports keyset pagination: when a limit is given (or `list_default_limit` is set),
+    objects are ordered by `list_cursor_field_name` (which must be unique) and the result is
+    `{"results": [...], "next": cursor}`, where `next` is to be passed back as the cursor parameter
+    to get the next page (and is null on the last page).  Without a limit, the result is a plain list.
+
+    Objects are read with `QuerySet.iterator()` and serialized one by one; with `list_stream`,
+    the serialized records are also streamed out as they are produced.  As `iterator()` doesn't
+    prefetch related objects, querysets with `prefetch_related()` lookups are read in (ordered) batches
+    of `list_prefetch_batch_size` objects instead, or all at once if they aren't ordered.
+
+    When streaming, the response starts once the first record has been serialized, so an error
+    serializing a later record cuts the response short, leaving its JSON incomplete (with a 200 status).
+    """
+    list_cursor_data_name = 'cursor'
+    list_limit_data_name = 'limit'
+    list_cursor_field_name = 'pk'
+    list_default_limit = None
+    list_max_limit = 1000
+    list_stream = False
+    list_prefetch_batch_size = 100
+
+    def get_list_limit(self):
+        limit = self.args.get(self.list_limit_data_name, self.list_default_limit)
+        if limit is None:
+            return None
+        return max(1, min(int(limit), self.list_max_limit))
+
+    def paginate_queryset(self, queryset, limit):
+        field_name = self.list_cursor_field_name
+        queryset = queryset.order_by(field_name)
+        cursor = self.args.get(self.list_cursor_data_name)
+        if cursor:
+            try:
+                queryset = queryset.filter(**{'%s__gt' % field_name: decode_cursor(cursor)})
+            except (TypeError, ValueError, ValidationError):  # Not a cursor, or not one for this field
+                raise ExceptionalResponse(JsonResponse({'error': 'invalid cursor %r' % cursor}, status=400))
+        return queryset[:limit]
+
+    def iterate_records(self, schema, object_list, state):
+        """
+        Serialize objects one by one, keeping track of the last object and the count in `state`.
+        """
+        for object in self.iterate_objects(object_list):
+            state['last'] = object
+            state['count'] += 1
+            yield schema.dump(object).data
+
+    def iterate_objects(self, object_list):
+        if not hasattr(object_list, 'iterator'):
+            return object_list
+        if not getattr(object_list, '_prefetch_related_lookups', None):
+            return object_list.iterator()
+        if not object_list.ordered:
+            return iter(object_list)
+        return self.iterate_batches(object_list, self.list_prefetch_batch_size)
+
+    def iterate_batches(self, queryset, batch_size):
+        start = 0
+        while True:
+            batch = list(queryset[start:start + batch_size])  # Evaluated with its prefetches
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            start += batch_size
+
+    def get_next_cursor(self, state, limit):
+        if state['count'] < limit:
+            return None
+        return encode_cursor(getattr(state['last'], self.list_cursor_field_name))
+
     def handle_list(self):
         self.call_processors('list')
         queryset = self.get_queryset('list')
+        limit = self.get_list_limit()
+        if limit is not None:
+            queryset = self.paginate_queryset(queryset, limit)
         object_list = self.process_object_list('list', queryset)
         schema = self.get_schema('list')
-        return schema.dump(object_list, many=True).data
+        state = {'last': None, 'count': 0}
+        records = self.iterate_records(schema, object_list, state)
+
+        if limit is None:
+            if self.list_stream:
+                return StreamingHttpResponse(
+                    start_streaming(stream_json('', records, '')),
+                    content_type='application/json',
+                )
+            return list(records)
+
+        if self.list_stream:
+            return StreamingHttpResponse(
+                start_streaming(stream_json(
+                    '{"results":',
+                    records,
+                    lambda: ',"next":%s}' % json.dumps(self.get_next_cursor(state, limit)),
+                )),
+                content_type='application/json',
+            )
+        results = list(records)
+        return {'results': results, 'next': self.get_next_cursor(state, limit)}
 
     def handle_retrieve(self):
         self.call_processors('retrieve')
@@ -136,6 +365,237 @@ class ModelHandlerDeleteMixin(BaseModelHandler):
         self.call_processors('post_delete', object=object)
 
 
+class BulkModelHandlerMixin(BaseModelHandler):
+    """
+    Common machinery for the bulk mixins.
+
+    Bulk operations take a list of records, validate them all at once and write all valid ones
+    in a single transaction.  The result is `{"results": [...], "errors": {index: error}}`,
+    where `results` is aligned with the input (`null` for failed items).
+
+    With `bulk_all_or_nothing`, nothing is written if any item fails.
+    """
+    bulk_all_or_nothing = False
+    bulk_batch_size = None
+
+    def load_bulk_records(self, purpose, records):
+        """
+        Validate `records` with the purpose's schema in one go.
+
+        :return: (loaded data by index, errors by index)
+        :rtype: tuple[dict[int, object], dict[int, object]]
+        """
+        schema = self.get_schema(purpose)
+        result = schema.load(records, many=True)
+        errors = dict(result.errors or {})
+        data = {
+            index: datum
+            for (index, datum) in enumerate(result.data)
+            if index not in errors
+        }
+        return (data, errors)
+
+    def clean_bulk_object(self, object, index, errors):
+        try:
+            object.full_clean(validate_unique=False)  # Uniqueness is left to the database; no query per object
+        except ValidationError as ve:
+            errors[index] = ve.message_dict
+            return False
+        return True
+
+    def clean_bulk_ids(self, ids, errors):
+        """
+        Convert object IDs to the type of the ID field; IDs that can't be converted are errors.
+
+        :param ids: IDs by index
+        :type ids: dict[int, object]
+        :return: Converted IDs by index
+        :rtype: dict[int, object]
+        """
+        meta = self.model._meta
+        field = (meta.pk if self.id_field_name == 'pk' else meta.get_field(self.id_field_name))
+        cleaned = {}
+        for index, id in ids.items():
+            try:
+                cleaned[index] = field.to_python(id)
+            except ValidationError as ve:
+                errors[index] = {self.id_data_name: ve.messages}
+        return cleaned
+
+    def should_write(self, errors):
+        return not (errors and self.bulk_all_or_nothing)
+
+    def format_bulk_result(self, purpose, count, objects_by_index, errors):
+        schema = self.get_schema(purpose)
+        results = [None] * count
+        if self.should_write(errors):
+            for index, object in objects_by_index.items():
+                results[index] = schema.dump(object).data
+        return {'results': results, 'errors': errors}
+
+
+class ModelHandlerBulkCreateMixin(BulkModelHandlerMixin):
+    bulk_create_data_name = 'data'
+
+    def handle_bulk_create(self):
+        self.call_processors('bulk_create')
+        records = self.args[self.bulk_create_data_name]
+        data, errors = self.load_bulk_records('bulk_create', records)
+        objects_by_index = {}
+        for index, datum in data.items():
+            object = (datum if isinstance(datum, self.model) else self.model(**datum))
+            if self.clean_bulk_object(object, index, errors):
+                objects_by_index[index] = object
+
+        if self.should_write(errors) and objects_by_index:
+            queryset = self.get_queryset('bulk_create')
+            with transaction.atomic(using=queryset.db):
+                objects = self.write_bulk_create(queryset, list(objects_by_index.values()))
+                objects_by_index = dict(zip(objects_by_index, objects))
+                self.call_processors('post_bulk_create', objects=objects)
+        return self.format_bulk_result('post_bulk_create', len(records), objects_by_index, errors)
+
+    def write_bulk_create(self, queryset, objects):
+        """
+        Insert the objects, making sure they get their primary keys.
+
+        Only some databases (e.g. PostgreSQL) return the primary keys of bulk inserted rows.
+        On SQLite, rows inserted within a transaction get consecutive row IDs, so objects with
+        automatic primary keys are bulk inserted too, and numbered back from the last row ID.
+        Elsewhere the objects are saved one by one, still in a single transaction.
+        """
+        connection = connections[queryset.db]
+        features = connection.features
+        if (
+            getattr(features, 'can_return_rows_from_bulk_insert', False) or  # Django 3.0+
+            getattr(features, 'can_return_ids_from_bulk_insert', False)
+        ):
+            return queryset.bulk_create(objects, batch_size=self.bulk_batch_size)
+        if connection.vendor == 'sqlite' and self.has_automatic_primary_keys(objects):
+            queryset.bulk_create(objects, batch_size=self.bulk_batch_size)
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT last_insert_rowid()')
+                last_id = cursor.fetchone()[0]
+            for id, object in enumerate(objects, last_id - len(objects) + 1):
+                object.pk = id
+                object._state.adding = False
+                object._state.db = queryset.db
+            return objects
+        for object in objects:
+            object.save(force_insert=True, using=queryset.db)
+        return objects
+
+
+    def has_automatic_primary_keys(self, objects):
+        meta = self.model._meta
+        return (
+            not meta.parents and  # Multi-table inherited models can't be bulk inserted
+            meta.pk.get_internal_type() in ('AutoField', 'BigAutoField') and
+            all(object.pk is None for object in objects)
+        )
+
+
+class ModelHandlerBulkUpdateMixin(BulkModelHandlerMixin):
+    """
+    Records are partial updates that must carry the object ID (`id_data_name`);
+    primary keys themselves are never updated.
+
+    The objects are read (and locked, with `select_for_update()`) in the transaction that writes them.
+    """
+    bulk_update_data_name = 'data'
+
+    def get_primary_key_names(self):
+        pk = self.model._meta.pk
+        return {'pk', pk.name, pk.attname, self.id_field_name}
+
+    def handle_bulk_update(self):
+        self.call_processors('bulk_update')
+        records = self.args[self.bulk_update_data_name]
+        data, errors = self.load_bulk_records('bulk_update', records)
+        ids = {}
+        for index in list(data):
+            id = records[index].get(self.id_data_name)
+            if id is None:
+                errors[index] = {self.id_data_name: ['Missing data for required field.']}
+            else:
+                ids[index] = id
+        ids = self.clean_bulk_ids(ids, errors)
+        data = {index: datum for (index, datum) in data.items() if index in ids}
+
+        queryset = self.get_queryset('bulk_update')
+        primary_key_names = self.get_primary_key_names()
+        objects_by_index = {}
+        with transaction.atomic(using=queryset.db):
+            objects = {
+                str(getattr(object, self.id_field_name)): object
+                for object
+                in queryset.select_for_update().filter(**{'%s__in' % self.id_field_name: list(ids.values())})
+            }
+
+            fields = set()
+            for index, datum in data.items():
+                object = objects.get(str(ids[index]))
+                if object is None:
+                    errors[index] = 'object %s not found' % ids[index]
+                    continue
+                for key, value in datum.items():
+                    if key in primary_key_names:
+                        continue
+                    setattr(object, key, value)
+                    fields.add(key)
+                if self.clean_bulk_object(object, index, errors):
+                    objects_by_index[index] = object
+
+            if self.should_write(errors) and objects_by_index and fields:
+                self.write_bulk_update(queryset, list(objects_by_index.values()), sorted(fields))
+                self.call_processors('post_bulk_update', objects=list(objects_by_index.values()))
+        return self.format_bulk_result('post_bulk_update', len(records), objects_by_index, errors)
+
+    def write_bulk_update(self, queryset, objects, fields):
+        if hasattr(queryset, 'bulk_update'):  # Django 2.2+
+            queryset.bulk_update(objects, fields, batch_size=self.bulk_batch_size)
+            return
+        for object in objects:  # Still a single transaction, but one query per object
+            object.save(update_fields=fields)
+
+
+class ModelHandlerBulkDeleteMixin(BulkModelHandlerMixin):
+    """
+    Takes a list of object IDs; the result is `{"deleted": [ids], "count": n, "errors": {index: error}}`,
+    where `count` is the number of objects actually deleted (as reported by the database).
+
+    The objects are looked up (and locked, with `select_for_update()`) in the transaction that deletes them.
+    """
+    bulk_delete_data_name = 'data'
+
+    def handle_bulk_delete(self):
+        self.call_processors('bulk_delete')
+        ids = self.args[self.bulk_delete_data_name]
+        errors = {}
+        cleaned_ids = self.clean_bulk_ids(dict(enumerate(ids)), errors)
+        queryset = self.get_queryset('bulk_delete').filter(
+            **{'%s__in' % self.id_field_name: list(cleaned_ids.values())}
+        )
+        deleted = []
+        count = 0
+        with transaction.atomic(using=queryset.db):
+            found_ids = {
+                str(id)
+                for id
+                in queryset.select_for_update().values_list(self.id_field_name, flat=True)
+            }
+            errors.update(
+                (index, 'object %s not found' % ids[index])
+                for (index, id) in cleaned_ids.items()
+                if str(id) not in found_ids
+            )
+            if self.should_write(errors):
+                count = queryset.delete()[1].get(self.model._meta.label, 0)
+                deleted = [ids[index] for (index, id) in cleaned_ids.items() if str(id) in found_ids]
+                self.call_processors('post_bulk_delete', ids=deleted)
+        return {'deleted': deleted, 'count': count, 'errors': errors}
+
+
 class CRUDModelHandler(
     ModelHandlerCreateMixin,
     ModelHandlerReadMixin,
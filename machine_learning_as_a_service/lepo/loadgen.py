@@ -0,0 +1,516 @@
+"""
+Spec-driven load generator.
+
+Walks the API like `lepo.codegen` does, synthesizes valid requests for each operation from its
+parameter definitions (types, formats, enums, bounds, body schemas), fires them at a running server
+and reports throughput and latency percentiles per operation ID.
+
+    python -m lepo.loadgen spec.yaml --base-url http://127.0.0.1:8000/api --concurrency 8 --requests 200
+
+Note that this calls every matching operation, including ones that modify data; use `--methods` and
+`--operation` to choose what to hit.
+"""
+import argparse
+import base64
+import datetime
+import json
+import math
+import random
+import re
+import string
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from lepo.codegen import iterate_operations
+from lepo.ndarray import NDARRAY_EXTENSION
+from lepo.router import Router
+from lepo.utils import maybe_resolve
+
+# Patterns are synthesized from their parse trees, as made by the `re` module's (internal) parser;
+# should it be unavailable or changed beyond recognition, patterned strings fall back on examples
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:  # pragma: no cover
+    try:
+        import sre_parse
+    except ImportError:
+        sre_parse = None
+
+COLLECTION_FORMAT_SEPARATORS = {
+    'csv': ',',
+    'ssv': ' ',
+    'tsv': '\t',
+    'pipes': '|',
+}
+
+# Characters to pick from for `.` and negated classes in patterns
+PATTERN_ALPHABET = string.ascii_letters + string.digits + '-_.'
+
+PATTERN_CATEGORIES = {}
+
+# Extra candidates for classes that match none of `PATTERN_ALPHABET`
+PATTERN_CATEGORY_CHARS = {}
+
+if sre_parse:
+    PATTERN_CATEGORIES.update({
+        sre_parse.CATEGORY_DIGIT: lambda char: char.isdigit(),
+        sre_parse.CATEGORY_NOT_DIGIT: lambda char: not char.isdigit(),
+        sre_parse.CATEGORY_WORD: lambda char: char.isalnum() or char == '_',
+        sre_parse.CATEGORY_NOT_WORD: lambda char: not (char.isalnum() or char == '_'),
+        sre_parse.CATEGORY_SPACE: lambda char: char.isspace(),
+        sre_parse.CATEGORY_NOT_SPACE: lambda char: not char.isspace(),
+    })
+    PATTERN_CATEGORY_CHARS.update({
+        sre_parse.CATEGORY_NOT_WORD: ' ',
+        sre_parse.CATEGORY_SPACE: ' ',
+    })
+
+
+class UnsupportedPattern(ValueError):
+    pass
+
+
+class PatternSynthesizer:
+    """
+    Synthesizes strings matching a regular expression.
+
+    Literals, `.`, character classes (including `\\d`, `\\w` and `\\s`), groups, alternation,
+    repetition and anchors are supported; unbounded repetitions are kept short.
+    Anything else (lookarounds, backreferences, ...) raises `UnsupportedPattern`.
+    """
+
+    def __init__(self, random, max_repeat=4):
+        self.random = random
+        self.max_repeat = max_repeat
+
+    def synthesize(self, pattern):
+        if not sre_parse:
+            raise UnsupportedPattern('The regular expression parser is not available')
+        try:
+            parsed = sre_parse.parse(pattern)
+        except re.error as exc:
+            raise UnsupportedPattern('Invalid pattern %r: %s' % (pattern, exc))
+        try:
+            return self.synthesize_nodes(parsed)
+        except UnsupportedPattern:
+            raise
+        except (AttributeError, TypeError, ValueError) as exc:  # The parse tree isn't what it used to be
+            raise UnsupportedPattern('Unable to synthesize %r: %s' % (pattern, exc))
+
+    def synthesize_nodes(self, nodes):
+        return ''.join(self.synthesize_node(op, arg) for (op, arg) in nodes)
+
+    def synthesize_node(self, op, arg):
+        if op == sre_parse.LITERAL:
+            return chr(arg)
+        if op == sre_parse.NOT_LITERAL:
+            return self.pick([char for char in PATTERN_ALPHABET if ord(char) != arg])
+        if op == sre_parse.ANY:
+            return self.random.choice(PATTERN_ALPHABET)
+        if op == sre_parse.IN:
+            return self.synthesize_class(arg)
+        if op == sre_parse.AT:  # Anchors match no characters
+            return ''
+        if op == sre_parse.BRANCH:
+            return self.synthesize_nodes(self.random.choice(arg[1]))
+        if op == sre_parse.SUBPATTERN:
+            return self.synthesize_nodes(arg[-1])
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            minimum, maximum, nodes = arg
+            if maximum == sre_parse.MAXREPEAT:
+                maximum = minimum + self.max_repeat
+            return ''.join(self.synthesize_nodes(nodes) for x in range(self.random.randint(minimum, maximum)))
+        raise UnsupportedPattern('Unsupported pattern construct %s' % op)
+
+    def synthesize_class(self, items):
+        candidates = set(PATTERN_ALPHABET)
+        for op, arg in items:
+            if op == sre_parse.LITERAL:
+                candidates.add(chr(arg))
+            elif op == sre_parse.RANGE:
+                candidates.update(chr(code) for code in range(arg[0], min(arg[1], arg[0] + 255) + 1))
+            elif op == sre_parse.CATEGORY:
+                candidates.update(PATTERN_CATEGORY_CHARS.get(arg, ''))
+        return self.pick(sorted(char for char in candidates if self.is_in_class(items, char)))
+
+    def is_in_class(self, items, char):
+        negate = False
+        for op, arg in items:
+            if op == sre_parse.NEGATE:
+                negate = True
+            elif op == sre_parse.LITERAL and ord(char) == arg:
+                return not negate
+            elif op == sre_parse.RANGE and arg[0] <= ord(char) <= arg[1]:
+                return not negate
+            elif op == sre_parse.CATEGORY:
+                if arg not in PATTERN_CATEGORIES:
+                    raise UnsupportedPattern('Unsupported character category %s' % arg)
+                if PATTERN_CATEGORIES[arg](char):
+                    return not negate
+            elif op not in (sre_parse.NEGATE, sre_parse.LITERAL, sre_parse.RANGE, sre_parse.CATEGORY):
+                raise UnsupportedPattern('Unsupported character class construct %s' % op)
+        return negate
+
+    def pick(self, candidates):
+        if not candidates:
+            raise UnsupportedPattern('No character to pick')
+        return self.random.choice(candidates)
+
+
+class RequestSynthesizer:
+    def __init__(self, router, random, optional_rate=0.5):
+        """
+        :type router: lepo.router.Router
+        :type random: random.Random
+        :param optional_rate: Probability of including each optional parameter or property.
+        """
+        self.router = router
+        self.random = random
+        self.optional_rate = optional_rate
+        self.pattern_synthesizer = PatternSynthesizer(random)
+
+    def resolve(self, schema):
+        return maybe_resolve(schema, self.router.resolve_reference)
+
+    def synthesize_value(self, schema):
+        """
+        Synthesize a value valid according to the given parameter or JSON schema definition.
+        """
+        schema = self.resolve(schema)
+        if 'schema' in schema:  # Body parameter
+            return self.synthesize_value(schema['schema'])
+        if 'allOf' in schema:
+            merged = {}
+            for subschema in schema['allOf']:
+                subschema = self.resolve(subschema)
+                merged.setdefault('properties', {}).update(subschema.get('properties', {}))
+                merged.setdefault('required', []).extend(subschema.get('required', ()))
+                merged.update((key, value) for (key, value) in subschema.items() if key not in merged)
+            return self.synthesize_value(merged)
+        if 'enum' in schema:
+            return self.random.choice(schema['enum'])
+        type = schema.get('type')
+        format = schema.get('format')
+        if type == 'boolean':
+            return self.random.choice((True, False))
+        if type == 'integer':
+            return self.synthesize_number(schema, integer=True)
+        if type == 'number':
+            return self.synthesize_number(schema, integer=False)
+        if type == 'array':
+            min_items = schema.get('minItems', 1)
+            max_items = schema.get('maxItems', min_items + 2)
+            return [
+                self.synthesize_value(schema.get('items', {}))
+                for x in range(self.random.randint(min_items, max_items))
+            ]
+        if type == 'object' or 'properties' in schema:
+            required = set(schema.get('required', ()))
+            return {
+                name: self.synthesize_value(property)
+                for (name, property) in schema.get('properties', {}).items()
+                if name in required or self.random.random() < self.optional_rate
+            }
+        if type == 'file':
+            return ('loadgen.bin', bytes(self.random.getrandbits(8) for x in range(64)))
+        if format == 'date':
+            return self.synthesize_date().isoformat()
+        if format in ('dateTime', 'date-time'):
+            return datetime.datetime.combine(self.synthesize_date(), datetime.time(12)).isoformat() + 'Z'
+        if format == 'byte':
+            return base64.b64encode(self.synthesize_string(schema).encode('utf-8')).decode('ascii')
+        if type == 'string':
+            return self.synthesize_string(schema)
+        return None
+
+    def synthesize_number(self, schema, integer):
+        minimum = schema.get('minimum', 0)
+        maximum = schema.get('maximum', minimum + 100)
+        if integer:
+            minimum += (1 if schema.get('exclusiveMinimum') else 0)
+            maximum -= (1 if schema.get('exclusiveMaximum') else 0)
+            value = self.random.randint(int(minimum), int(maximum))
+        else:
+            value = self.random.uniform(minimum, maximum)
+        multiple_of = schema.get('multipleOf')
+        if multiple_of:
+            # Round to a multiple, but stay within the bounds (the lowest and highest multiples within them)
+            low = math.ceil(minimum / multiple_of)
+            high = math.floor(maximum / multiple_of)
+            if not integer:
+                low += (1 if schema.get('exclusiveMinimum') and low * multiple_of == minimum else 0)
+                high -= (1 if schema.get('exclusiveMaximum') and high * multiple_of == maximum else 0)
+            value = min(max(1, round(value / multiple_of), low), high) * multiple_of
+        return value
+
+    def synthesize_date(self):
+        return datetime.date(2017, 1, 1) + datetime.timedelta(days=self.random.randint(0, 365))
+
+    def synthesize_string(self, schema):
+        if 'pattern' in schema:
+            return self.synthesize_pattern_string(schema)
+        if 'default' in schema:
+            return schema['default']
+        return self.synthesize_random_string(schema)
+
+    def synthesize_pattern_string(self, schema, attempts=10):
+        """
+        Synthesize a string matching the schema's `pattern` (and length bounds), falling back on its
+        example or default if the pattern is beyond `PatternSynthesizer` or its strings don't fit.
+        """
+        pattern = schema['pattern']
+        min_length = schema.get('minLength', 0)
+        max_length = schema.get('maxLength')
+        for x in range(attempts):
+            try:
+                value = self.pattern_synthesizer.synthesize(pattern)
+            except UnsupportedPattern:
+                break
+            if re.search(pattern, value) and min_length <= len(value) <= (max_length or len(value)):
+                return value
+        for key in ('example', 'x-example', 'default'):
+            if key in schema:
+                return schema[key]
+        return self.synthesize_random_string(schema)
+
+    def synthesize_random_string(self, schema):
+        min_length = schema.get('minLength', 1)
+        max_length = schema.get('maxLength', max(min_length, 12))
+        return ''.join(
+            self.random.choice('abcdefghijklmnopqrstuvwxyz')
+            for x in range(self.random.randint(min_length, max_length))
+        )
+
+    def synthesize_array(self, spec):
+        """
+        Synthesize an array as described by an `x-ndarray` spec (see `lepo.ndarray`).
+
+        :rtype: numpy.ndarray
+        """
+        import numpy as np  # Only needed by APIs that use array parameters
+
+        dtype = np.dtype(spec.get('dtype', 'float64'))
+        shape = tuple(
+            (self.random.randint(1, 4) if length is None or length < 0 else int(length))
+            for length in spec.get('shape', [None])
+        )
+        size = int(np.prod(shape))
+        if dtype.kind in 'fc':
+            values = [self.random.uniform(-1, 1) for x in range(size)]
+        elif dtype.kind == 'b':
+            values = [self.random.choice((True, False)) for x in range(size)]
+        elif dtype.kind in 'iu':
+            values = [self.random.randint(0, 100) for x in range(size)]
+        else:
+            return np.zeros(shape, dtype=dtype)
+        return np.array(values, dtype=dtype).reshape(shape)
+
+    def synthesize_body(self, operation, parameter):
+        """
+        Synthesize a body parameter, encoded as the first content type the operation consumes.
+
+        JSON bodies are encoded as JSON and `text/*` bodies as text (JSON if they aren't strings);
+        `application/octet-stream` bodies are random bytes.  Array (`x-ndarray`) parameters are
+        synthesized as arrays, and sent as raw bytes or base64 accordingly.
+
+        :return: The content type, the body, and any headers to send with it.
+        :rtype: tuple[str, bytes, dict]
+        """
+        content_type = (operation.consumes or ['application/json'])[0]
+        headers = {}
+        if NDARRAY_EXTENSION in parameter:
+            array = self.synthesize_array(parameter[NDARRAY_EXTENSION])
+            if content_type == 'application/octet-stream':
+                headers['X-Ndarray-Shape'] = ','.join(str(length) for length in array.shape)
+                return (content_type, array.tobytes(), headers)
+            data = base64.b64encode(array.tobytes()).decode('ascii')
+            value = (data if content_type.startswith('text/') else {'data': data, 'shape': list(array.shape)})
+        elif content_type == 'application/octet-stream':
+            return (content_type, bytes(self.random.getrandbits(8) for x in range(64)), headers)
+        else:
+            value = self.synthesize_value(parameter)
+        if isinstance(value, str) and content_type.startswith('text/'):
+            return (content_type, value.encode('utf-8'), headers)
+        return (content_type, json.dumps(value).encode('utf-8'), headers)
+
+    def serialize_value(self, parameter, value):
+        """
+        Serialize a value for a non-body parameter.
+
+        :return: A string, or a list of strings for `multi` collections.
+        """
+        if isinstance(value, list):
+            items = [self.serialize_value(parameter.get('items', {}), item) for item in value]
+            collection_format = parameter.get('collectionFormat', 'csv')
+            if collection_format == 'multi':
+                return items
+            return COLLECTION_FORMAT_SEPARATORS[collection_format].join(items)
+        if isinstance(value, bool):
+            return ('true' if value else 'false')
+        return str(value)
+
+    def synthesize_request(self, operation):
+        """
+        :type operation: lepo.operation.Operation
+        :return: Keyword arguments for `requests.Session.request()` (with a relative URL)
+        :rtype: dict
+        """
+        path = operation.path.path
+        kwargs = {'method': operation.method.upper(), 'params': {}, 'headers': {}}
+        for parameter in operation.parameters:
+            if not parameter.get('required') and self.random.random() >= self.optional_rate:
+                continue
+            location = parameter['in']
+            if location == 'body':
+                content_type, kwargs['data'], headers = self.synthesize_body(operation, parameter)
+                kwargs['headers']['Content-Type'] = content_type
+                kwargs['headers'].update(headers)
+                continue
+            value = self.synthesize_value(parameter)
+            if location == 'formData' and parameter.get('type') == 'file':
+                kwargs.setdefault('files', {})[parameter['name']] = value
+            elif location == 'formData':
+                kwargs.setdefault('data', {})[parameter['name']] = self.serialize_value(parameter, value)
+            elif location == 'path':
+                path = path.replace('{%s}' % parameter['name'], quote(self.serialize_value(parameter, value), safe=''))
+            elif location == 'header':
+                kwargs['headers'][parameter['name']] = self.serialize_value(parameter, value)
+            else:
+                kwargs['params'][parameter['name']] = self.serialize_value(parameter, value)
+        base_path = self.router.api.get('basePath', '/').rstrip('/')
+        kwargs['url'] = base_path + path
+        return kwargs
+
+
+class LoadGenerator:
+    def __init__(self, router, base_url, concurrency=4, timeout=30, optional_rate=0.5, seed=None):
+        self.router = router
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.synthesizer = RequestSynthesizer(router, self.random, optional_rate=optional_rate)
+        self.local = threading.local()
+
+    def get_session(self):
+        import requests
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        return session
+
+    def send(self, request_kwargs):
+        """
+        :return: (latency in seconds, status code or None, error or None)
+        """
+        request_kwargs = dict(request_kwargs, url=self.base_url + request_kwargs['url'], timeout=self.timeout)
+        start = time.perf_counter()
+        try:
+            response = self.get_session().request(**request_kwargs)
+            response.content  # Make sure the body has been read
+        except Exception as exc:
+            return (time.perf_counter() - start, None, exc)
+        return (time.perf_counter() - start, response.status_code, None)
+
+    def run_operation(self, operation, n_requests):
+        # Synthesize up front, so synthesis isn't part of the measurement
+        requests_to_send = [self.synthesizer.synthesize_request(operation) for x in range(n_requests)]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            start = time.perf_counter()
+            results = list(executor.map(self.send, requests_to_send))
+            elapsed = time.perf_counter() - start
+        return summarize(operation, results, elapsed)
+
+    def run(self, n_requests, operation_ids=None, methods=None, stream=sys.stderr):
+        summaries = OrderedDict()
+        operations = sorted(iterate_operations(self.router), key=lambda operation: operation.id)
+        for operation in operations:
+            if operation_ids and operation.id not in operation_ids:
+                continue
+            if methods and operation.method.upper() not in methods:
+                continue
+            stream.write('%s %s (%s)...\n' % (operation.method.upper(), operation.path.path, operation.id))
+            summaries[operation.id] = self.run_operation(operation, n_requests)
+        return summaries
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(math.ceil(fraction * len(sorted_values))) - 1))  # Nearest rank
+    return sorted_values[index]
+
+
+def summarize(operation, results, elapsed):
+    latencies = sorted(latency for (latency, status, error) in results)
+    statuses = {}
+    errors = 0
+    for latency, status, error in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        if error is not None or not (200 <= status < 400):
+            errors += 1
+    return OrderedDict([
+        ('method', operation.method.upper()),
+        ('path', operation.path.path),
+        ('requests', len(results)),
+        ('errors', errors),
+        ('statuses', statuses),
+        ('elapsed', elapsed),
+        ('throughput', (len(results) / elapsed if elapsed else None)),
+        ('p50', percentile(latencies, 0.5)),
+        ('p90', percentile(latencies, 0.9)),
+        ('p99', percentile(latencies, 0.99)),
+        ('max', (latencies[-1] if latencies else None)),
+    ])
+
+
+def format_summaries(summaries):
+    lines = ['%-40s %8s %7s %9s %9s %9s %9s' % ('operation', 'requests', 'errors', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms')]
+    for operation_id, summary in summaries.items():
+        lines.append('%-40s %8d %7d %9.1f %9.1f %9.1f %9.1f' % (
+            operation_id,
+            summary['requests'],
+            summary['errors'],
+            summary['throughput'] or 0,
+            (summary['p50'] or 0) * 1000,
+            (summary['p90'] or 0) * 1000,
+            (summary['p99'] or 0) * 1000,
+        ))
+    return '\n'.join(lines)
+
+
+def cmdline():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('input', help='OpenAPI (Swagger 2.0) document, YAML or JSON')
+    ap.add_argument('--base-url', default='http://127.0.0.1:8000/api', help='URL the API (basePath) is mounted at')
+    ap.add_argument('--concurrency', type=int, default=4)
+    ap.add_argument('--requests', type=int, default=100, help='requests per operation')
+    ap.add_argument('--operation', action='append', dest='operations', help='only run this operation (repeatable)')
+    ap.add_argument('--methods', default=None, help='only run operations with these methods (e.g. GET,HEAD)')
+    ap.add_argument('--optional-rate', type=float, default=0.5, help='probability of sending optional parameters')
+    ap.add_argument('--timeout', type=float, default=30)
+    ap.add_argument('--seed', type=int, default=None)
+    ap.add_argument('--json', action='store_true', help='output results as JSON')
+    args = ap.parse_args()
+    generator = LoadGenerator(
+        router=Router.from_file(args.input),
+        base_url=args.base_url,
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+        optional_rate=args.optional_rate,
+        seed=args.seed,
+    )
+    methods = ({method.strip().upper() for method in args.methods.split(',')} if args.methods else None)
+    summaries = generator.run(args.requests, operation_ids=args.operations, methods=methods)
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+    else:
+        print(format_summaries(summaries))
+
+
+if __name__ == '__main__':
+    cmdline()
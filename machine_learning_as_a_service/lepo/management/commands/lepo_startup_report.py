@@ -0,0 +1,16 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from lepo.startup import startup_timer
+
+
+class Command(BaseCommand):
+    help = 'Load the URLconf (and so build the API routers) and report where the startup time went.'
+    requires_system_checks = False  # The checks would load the URLconf before we get to time it
+
+    def handle(self, *args, **options):
+        with startup_timer.step('import %s' % settings.ROOT_URLCONF):
+            import_module(settings.ROOT_URLCONF)
+        self.stdout.write(startup_timer.format_report())
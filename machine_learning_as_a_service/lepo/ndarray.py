@@ -0,0 +1,158 @@
+"""
+Binary array parameters.
+
+A parameter with an `x-ndarray` extension is decoded straight into a numpy array
+instead of being cast item by item:
+
+    - name: init
+      in: body
+      schema:
+        type: string
+      x-ndarray:
+        dtype: float64       # any numpy dtype; e.g. '<f8' pins the byte order
+        shape: [null, 8]     # null for dimensions of any length; leave out to allow any shape
+
+The value may be
+
+* raw bytes: an `application/octet-stream` body (the shape may be given in an `X-Ndarray-Shape: 16,8` header),
+* a base64 string: a query, form or header parameter, or a JSON or text body, or
+* a JSON body `{"data": "<base64>", "shape": [16, 8], "dtype": "float32"}`.
+
+The bytes are wrapped with `numpy.frombuffer` without copying (so the array is read-only),
+and the dtype and shape are validated once for the whole array.  Arrays given in a dtype
+other than the declared one are converted if that can be done without loss.  Only plain
+(numeric, boolean, string or datetime) dtypes are allowed: not object, structured, subarray
+or zero-size ones.
+"""
+import base64
+import binascii
+import re
+from functools import reduce
+
+from django.utils.encoding import force_bytes, force_text
+
+from lepo.excs import InvalidArray
+
+NDARRAY_EXTENSION = 'x-ndarray'
+
+SHAPE_HEADER = 'HTTP_X_NDARRAY_SHAPE'
+
+DIGITS_REGEX = re.compile(r'[0-9]+')
+
+
+def parse_shape(value):
+    """
+    :param value: A list of ints, or a string like '16,8'.
+    :raises InvalidArray: if any of the lengths is not a non-negative integer
+    :rtype: tuple[int]
+    """
+    if isinstance(value, str):
+        value = [item for item in value.replace(' ', '').split(',') if item]
+        if all(DIGITS_REGEX.fullmatch(item) for item in value):
+            return tuple(int(item) for item in value)
+    elif isinstance(value, (list, tuple)) and all(
+        isinstance(item, int) and not isinstance(item, bool) and item >= 0 for item in value
+    ):
+        return tuple(value)
+    raise InvalidArray('Invalid shape %r' % (value,))
+
+
+def get_size(shape):
+    return reduce(lambda a, b: a * b, shape, 1)
+
+
+def resolve_shape(declared, given, size):
+    """
+    Work out the shape of an array of `size` items.
+
+    :param declared: The shape in the spec (with None for free dimensions), or None for any shape.
+    :param given: The shape given with the value, if any.
+    :rtype: tuple[int]
+    """
+    if given is not None:
+        if declared is not None and (
+            len(given) != len(declared) or
+            any(want is not None and want != have for (want, have) in zip(declared, given))
+        ):
+            raise InvalidArray('Shape %r does not match %r' % (given, declared))
+        if get_size(given) != size:
+            raise InvalidArray('Shape %r does not fit %d items' % (given, size))
+        return given
+    if declared is None:
+        return (size,)
+    free = [index for (index, length) in enumerate(declared) if length is None]
+    if len(free) > 1:
+        raise InvalidArray('The shape must be given (it can only be inferred with one free dimension)')
+    fixed = get_size(length for length in declared if length is not None)
+    if free:
+        if fixed == 0 or size % fixed:
+            raise InvalidArray('%d items do not fit the shape %r' % (size, declared))
+        return tuple((size // fixed if length is None else length) for length in declared)
+    if fixed != size:
+        raise InvalidArray('%d items do not fit the shape %r' % (size, declared))
+    return tuple(declared)
+
+
+def check_dtype(dtype):
+    """
+    :type dtype: numpy.dtype
+    :raises InvalidArray: if arrays of `dtype` can't be read from raw bytes
+    """
+    if dtype.hasobject:
+        raise InvalidArray('Arrays of %s (objects) are not supported' % dtype)
+    if dtype.fields is not None or dtype.subdtype is not None:
+        raise InvalidArray('Arrays of %s (structured or subarray) are not supported' % dtype)
+    if dtype.itemsize == 0:
+        raise InvalidArray('Arrays of %s (zero-size items) are not supported' % dtype)
+
+
+def decode_ndarray(spec, value):
+    """
+    Decode a parameter value into an array as described by an `x-ndarray` spec.
+
+    :param spec: The `x-ndarray` extension of the parameter.
+    :type spec: dict
+    :param value: Bytes, a base64 string, or a dict with `data` (and optionally `shape` and `dtype`).
+    :raises InvalidArray: if the value is not a valid array of the declared dtype and shape
+    :rtype: numpy.ndarray
+    """
+    import numpy as np  # Only needed by APIs that use array parameters
+
+    dtype = np.dtype(spec.get('dtype', 'float64'))
+    check_dtype(dtype)
+    declared_shape = spec.get('shape')
+    if declared_shape is not None:
+        declared_shape = tuple((None if length is None or length < 0 else int(length)) for length in declared_shape)
+
+    given_shape = given_dtype = None
+    if isinstance(value, dict):
+        if 'data' not in value:
+            raise InvalidArray('The array has no data')
+        if value.get('shape') is not None:
+            given_shape = parse_shape(value['shape'])
+        if value.get('dtype') is not None:
+            try:
+                given_dtype = np.dtype(value['dtype'])
+            except TypeError:
+                raise InvalidArray('Invalid dtype %r' % value['dtype'])
+            check_dtype(given_dtype)
+        value = value['data']
+
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        buffer = value
+    else:
+        try:
+            buffer = base64.b64decode(force_bytes(force_text(value)), validate=True)
+        except (binascii.Error, ValueError):
+            raise InvalidArray('The array data is not valid base64')
+
+    source_dtype = (given_dtype or dtype)
+    if len(buffer) % source_dtype.itemsize:
+        raise InvalidArray('%d bytes are not a whole number of %s items' % (len(buffer), source_dtype))
+    array = np.frombuffer(buffer, dtype=source_dtype)
+    array = array.reshape(resolve_shape(declared_shape, given_shape, array.size))
+    if source_dtype != dtype:
+        if not np.can_cast(source_dtype, dtype, casting='safe'):
+            raise InvalidArray('Cannot convert %s to %s without loss' % (source_dtype, dtype))
+        array = array.astype(dtype)
+    return array
@@ -6,6 +6,7 @@ import jsonschema
 from django.utils.encoding import force_bytes, force_text
 
 from lepo.excs import ErroneousParameters, InvalidBodyContent, InvalidBodyFormat, MissingParameter
+from lepo.ndarray import NDARRAY_EXTENSION, SHAPE_HEADER, decode_ndarray
 from lepo.utils import maybe_resolve
 
 COLLECTION_FORMAT_SPLITTERS = {
@@ -27,6 +28,8 @@ OPENAPI_JSONSCHEMA_VALIDATION_KEYS = (
 
 
 def cast_parameter_value(api_info, parameter, value):
+    if NDARRAY_EXTENSION in parameter:  # Decoded and validated as a whole; see `lepo.ndarray`
+        return decode_ndarray(parameter[NDARRAY_EXTENSION], value)
     if parameter.get('type') == 'array':
         if not isinstance(value, list):  # could be a list already if collection format was multi
             splitter = COLLECTION_FORMAT_SPLITTERS.get(parameter.get('collectionFormat', 'csv'))
@@ -89,6 +92,8 @@ def read_body(request):
             return json.loads(request.body.decode(request.content_params.get('charset', 'UTF-8')))
         elif request.content_type == 'text/plain':
             return request.body.decode(request.content_params.get('charset', 'UTF-8'))
+        elif request.content_type == 'application/octet-stream':
+            return request.body
     except Exception as exc:
         raise InvalidBodyContent('Unable to parse this body as %s' % request.content_type) from exc
     raise NotImplementedError('No idea how to parse content-type %s' % request.content_type)  # pragma: no cover
@@ -109,7 +114,12 @@ def get_parameter_value(request, view_kwargs, param):
         return view_kwargs[param['name']]
 
     if param['in'] == 'body':
-        return read_body(request)
+        if not request.body:  # Treat an empty body like any other missing parameter
+            raise KeyError(param['name'])
+        body = read_body(request)
+        if NDARRAY_EXTENSION in param and isinstance(body, bytes) and SHAPE_HEADER in request.META:
+            return {'data': body, 'shape': request.META[SHAPE_HEADER]}
+        return body
 
     if param['in'] == 'header':
         return request.META['HTTP_%s' % param['name'].upper().replace('-', '_')]
@@ -1,9 +1,16 @@
-from django.http import HttpResponse, JsonResponse
+from calendar import timegm
+
+from django.http import JsonResponse
+from django.http.response import HttpResponseBase
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from django.views import View
 
+from lepo.admission import AdmissionRejected, get_operation_limiter
 from lepo.api_info import APIInfo
-from lepo.excs import InvalidOperation, ExceptionalResponse
+from lepo.excs import ErroneousParameters, InvalidOperation, ExceptionalResponse
 from lepo.parameters import read_parameters
+from lepo.profiling import get_request_profiler
 from lepo.utils import snake_case
 
 
@@ -17,21 +24,72 @@ class PathView(View):
         except InvalidOperation:
             return self.http_method_not_allowed(request, **kwargs)
         request.api_info = APIInfo(operation=operation)
-        params = dict(
-            (snake_case(name), value)
-            for (name, value)
-            in read_parameters(request, kwargs).items()
-        )
+        limiter = get_operation_limiter(operation)
+        if not limiter:
+            return self.dispatch_admitted(request, **kwargs)
+        try:
+            return limiter.admit_response(lambda: self.dispatch_admitted(request, **kwargs))
+        except AdmissionRejected as ar:
+            return ar.get_response()
+
+    def dispatch_admitted(self, request, **kwargs):
+        profiler = get_request_profiler(request)
+        if profiler:
+            return profiler.profile_view(self.dispatch_operation, request, **kwargs)
+        return self.dispatch_operation(request, **kwargs)
+
+    def dispatch_operation(self, request, **kwargs):
+        operation = request.api_info.operation
+        try:
+            params = dict(
+                (snake_case(name), value)
+                for (name, value)
+                in read_parameters(request, kwargs).items()
+            )
+        except ErroneousParameters as ep:
+            return ep.get_response()
         handler = request.api_info.router.get_handler(operation.id)
+        etag = last_modified = None
         try:
+            etag, last_modified = self.get_conditions(request, handler, params)
+            if etag or last_modified:
+                response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+                if response is not None:  # 304 Not Modified or 412 Precondition Failed
+                    return self.set_validators(response, etag, last_modified)
             response = handler(request, **params)
         except ExceptionalResponse as er:
             response = er.response
 
-        return self.transform_response(response)
+        response = self.transform_response(response)
+        if request.method in ('GET', 'HEAD') and 200 <= response.status_code < 300:
+            self.set_validators(response, etag, last_modified)
+        return response
+
+    def get_conditions(self, request, handler, params):
+        """
+        Get the (quoted ETag, last modified timestamp) validators for a request, if the handler supports them.
+
+        See `lepo.decorators.condition`.
+        """
+        condition_func = getattr(handler, 'condition_func', None)
+        if not condition_func:
+            return (None, None)
+        etag, last_modified = condition_func(request, **params)
+        if etag is not None:
+            etag = quote_etag(str(etag))
+        if last_modified is not None:
+            last_modified = timegm(last_modified.utctimetuple())
+        return (etag, last_modified)
+
+    def set_validators(self, response, etag, last_modified):
+        if etag and not response.has_header('ETag'):
+            response['ETag'] = etag
+        if last_modified and not response.has_header('Last-Modified'):
+            response['Last-Modified'] = http_date(last_modified)
+        return response
 
     def transform_response(self, response):
-        if isinstance(response, HttpResponse):
+        if isinstance(response, HttpResponseBase):
             # TODO: validate against responses
             return response
         return JsonResponse(response, safe=False)  # TODO: maybe less TIMTOWDI here?
@@ -0,0 +1,243 @@
+"""
+Opt-in, per-request profiling of lepo operations.
+
+Profiling is configured with the `LEPO_PROFILING` setting (see `DEFAULTS` for the keys).
+A request is profiled either when it carries the profiling header with the configured secret,
+or when it is picked by random sampling (`SAMPLE_RATE`).
+
+Profiles are stored in a Django cache keyed by request ID (taken from `X-Request-ID` when sane,
+generated otherwise), and the ID is returned to the client in the `X-Lepo-Profile-Id` header.
+Use `get_profiling_urls()` to mount the retrieval view.
+
+Note that with more than one worker process, `CACHE` should name a cache shared between them.
+"""
+import cProfile
+import io
+import marshal
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.conf.urls import url
+from django.core.cache import caches
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+DEFAULTS = {
+    'SECRET': None,  # Value for `HEADER` that enables profiling; header-triggered profiling is off if unset
+    'HEADER': 'X-Lepo-Profile',
+    'SAMPLE_RATE': 0.0,  # Fraction (0..1) of requests to profile regardless of the header
+    'PROFILER': 'cprofile',  # or 'sampling'
+    'SAMPLING_INTERVAL': 0.005,  # Seconds between stack samples for the sampling profiler
+    'STATS_LIMIT': 100,  # Number of functions to list in the text report
+    'CACHE': 'default',
+    'TIMEOUT': 3600,  # Seconds to keep stored profiles around
+}
+
+REQUEST_ID_REGEX = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+def get_profiling_options():
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'LEPO_PROFILING', None) or {})
+    return options
+
+
+def get_header_meta_name(header):
+    return 'HTTP_%s' % header.upper().replace('-', '_')
+
+
+def is_authorized(request, options):
+    secret = options['SECRET']
+    value = request.META.get(get_header_meta_name(options['HEADER']))
+    return bool(secret and value and constant_time_compare(value, secret))
+
+
+def get_request_id(request):
+    request_id = request.META.get('HTTP_X_REQUEST_ID', '')
+    if REQUEST_ID_REGEX.match(request_id):
+        return request_id
+    return uuid.uuid4().hex
+
+
+def get_cache_key(request_id):
+    return 'lepo-profile:%s' % request_id
+
+
+def get_request_profiler(request):
+    """
+    Get a profiler for the given request, if it should be profiled at all.
+
+    :type request: HttpRequest
+    :rtype: RequestProfiler|None
+    """
+    options = get_profiling_options()
+    if not (is_authorized(request, options) or random.random() < options['SAMPLE_RATE']):
+        return None
+    profiler_class = PROFILER_CLASSES[options['PROFILER']]
+    return profiler_class(request_id=get_request_id(request), options=options)
+
+
+class RequestProfiler:
+    name = None  # Filled in by subclasses
+    default_format = None  # Filled in by subclasses
+
+    def __init__(self, request_id, options):
+        self.request_id = request_id
+        self.options = options
+
+    def run(self, func, *args, **kwargs):
+        raise NotImplementedError('Subclasses must implement this')  # pragma: no cover
+
+    def get_outputs(self):
+        """
+        :return: Mapping of output format name to (content type, content).
+        :rtype: dict[str, tuple[str, str|bytes]]
+        """
+        raise NotImplementedError('Subclasses must implement this')  # pragma: no cover
+
+    def profile_view(self, view, request, **kwargs):
+        """
+        Run `view` under this profiler, store the results and tag the response with the request ID.
+        """
+        start = time.time()
+        try:
+            response = self.run(view, request, **kwargs)
+        finally:
+            self.store(request, duration=time.time() - start)
+        response['X-Lepo-Profile-Id'] = self.request_id
+        return response
+
+    def store(self, request, duration):
+        api_info = getattr(request, 'api_info', None)
+        record = {
+            'request_id': self.request_id,
+            'profiler': self.name,
+            'method': request.method,
+            'path': request.path,
+            'operation_id': (api_info.operation.id if api_info else None),
+            'duration': duration,
+            'default_format': self.default_format,
+            'outputs': self.get_outputs(),
+        }
+        caches[self.options['CACHE']].set(
+            get_cache_key(self.request_id),
+            record,
+            timeout=self.options['TIMEOUT'],
+        )
+
+
+class CProfileRequestProfiler(RequestProfiler):
+    name = 'cprofile'
+    default_format = 'text'
+    profile = None
+
+    def run(self, func, *args, **kwargs):
+        self.profile = cProfile.Profile()
+        return self.profile.runcall(func, *args, **kwargs)
+
+    def get_outputs(self):
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.sort_stats('cumulative').print_stats(self.options['STATS_LIMIT'])
+        return {
+            'text': ('text/plain', stream.getvalue()),
+            # Same format as `pstats.Stats.dump_stats()`, so the download can be fed to pstats/snakeviz
+            'pstats': ('application/octet-stream', marshal.dumps(stats.stats)),
+        }
+
+
+class SamplingRequestProfiler(RequestProfiler):
+    name = 'sampling'
+    default_format = 'collapsed'
+
+    def __init__(self, request_id, options):
+        super(SamplingRequestProfiler, self).__init__(request_id, options)
+        self.stacks = Counter()
+
+    def run(self, func, *args, **kwargs):
+        target_thread_id = threading.get_ident()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample,
+            args=(target_thread_id, stop),
+            name='lepo-profile-%s' % self.request_id,
+            daemon=True,
+        )
+        sampler.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stop.set()
+            sampler.join()
+
+    def _sample(self, thread_id, stop):
+        while not stop.wait(self.options['SAMPLING_INTERVAL']):
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                self.stacks[collapse_stack(frame)] += 1
+
+    def get_outputs(self):
+        collapsed = ''.join(
+            '%s %d\n' % (stack, count)
+            for (stack, count)
+            in sorted(self.stacks.items())
+        )
+        return {'collapsed': ('text/plain', collapsed)}
+
+
+def collapse_stack(frame):
+    """
+    Format a frame's stack in the "collapsed" format used by flame graph tools (outermost frame first).
+
+    :rtype: str
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s:%s:%d' % (code.co_filename, code.co_name, code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+PROFILER_CLASSES = {
+    CProfileRequestProfiler.name: CProfileRequestProfiler,
+    SamplingRequestProfiler.name: SamplingRequestProfiler,
+}
+
+
+def get_profile(request, request_id):
+    """
+    Retrieve a stored profile.
+
+    The request must carry the same secret header that triggers profiling.
+    The `format` query parameter selects the output (`text` or `pstats` for cProfile profiles,
+    `collapsed` for sampling profiles); the default depends on the profiler.
+    """
+    options = get_profiling_options()
+    if not is_authorized(request, options):
+        return HttpResponseForbidden('Profiling secret missing or invalid')
+    record = caches[options['CACHE']].get(get_cache_key(request_id))
+    if not record:
+        raise Http404('No profile stored for request %s' % request_id)
+    outputs = record['outputs']
+    format = request.GET.get('format') or record['default_format']
+    if format not in outputs:
+        raise Http404('Profile %s is not available as %s (%s are)' % (request_id, format, ', '.join(sorted(outputs))))
+    content_type, content = outputs[format]
+    response = HttpResponse(content, content_type=content_type)
+    response['X-Lepo-Profile-Operation'] = record['operation_id'] or ''
+    response['X-Lepo-Profile-Duration'] = '%.6f' % record['duration']
+    return response
+
+
+def get_profiling_urls(profiles_url='_profiles/'):
+    return [
+        url(r'%s(?P<request_id>[A-Za-z0-9._-]+)$' % profiles_url, get_profile, name='lepo_profile'),
+    ]
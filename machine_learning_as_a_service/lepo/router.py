@@ -1,6 +1,13 @@
+import ast
+import hashlib
+import importlib.util
+import logging
+import os
+import pickle
+import tempfile
 from collections import Iterable
 from copy import deepcopy
-from functools import reduce
+from functools import lru_cache, reduce
 from importlib import import_module
 from inspect import isfunction, ismethod
 
@@ -12,6 +19,8 @@ from lepo.excs import MissingHandler
 from lepo.path import Path
 from lepo.utils import maybe_resolve, snake_case
 
+log = logging.getLogger(__name__)
+
 
 def root_view(request):
     return HttpResponse('API root')
@@ -20,37 +29,50 @@ def root_view(request):
 class Router:
     path_class = Path
 
-    def __init__(self, api):
+    def __init__(self, api, copy_api=True):
         """
         Instantiate a new Lepo router.
 
         :param api: The OpenAPI definition object.
         :type api: dict
+        :param copy_api: Whether to deep-copy the definition object.
+                         Only pass False if nothing else holds a reference to it.
+        :type copy_api: bool
         """
-        self.api = deepcopy(api)
+        self.api = (deepcopy(api) if copy_api else api)
         self.api.pop('host', None)
         self.handlers = {}
         self.resolver = RefResolver('', self.api)
 
     @classmethod
-    def from_file(cls, filename):
+    def from_file(cls, filename, cache_dir=None):
         """
         Construct a Router by parsing the given `filename`.
 
-        If PyYAML is installed, YAML files are supported.
+        If PyYAML is installed, YAML files are supported (using the LibYAML based loader when available).
         JSON files are always supported.
 
         :param filename: The filename to read.
+        :param cache_dir: Optional directory for caching the parsed definition, keyed by the file's hash,
+                          so it needn't be parsed again on later boots.
+                          The cache is pickled, so this must be a directory only trusted users can write to.
         :rtype: Router
         """
-        with open(filename) as infp:
-            if filename.endswith('.yaml') or filename.endswith('.yml'):
-                import yaml
-                data = yaml.safe_load(infp)
-            else:
-                import json
-                data = json.load(infp)
-        return cls(data)
+        with open(filename, 'rb') as infp:
+            content = infp.read()
+        cache_filename = None
+        if cache_dir:
+            cache_filename = os.path.join(cache_dir, '%s.%s.pickle' % (
+                os.path.basename(filename),
+                hashlib.sha256(content).hexdigest(),
+            ))
+            data = read_spec_cache(cache_filename)
+            if data is not None:
+                return cls(data, copy_api=False)
+        data = parse_spec(filename, content)
+        if cache_filename:
+            write_spec_cache(cache_filename, data)
+        return cls(data, copy_api=False)
 
     def get_path(self, path):
         """
@@ -147,7 +169,7 @@ class Router:
             'Missing handler for operation %s (tried %s too)' % (operation_id, snake_case(operation_id))
         )
 
-    def add_handlers(self, namespace):
+    def add_handlers(self, namespace, lazy=False):
         """
         Add handler functions from the given `namespace`, for instance a module.
 
@@ -158,7 +180,26 @@ class Router:
 
         :param namespace: Namespace object.
         :type namespace: str|module|dict[str, function]
+        :param lazy: If set (and `namespace` is a module name), the module is only imported when
+                     one of the API's operations is first called. Operations that the module turns
+                     out not to implement fall back to whatever handler was added before.
+        :type lazy: bool
         """
+        if lazy:
+            if not isinstance(namespace, str):
+                raise TypeError('Lazy handlers require a module name, got %r' % namespace)
+            for path in self.get_paths():
+                for operation in path.get_operations():
+                    names = [operation.id]
+                    if snake_case(operation.id) != operation.id:
+                        names.append(snake_case(operation.id))
+                    self.handlers[operation.id] = LazyHandler(
+                        module_name=namespace,
+                        names=names,
+                        fallback=self.handlers.get(operation.id),
+                    )
+            return
+
         if isinstance(namespace, str):
             namespace = import_module(namespace)
 
@@ -183,3 +224,104 @@ class Router:
         """
         url, resolved = self.resolver.resolve(ref)
         return resolved
+
+
+class LazyHandler:
+    """
+    A handler that imports its module on first use.
+    """
+
+    def __init__(self, module_name, names, fallback=None):
+        self.module_name = module_name
+        self.names = names
+        self.fallback = fallback
+        self._handler = None
+
+    def check(self):
+        """
+        Check that the module defines one of the handler names (or that there is a fallback)
+        without importing it, by looking at the module's source.
+
+        :raises MissingHandler: if it doesn't
+        """
+        if self._handler is not None or self.fallback:
+            return
+        defined_names = get_defined_names(self.module_name)
+        if defined_names is not None and not defined_names.intersection(self.names):
+            raise MissingHandler('Module %s has no handler %s' % (self.module_name, ' or '.join(self.names)))
+
+    def resolve(self):
+        if self._handler is None:
+            module = import_module(self.module_name)
+            handler = next((getattr(module, name) for name in self.names if hasattr(module, name)), None)
+            if handler is None and self.fallback:
+                handler = self.fallback
+            if handler is None:
+                raise MissingHandler('Module %s has no handler %s' % (self.module_name, ' or '.join(self.names)))
+            if isinstance(handler, LazyHandler):
+                handler = handler.resolve()
+            self._handler = handler
+        return self._handler
+
+    @property
+    def condition_func(self):
+        return getattr(self.resolve(), 'condition_func', None)
+
+    def __call__(self, request, **kwargs):
+        return self.resolve()(request, **kwargs)
+
+
+@lru_cache(maxsize=None)
+def get_defined_names(module_name):
+    """
+    Get the names a module defines at the top level, reading its source without importing it.
+
+    :return: The names, or None if the module's source isn't available.
+    :rtype: set[str]|None
+    """
+    spec = importlib.util.find_spec(module_name)
+    if spec is None or not spec.origin or not spec.origin.endswith('.py'):
+        return None
+    with open(spec.origin, 'rb') as infp:
+        tree = ast.parse(infp.read(), filename=spec.origin)
+    names = set()
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = (node.targets if isinstance(node, ast.Assign) else [node.target])
+            names.update(target.id for target in targets if isinstance(target, ast.Name))
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.update((alias.asname or alias.name).split('.')[0] for alias in node.names)
+    return names
+
+
+def parse_spec(filename, content):
+    if filename.endswith('.yaml') or filename.endswith('.yml'):
+        import yaml
+        return yaml.load(content, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+    import json
+    return json.loads(content.decode('utf-8'))
+
+
+def read_spec_cache(cache_filename):
+    try:
+        with open(cache_filename, 'rb') as infp:
+            return pickle.load(infp)
+    except FileNotFoundError:
+        return None
+    except Exception:  # A corrupt cache is not worth failing to boot over
+        log.warning('Could not read spec cache %s', cache_filename, exc_info=True)
+        return None
+
+
+def write_spec_cache(cache_filename, data):
+    cache_dir = os.path.dirname(cache_filename)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_filename = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as outfp:
+            pickle.dump(data, outfp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_filename, cache_filename)  # Atomic, so concurrently booting workers never see half a file
+    except OSError:
+        log.warning('Could not write spec cache %s', cache_filename, exc_info=True)
@@ -0,0 +1,38 @@
+"""
+Boot time accounting.
+
+Wrap startup steps in `startup_timer.step()` and the report is logged (at INFO level, to `lepo.startup`)
+whenever a step finishes; `python manage.py lepo_startup_report` prints it.
+For a per-module import breakdown, run Python with `-X importtime`.
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    def __init__(self):
+        self.steps = []
+
+    @contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.steps.append((name, duration))
+            log.info('%s took %.1f ms', name, duration * 1000)
+
+    def format_report(self):
+        total = sum(duration for (name, duration) in self.steps)
+        lines = ['%-40s %10s %6s' % ('step', 'ms', '%')]
+        for name, duration in self.steps:
+            lines.append('%-40s %10.1f %5.1f%%' % (name, duration * 1000, 100.0 * duration / (total or 1)))
+        lines.append('%-40s %10.1f' % ('total', total * 1000))
+        return '\n'.join(lines)
+
+
+startup_timer = StartupTimer()
@@ -0,0 +1,85 @@
+import shutil
+import tempfile
+
+from django.conf.urls import include, url
+from django.http import StreamingHttpResponse
+from django.test import TestCase, override_settings
+
+from lepo.admission import AdmissionRejected, get_admission_urls, get_operation_limiter
+from lepo.tests.utils import get_router, get_urlpatterns
+
+
+def compute(request):
+    return {'result': 1}
+
+
+def stream(request):
+    return StreamingHttpResponse(iter(['[', '1', ']']), content_type='application/json')
+
+
+router = get_router(
+    paths={
+        '/compute': {'get': {
+            'operationId': 'compute',
+            'x-lepo-concurrency': {'concurrency': 1, 'queue': 1, 'timeout': 0.05},
+            'responses': {'200': {'description': 'The result'}},
+        }},
+        '/stream': {'get': {
+            'operationId': 'stream',
+            'x-lepo-concurrency': 1,
+            'responses': {'200': {'description': 'The results'}},
+        }},
+    },
+    handlers={'compute': compute, 'stream': stream},
+)
+
+urlpatterns = get_urlpatterns(router) + [url(r'^api/', include(get_admission_urls(router)))]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AdmissionTest(TestCase):
+    def setUp(self):
+        lock_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, lock_dir, ignore_errors=True)
+        admission_settings = override_settings(LEPO_ADMISSION={
+            'LOCK_DIR': lock_dir,
+            'RETRY_AFTER': 3,
+            'METRICS_SECRET': 'sesame',
+        })
+        admission_settings.enable()
+        self.addCleanup(admission_settings.disable)
+
+    def get_limiter(self, path):
+        return get_operation_limiter(router.get_path(path).get_operation('get'))
+
+    def test_rejected_while_busy(self):
+        slot = self.get_limiter('/compute').acquire()
+        try:
+            response = self.client.get('/api/compute')  # Queued, then timed out
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '3')
+        finally:
+            slot.release()
+        self.assertEqual(self.client.get('/api/compute').status_code, 200)
+
+    def test_streamed_response_holds_slot(self):
+        limiter = self.get_limiter('/stream')
+        response = self.client.get('/api/stream')
+        self.assertEqual(response.status_code, 200)
+        with self.assertRaises(AdmissionRejected):  # Still held while the body is being sent
+            limiter.acquire()
+        self.assertEqual(b''.join(response.streaming_content), b'[1]')
+        limiter.acquire().release()
+
+    def test_metrics(self):
+        self.assertEqual(self.client.get('/api/_admission/metrics').status_code, 403)
+        response = self.client.get('/api/_admission/metrics', HTTP_AUTHORIZATION='Bearer open')
+        self.assertEqual(response.status_code, 403)
+        slot = self.get_limiter('/compute').acquire()
+        try:
+            response = self.client.get('/api/_admission/metrics', {'format': 'json'}, HTTP_AUTHORIZATION='Bearer sesame')
+        finally:
+            slot.release()
+        self.assertEqual(response.json()['compute'], {'concurrency': 1, 'queue': 1, 'running': 1, 'queued': 0})
+        response = self.client.get('/api/_admission/metrics', HTTP_AUTHORIZATION='Bearer sesame')
+        self.assertIn('lepo_admission_running{operation="compute"} 0', response.content.decode())
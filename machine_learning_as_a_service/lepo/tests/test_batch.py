@@ -0,0 +1,66 @@
+import json
+
+from django.test import TestCase, override_settings
+
+from lepo.batch import execute_batch
+from lepo.tests.utils import get_router, get_urlpatterns
+
+
+def whoami(request):
+    return {
+        'authorization': request.META.get('HTTP_AUTHORIZATION'),
+        'cookie': request.META.get('HTTP_COOKIE'),
+        'user_agent': request.META.get('HTTP_USER_AGENT'),
+    }
+
+
+router = get_router(
+    paths={
+        '/batch': {'post': {
+            'operationId': 'execute_batch',
+            'parameters': [{'name': 'batch', 'in': 'body', 'required': True, 'schema': {'type': 'object'}}],
+            'responses': {'200': {'description': 'The results'}},
+        }},
+        '/whoami': {'get': {
+            'operationId': 'whoami',
+            'responses': {'200': {'description': 'The request headers'}},
+        }},
+    },
+    handlers={'execute_batch': execute_batch, 'whoami': whoami},
+)
+
+urlpatterns = get_urlpatterns(router)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class BatchTest(TestCase):
+    def post_batch(self, requests, **extra):
+        response = self.client.post(
+            '/api/batch',
+            json.dumps({'requests': requests}),
+            content_type='application/json',
+            **extra
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_credentials_are_not_passed_on(self):
+        results = self.post_batch(
+            [{'id': 'a', 'operation_id': 'whoami'}, {'id': 'b', 'path': '/whoami'}],
+            HTTP_AUTHORIZATION='Bearer secret',
+            HTTP_COOKIE='sessionid=secret',
+            HTTP_USER_AGENT='tests',
+        )
+        self.assertEqual([result['id'] for result in results], ['a', 'b'])
+        for result in results:
+            self.assertEqual(result['status'], 200)
+            self.assertEqual(result['body'], {'authorization': None, 'cookie': None, 'user_agent': 'tests'})
+
+    def test_nested_batches_are_rejected(self):
+        results = self.post_batch([
+            {'id': 'a', 'operation_id': 'execute_batch', 'body': {'requests': [{'operation_id': 'whoami'}]}},
+            {'id': 'b', 'method': 'POST', 'path': '/batch', 'body': {'requests': []}},
+            {'id': 'c', 'operation_id': 'whoami'},
+        ])
+        self.assertEqual([result['status'] for result in results], [400, 400, 200])
+        self.assertEqual(results[0]['body'], {'error': 'Batches may not be nested'})
@@ -0,0 +1,102 @@
+import json
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from marshmallow import Schema, fields, post_load
+
+from data.models import Data
+from lepo.handlers import ModelHandlerBulkCreateMixin, ModelHandlerBulkDeleteMixin, ModelHandlerBulkUpdateMixin
+from lepo.tests.utils import get_router, get_urlpatterns
+
+
+class DataSchema(Schema):
+    id = fields.Integer(dump_only=True)
+    source_url = fields.String()
+
+    @post_load
+    def make_data(self, data):
+        if self.partial:  # Updates are set on the existing objects
+            return data
+        return Data(data_frame=[], **data)
+
+
+class DataBulkHandler(ModelHandlerBulkCreateMixin, ModelHandlerBulkUpdateMixin, ModelHandlerBulkDeleteMixin):
+    model = Data
+    queryset = Data.objects.all()
+    schema_class = DataSchema
+
+
+def get_bulk_operation(operation_id):
+    return {
+        'operationId': operation_id,
+        'parameters': [{'name': 'data', 'in': 'body', 'required': True, 'schema': {'type': 'array', 'items': {}}}],
+        'responses': {'200': {'description': 'The results'}},
+    }
+
+
+router = get_router(
+    paths={
+        '/data/bulk': {
+            'post': get_bulk_operation('bulk_create_data'),
+            'patch': get_bulk_operation('bulk_update_data'),
+            'delete': get_bulk_operation('bulk_delete_data'),
+        },
+    },
+    handlers={
+        'bulk_create_data': DataBulkHandler.get_view('handle_bulk_create'),
+        'bulk_update_data': DataBulkHandler.get_view('handle_bulk_update'),
+        'bulk_delete_data': DataBulkHandler.get_view('handle_bulk_delete'),
+    },
+)
+
+urlpatterns = get_urlpatterns(router)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class BulkTest(TestCase):
+    def send(self, method, records):
+        response = self.client.generic(method, '/api/data/bulk', json.dumps(records), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def create(self, *urls):
+        return [Data.objects.create(data_frame=[], source_url=url) for url in urls]
+
+    def test_bulk_create(self):
+        Data.objects.create(data_frame=[])  # So that the new IDs don't start at 1
+        records = [{'source_url': 'http://example.com/%d.csv' % index} for index in range(5)]
+        records.insert(2, {'source_url': 'not an URL'})
+        with CaptureQueriesContext(connection) as queries:
+            result = self.send('POST', records)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT')]), 1)
+        self.assertEqual(list(result['errors']), ['2'])
+        self.assertIsNone(result['results'][2])
+        for record, created in zip(records, result['results']):
+            if created:
+                self.assertEqual(Data.objects.get(pk=created['id']).source_url, record['source_url'])
+        self.assertEqual(Data.objects.count(), 6)
+
+    def test_bulk_update(self):
+        first, second = self.create('http://example.com/a.csv', 'http://example.com/b.csv')
+        result = self.send('PATCH', [
+            {'id': first.pk, 'source_url': 'http://example.com/c.csv'},
+            {'id': 'first', 'source_url': 'http://example.com/d.csv'},
+            {'id': 99999, 'source_url': 'http://example.com/e.csv'},
+            {'source_url': 'http://example.com/f.csv'},
+        ])
+        self.assertEqual(result['results'][0], {'id': first.pk, 'source_url': 'http://example.com/c.csv'})
+        self.assertEqual(sorted(result['errors']), ['1', '2', '3'])
+        self.assertIn('id', result['errors']['1'])
+        self.assertEqual(
+            list(Data.objects.order_by('pk').values_list('source_url', flat=True)),
+            ['http://example.com/c.csv', 'http://example.com/b.csv'],
+        )
+
+    def test_bulk_delete(self):
+        first, second = self.create('http://example.com/a.csv', 'http://example.com/b.csv')
+        result = self.send('DELETE', [first.pk, 'second', 99999, {'id': second.pk}])
+        self.assertEqual(result['deleted'], [first.pk])
+        self.assertEqual(result['count'], 1)
+        self.assertEqual(sorted(result['errors']), ['1', '2', '3'])
+        self.assertEqual(list(Data.objects.values_list('pk', flat=True)), [second.pk])
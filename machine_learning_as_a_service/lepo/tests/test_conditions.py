@@ -0,0 +1,107 @@
+import json
+
+from django.http import JsonResponse
+from django.test import TestCase, override_settings
+from marshmallow import Schema, fields
+
+from data.models import Data
+from lepo.excs import ExceptionalResponse
+from lepo.handlers import ModelHandlerReadMixin, ModelHandlerUpdateMixin
+from lepo.tests.utils import get_router, get_urlpatterns
+
+
+class DataSchema(Schema):
+    id = fields.Integer(dump_only=True)
+    source_url = fields.String()
+
+
+class DataHandler(ModelHandlerReadMixin, ModelHandlerUpdateMixin):
+    model = Data
+    queryset = Data.objects.all()
+    schema_class = DataSchema
+    etag_field_name = 'content_hash'
+    last_modified_field_name = 'updated'
+    view_processors = ('check_access',)
+
+    def check_access(self, purpose):
+        if self.request.META.get('HTTP_X_ACCESS') != 'granted':
+            raise ExceptionalResponse(JsonResponse({'error': 'Access denied'}, status=403))
+
+
+router = get_router(
+    paths={
+        '/data/{id}': {
+            'parameters': [{'name': 'id', 'in': 'path', 'required': True, 'type': 'integer'}],
+            'get': {'operationId': 'retrieve_data', 'responses': {'200': {'description': 'The data'}}},
+            'put': {
+                'operationId': 'update_data',
+                'parameters': [{'name': 'data', 'in': 'body', 'required': True, 'schema': {'type': 'object'}}],
+                'responses': {'200': {'description': 'The updated data'}},
+            },
+        },
+    },
+    handlers={
+        'retrieve_data': DataHandler.get_view('handle_retrieve'),
+        'update_data': DataHandler.get_view('handle_update'),
+    },
+)
+
+urlpatterns = get_urlpatterns(router)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class ConditionTest(TestCase):
+    def setUp(self):
+        self.data = Data.objects.create(data_frame=[], source_url='http://example.com/a.csv', content_hash='abc')
+        self.url = '/api/data/%d' % self.data.pk
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url, HTTP_X_ACCESS='granted')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"abc"')
+        self.assertIn('Last-Modified', response)
+        response = self.client.get(self.url, HTTP_X_ACCESS='granted', HTTP_IF_NONE_MATCH='"abc"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], '"abc"')
+        response = self.client.get(self.url, HTTP_X_ACCESS='granted', HTTP_IF_NONE_MATCH='"def"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_put(self):
+        body = json.dumps({'source_url': 'http://example.com/b.csv'})
+        response = self.client.put(
+            self.url, body, content_type='application/json',
+            HTTP_X_ACCESS='granted', HTTP_IF_MATCH='"def"',
+        )
+        self.assertEqual(response.status_code, 412)
+        self.data.refresh_from_db()
+        self.assertEqual(self.data.source_url, 'http://example.com/a.csv')
+        response = self.client.put(
+            self.url, body, content_type='application/json',
+            HTTP_X_ACCESS='granted', HTTP_IF_MATCH='"abc"',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.data.refresh_from_db()
+        self.assertEqual(self.data.source_url, 'http://example.com/b.csv')
+
+    def test_processors_run_before_conditions(self):
+        # Without access, the validators must neither be compared nor revealed
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"abc"')
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn('ETag', response)
+        response = self.client.put(self.url, '{}', content_type='application/json', HTTP_IF_MATCH='"def"')
+        self.assertEqual(response.status_code, 403)
+
+    def test_processors_run_once(self):
+        calls = []
+        check_access = DataHandler.check_access
+
+        def counting_check_access(handler, purpose):
+            calls.append(purpose)
+            check_access(handler, purpose)
+
+        DataHandler.check_access = counting_check_access
+        try:
+            self.assertEqual(self.client.get(self.url, HTTP_X_ACCESS='granted').status_code, 200)
+        finally:
+            DataHandler.check_access = check_access
+        self.assertEqual(calls, ['view'])
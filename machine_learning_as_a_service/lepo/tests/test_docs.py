@@ -0,0 +1,55 @@
+import gzip
+import json
+
+from django.conf.urls import include, url
+from django.test import TestCase, override_settings
+
+from lepo.tests.utils import get_router
+from lepo_doc.precompressed import accepts_gzip, get_swagger_ui_asset
+from lepo_doc.urls import get_docs_urls
+from lepo_doc.views import get_asset_version
+
+router = get_router(paths={'/ping': {'get': {'operationId': 'ping', 'responses': {'200': {'description': 'Pong'}}}}})
+
+urlpatterns = [url(r'^api/', include((get_docs_urls(router, 'api-docs'), 'api-docs'), namespace='api-docs'))]
+
+
+class AcceptEncodingTest(TestCase):
+    def test_accepts_gzip(self):
+        for value in ('gzip', 'deflate, gzip', 'GZIP;q=0.5', 'x-gzip', '*', 'identity, *;q=0.1'):
+            self.assertTrue(accepts_gzip(value), value)
+        for value in ('', 'identity', 'deflate, br', 'gzip;q=0', 'gzip; q=0.0, *', '*;q=0', 'gzipped'):
+            self.assertFalse(accepts_gzip(value), value)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class PrecompressedSpecTest(TestCase):
+    def test_negotiation(self):
+        response = self.client.get('/api/swagger.json', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response['ETag'].endswith('-gzip"'))
+        self.assertEqual(json.loads(gzip.decompress(response.content).decode('utf-8')), router.api)
+        gzipped_etag = response['ETag']
+
+        response = self.client.get('/api/swagger.json', HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(json.loads(response.content.decode('utf-8')), router.api)
+        self.assertNotEqual(response['ETag'], gzipped_etag)
+
+    def test_revalidation(self):
+        etag = self.client.get('/api/swagger.json')['ETag']
+        response = self.client.get('/api/swagger.json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        # The gzipped representation has an ETag of its own
+        response = self.client.get('/api/swagger.json', HTTP_IF_NONE_MATCH=etag, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+
+    def test_asset_caching(self):
+        version = get_asset_version(get_swagger_ui_asset('swagger-ui.css'))
+        response = self.client.get('/api/swagger-ui/swagger-ui.css', {'v': version})
+        self.assertIn('immutable', response['Cache-Control'])
+        response = self.client.get('/api/swagger-ui/swagger-ui.css', {'v': 'old'})
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertEqual(self.client.get('/api/swagger-ui/other.js').status_code, 404)
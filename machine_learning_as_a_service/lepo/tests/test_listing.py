@@ -0,0 +1,103 @@
+import json
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from marshmallow import Schema, fields
+
+from data.models import Data, DataSegment
+from lepo.handlers import ModelHandlerReadMixin, encode_cursor
+from lepo.tests.utils import get_router, get_urlpatterns
+
+
+class DataSchema(Schema):
+    id = fields.Integer()
+    segment_count = fields.Method('get_segment_count')
+
+    def get_segment_count(self, data):
+        return len(data.segments.all())
+
+
+class DataHandler(ModelHandlerReadMixin):
+    model = Data
+    queryset = Data.objects.prefetch_related('segments')
+    schema_class = DataSchema
+    list_prefetch_batch_size = 2
+
+
+class StreamingDataHandler(DataHandler):
+    list_stream = True
+
+
+def get_list_operation(operation_id):
+    return {
+        'operationId': operation_id,
+        'parameters': [
+            {'name': 'cursor', 'in': 'query', 'type': 'string'},
+            {'name': 'limit', 'in': 'query', 'type': 'integer'},
+        ],
+        'responses': {'200': {'description': 'The data'}},
+    }
+
+
+router = get_router(
+    paths={
+        '/data': {'get': get_list_operation('list_data')},
+        '/streamed-data': {'get': get_list_operation('stream_data')},
+    },
+    handlers={
+        'list_data': DataHandler.get_view('handle_list'),
+        'stream_data': StreamingDataHandler.get_view('handle_list'),
+    },
+)
+
+urlpatterns = get_urlpatterns(router)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class ListTest(TestCase):
+    def setUp(self):
+        self.data = [Data.objects.create(data_frame=[]) for x in range(5)]
+        for version in (2, 3):
+            DataSegment.objects.create(data=self.data[0], version=version, data_frame=[], row_count=0)
+
+    def get_pages(self, url, limit):
+        ids = []
+        cursor = None
+        while True:
+            params = {'limit': limit}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            page = json.loads(b''.join(response) if response.streaming else response.content)
+            ids.extend(record['id'] for record in page['results'])
+            cursor = page['next']
+            if not cursor:
+                return ids
+
+    def test_cursor_round_trip(self):
+        expected = [data.pk for data in self.data]
+        self.assertEqual(self.get_pages('/api/data', 2), expected)
+        self.assertEqual(self.get_pages('/api/streamed-data', 2), expected)
+        self.assertEqual(self.get_pages('/api/data', 5), expected)
+
+    def test_bad_cursor(self):
+        for cursor in ('not a cursor', encode_cursor('not an id')):
+            response = self.client.get('/api/data', {'limit': 2, 'cursor': cursor})
+            self.assertEqual(response.status_code, 400)
+
+    def test_prefetch(self):
+        # Not ordered, so read at once: one query for the objects, and one to prefetch their segments
+        with self.assertNumQueries(2):
+            records = self.client.get('/api/data').json()
+        self.assertEqual(sorted(record['segment_count'] for record in records), [0, 0, 0, 0, 2])
+        # Paginated, so ordered and read in batches of two, prefetching for each batch
+        with self.assertNumQueries(6):
+            records = self.client.get('/api/data', {'limit': 5}).json()['results']
+        self.assertEqual([record['segment_count'] for record in records], [2, 0, 0, 0, 0])
+
+    def test_streaming_error_before_response(self):
+        # Raised by the view itself, so it becomes an error response rather than a cut-short 200
+        with mock.patch.object(DataSchema, 'get_segment_count', side_effect=ZeroDivisionError):
+            with self.assertRaises(ZeroDivisionError):
+                self.client.get('/api/streamed-data')
@@ -0,0 +1,119 @@
+import json
+import random
+import re
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from lepo.loadgen import RequestSynthesizer
+from lepo.tests.utils import get_router, get_urlpatterns
+
+
+def echo_object(request, data):
+    return {'data': data}
+
+
+def echo_text(request, text):
+    return {'text': text}
+
+
+def echo_bytes(request, content):
+    return {'length': len(content)}
+
+
+def echo_array(request, values):
+    return {'shape': list(values.shape), 'dtype': str(values.dtype)}
+
+
+def get_body_operation(operation_id, consumes, parameter):
+    return {'post': {
+        'operationId': operation_id,
+        'consumes': consumes,
+        'parameters': [dict(parameter, **{'in': 'body', 'required': True})],
+        'responses': {'200': {'description': 'The parameter'}},
+    }}
+
+
+ARRAY_PARAMETER = {
+    'name': 'values',
+    'schema': {'type': 'string'},
+    'x-ndarray': {'dtype': 'int32', 'shape': [None, 3]},
+}
+
+router = get_router(
+    paths={
+        '/object': get_body_operation('echo_object', ['application/json'], {
+            'name': 'data',
+            'schema': {
+                'type': 'object',
+                'required': ['code'],
+                'properties': {'code': {'type': 'string', 'pattern': '^[A-Z]{3}-\\d{2}$'}},
+            },
+        }),
+        '/text': get_body_operation('echo_text', ['text/plain'], {'name': 'text', 'schema': {'type': 'string'}}),
+        '/bytes': get_body_operation('echo_bytes', ['application/octet-stream'], {'name': 'content', 'schema': {}}),
+        '/array': get_body_operation('echo_array', ['application/octet-stream'], ARRAY_PARAMETER),
+        '/json-array': get_body_operation('echo_json_array', ['application/json'], ARRAY_PARAMETER),
+    },
+    handlers={
+        'echo_object': echo_object,
+        'echo_text': echo_text,
+        'echo_bytes': echo_bytes,
+        'echo_array': echo_array,
+        'echo_json_array': echo_array,
+    },
+)
+
+urlpatterns = get_urlpatterns(router)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class SynthesisTest(TestCase):
+    def setUp(self):
+        self.synthesizer = RequestSynthesizer(router, random.Random(42))
+
+    def send(self, path):
+        kwargs = self.synthesizer.synthesize_request(router.get_path(path).get_operation('post'))
+        headers = {
+            'HTTP_%s' % name.upper().replace('-', '_'): value
+            for (name, value) in kwargs['headers'].items()
+            if name != 'Content-Type'
+        }
+        response = self.client.generic(
+            kwargs['method'],
+            kwargs['url'],
+            kwargs['data'],
+            content_type=kwargs['headers']['Content-Type'],
+            **headers
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        return (kwargs, response.json())
+
+    def test_json_body(self):
+        kwargs, result = self.send('/object')
+        self.assertEqual(kwargs['headers']['Content-Type'], 'application/json')
+        self.assertRegex(result['data']['code'], r'^[A-Z]{3}-\d{2}$')
+
+    def test_text_body(self):
+        kwargs, result = self.send('/text')
+        self.assertEqual(kwargs['headers']['Content-Type'], 'text/plain')
+        self.assertEqual(kwargs['data'], result['text'].encode('utf-8'))  # Raw text, not a JSON string
+
+    def test_bytes_body(self):
+        kwargs, result = self.send('/bytes')
+        self.assertEqual(kwargs['headers']['Content-Type'], 'application/octet-stream')
+        self.assertEqual(result['length'], len(kwargs['data']))
+
+    def test_array_bodies(self):
+        kwargs, result = self.send('/array')
+        self.assertIn('X-Ndarray-Shape', kwargs['headers'])
+        self.assertEqual(result['shape'][1], 3)
+        self.assertEqual(result['dtype'], 'int32')
+        kwargs, result = self.send('/json-array')
+        self.assertEqual(result['shape'], json.loads(kwargs['data'])['shape'])
+
+    def test_pattern_without_parser(self):
+        schema = {'type': 'string', 'pattern': '^[a-z]+$', 'example': 'fallback'}
+        self.assertTrue(re.match(schema['pattern'], self.synthesizer.synthesize_pattern_string(schema)))
+        with mock.patch('lepo.loadgen.sre_parse', None):
+            self.assertEqual(self.synthesizer.synthesize_pattern_string(schema), 'fallback')
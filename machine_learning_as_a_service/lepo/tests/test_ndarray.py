@@ -0,0 +1,104 @@
+import base64
+import json
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from lepo.excs import InvalidArray
+from lepo.ndarray import decode_ndarray, parse_shape
+from lepo.tests.utils import get_router, get_urlpatterns
+
+
+def describe(request, array):
+    return {'shape': list(array.shape), 'dtype': str(array.dtype), 'sum': float(array.sum())}
+
+
+router = get_router(
+    paths={
+        '/describe': {'post': {
+            'operationId': 'describe',
+            'consumes': ['application/json', 'application/octet-stream'],
+            'parameters': [{
+                'name': 'array',
+                'in': 'body',
+                'required': True,
+                'schema': {'type': 'string'},
+                'x-ndarray': {'dtype': 'float64', 'shape': [None, 2]},
+            }],
+            'responses': {'200': {'description': 'The shape and dtype of the array'}},
+        }},
+    },
+    handlers={'describe': describe},
+)
+
+urlpatterns = get_urlpatterns(router)
+
+
+def encode(array):
+    return base64.b64encode(array.tobytes()).decode()
+
+
+class ShapeTest(SimpleTestCase):
+    def test_valid(self):
+        self.assertEqual(parse_shape('16, 8'), (16, 8))
+        self.assertEqual(parse_shape([0, 3]), (0, 3))
+
+    def test_invalid(self):
+        for shape in ('16,8.5', '-2,4', '1e3', '²', [2.5, 2], [-1, 4], [True], '4,x', 16):
+            with self.assertRaises(InvalidArray, msg=shape):
+                parse_shape(shape)
+
+
+class DecodeTest(SimpleTestCase):
+    def test_dtype(self):
+        spec = {'dtype': 'float64'}
+        array = decode_ndarray(spec, {'data': encode(np.arange(4, dtype='int32')), 'dtype': 'int32'})
+        self.assertEqual(array.dtype, np.float64)
+        self.assertEqual(array.tolist(), [0, 1, 2, 3])
+        for (dtype, message) in [('float128x', 'Invalid dtype'), ('O', 'objects'), ('V0', 'zero-size')]:
+            with self.assertRaisesRegex(InvalidArray, message):
+                decode_ndarray(spec, {'data': '', 'dtype': dtype})
+        with self.assertRaisesRegex(InvalidArray, 'without loss'):
+            decode_ndarray({'dtype': 'int32'}, {'data': encode(np.zeros(2)), 'dtype': 'float64'})
+        with self.assertRaisesRegex(InvalidArray, 'whole number'):
+            decode_ndarray(spec, base64.b64encode(b'\0' * 12).decode())
+
+    def test_shape(self):
+        spec = {'dtype': 'float64', 'shape': [None, 2]}
+        self.assertEqual(decode_ndarray(spec, encode(np.zeros(6))).shape, (3, 2))
+        self.assertEqual(decode_ndarray(spec, {'data': encode(np.zeros(6)), 'shape': [3, 2]}).shape, (3, 2))
+        with self.assertRaisesRegex(InvalidArray, 'do not fit'):
+            decode_ndarray(spec, encode(np.zeros(5)))
+        with self.assertRaisesRegex(InvalidArray, 'does not match'):
+            decode_ndarray(spec, {'data': encode(np.zeros(6)), 'shape': [2, 3]})
+        with self.assertRaisesRegex(InvalidArray, 'Invalid shape'):
+            decode_ndarray(spec, {'data': encode(np.zeros(6)), 'shape': [-3, -2]})
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class ArrayParameterTest(SimpleTestCase):
+    def test_raw_body(self):
+        response = self.client.post(
+            '/api/describe',
+            np.arange(6, dtype='float64').tobytes(),
+            content_type='application/octet-stream',
+            HTTP_X_NDARRAY_SHAPE='3,2',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'shape': [3, 2], 'dtype': 'float64', 'sum': 15.0})
+
+    def test_json_body(self):
+        body = {'data': encode(np.ones(4, dtype='float32')), 'dtype': 'float32', 'shape': [2, 2]}
+        response = self.client.post('/api/describe', json.dumps(body), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'shape': [2, 2], 'dtype': 'float64', 'sum': 4.0})
+
+    def test_invalid_shape_header(self):
+        for shape in ('1.5,4', '-3,-2', '3,2,1'):
+            response = self.client.post(
+                '/api/describe',
+                np.zeros(6).tobytes(),
+                content_type='application/octet-stream',
+                HTTP_X_NDARRAY_SHAPE=shape,
+            )
+            self.assertEqual(response.status_code, 400, shape)
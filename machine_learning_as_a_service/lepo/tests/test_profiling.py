@@ -0,0 +1,67 @@
+import marshal
+import time
+
+from django.conf.urls import include, url
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from lepo.profiling import get_profiling_urls
+from lepo.tests.utils import get_router, get_urlpatterns
+
+
+def compute_answer(request):
+    time.sleep(0.02)  # Long enough for the sampling profiler to take a sample or two
+    return {'answer': 42}
+
+
+router = get_router(
+    paths={'/answer': {'get': {'operationId': 'compute_answer', 'responses': {'200': {'description': 'The answer'}}}}},
+    handlers={'compute_answer': compute_answer},
+)
+
+urlpatterns = get_urlpatterns(router) + [url(r'^api/', include(get_profiling_urls()))]
+
+
+@override_settings(ROOT_URLCONF=__name__, LEPO_PROFILING={'SECRET': 'sesame'})
+class ProfilingTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_not_profiled_without_secret(self):
+        self.assertNotIn('X-Lepo-Profile-Id', self.client.get('/api/answer'))
+        self.assertNotIn('X-Lepo-Profile-Id', self.client.get('/api/answer', HTTP_X_LEPO_PROFILE='open'))
+
+    def test_capture_and_retrieve(self):
+        response = self.client.get('/api/answer', HTTP_X_LEPO_PROFILE='sesame', HTTP_X_REQUEST_ID='req-1')
+        self.assertEqual(response.json(), {'answer': 42})
+        self.assertEqual(response['X-Lepo-Profile-Id'], 'req-1')
+
+        response = self.client.get('/api/_profiles/req-1', HTTP_X_LEPO_PROFILE='sesame')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Lepo-Profile-Operation'], 'compute_answer')
+        self.assertIn('compute_answer', response.content.decode())
+
+        response = self.client.get('/api/_profiles/req-1', {'format': 'pstats'}, HTTP_X_LEPO_PROFILE='sesame')
+        stats = marshal.loads(response.content)
+        self.assertTrue(any(function[2] == 'compute_answer' for function in stats))
+
+        response = self.client.get('/api/_profiles/req-1', {'format': 'svg'}, HTTP_X_LEPO_PROFILE='sesame')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/api/_profiles/req-2', HTTP_X_LEPO_PROFILE='sesame')
+        self.assertEqual(response.status_code, 404)
+
+    def test_retrieval_needs_secret(self):
+        self.client.get('/api/answer', HTTP_X_LEPO_PROFILE='sesame', HTTP_X_REQUEST_ID='req-1')
+        self.assertEqual(self.client.get('/api/_profiles/req-1').status_code, 403)
+        self.assertEqual(self.client.get('/api/_profiles/req-1', HTTP_X_LEPO_PROFILE='open').status_code, 403)
+
+    def test_insane_request_id_is_replaced(self):
+        response = self.client.get('/api/answer', HTTP_X_LEPO_PROFILE='sesame', HTTP_X_REQUEST_ID='../../etc')
+        self.assertRegex(response['X-Lepo-Profile-Id'], r'^[0-9a-f]{32}$')
+
+    def test_sampled_sampling_profile(self):
+        with self.settings(LEPO_PROFILING={'SECRET': 'sesame', 'SAMPLE_RATE': 1, 'PROFILER': 'sampling'}):
+            request_id = self.client.get('/api/answer')['X-Lepo-Profile-Id']
+            response = self.client.get('/api/_profiles/%s' % request_id, HTTP_X_LEPO_PROFILE='sesame')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('compute_answer', response.content.decode())
@@ -0,0 +1,82 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from lepo.excs import MissingHandler
+from lepo.router import LazyHandler, Router, parse_spec
+
+
+def get_spec(title):
+    return {
+        'swagger': '2.0',
+        'info': {'title': title, 'version': '1'},
+        'paths': {'/ping': {'get': {'operationId': 'ping', 'responses': {'200': {'description': 'Pong'}}}}},
+    }
+
+
+class SpecCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.filename = os.path.join(self.directory, 'spec.json')
+        self.cache_dir = os.path.join(self.directory, 'cache')
+
+    def write_spec(self, title):
+        with open(self.filename, 'w') as outfp:
+            json.dump(get_spec(title), outfp)
+
+    def load(self):
+        with mock.patch('lepo.router.parse_spec', wraps=parse_spec) as parse:
+            router = Router.from_file(self.filename, cache_dir=self.cache_dir)
+        return (router, parse.called)
+
+    def test_cache_is_used(self):
+        self.write_spec('First')
+        router, parsed = self.load()
+        self.assertTrue(parsed)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        router, parsed = self.load()
+        self.assertFalse(parsed)
+        self.assertEqual(router.api['info']['title'], 'First')
+
+    def test_cache_is_invalidated_by_changes(self):
+        self.write_spec('First')
+        self.load()
+        self.write_spec('Second')
+        router, parsed = self.load()
+        self.assertTrue(parsed)
+        self.assertEqual(router.api['info']['title'], 'Second')
+
+    def test_corrupt_cache_is_ignored(self):
+        self.write_spec('First')
+        self.load()
+        for name in os.listdir(self.cache_dir):
+            with open(os.path.join(self.cache_dir, name), 'wb') as outfp:
+                outfp.write(b'not a pickle')
+        with self.assertLogs('lepo.router', 'WARNING'):
+            router, parsed = self.load()
+        self.assertTrue(parsed)
+        self.assertEqual(router.api['info']['title'], 'First')
+
+
+class LazyHandlerTest(SimpleTestCase):
+    def test_resolve(self):
+        handler = LazyHandler('lepo.tests.test_router', ['get_spec'])
+        handler.check()
+        self.assertIs(handler.resolve(), get_spec)
+
+    def test_fallback(self):
+        fallback = LazyHandler('lepo.tests.test_router', ['get_spec'])
+        handler = LazyHandler('lepo.tests.test_router', ['nonexistent'], fallback=fallback)
+        self.assertIs(handler.resolve(), get_spec)
+
+    def test_missing(self):
+        handler = LazyHandler('lepo.tests.test_router', ['nonexistent'])
+        with self.assertRaises(MissingHandler):
+            handler.check()
+        with self.assertRaises(MissingHandler):
+            handler.resolve()
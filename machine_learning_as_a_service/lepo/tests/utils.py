@@ -0,0 +1,28 @@
+from django.conf.urls import include, url
+
+from lepo.router import Router
+
+
+def get_router(paths, handlers=None, **api):
+    """
+    Build a router for a minimal API with the given paths, and add the given handlers to it.
+
+    :type paths: dict
+    :type handlers: dict[str, function]|None
+    :rtype: lepo.router.Router
+    """
+    router = Router(dict({
+        'swagger': '2.0',
+        'info': {'title': 'Test API', 'version': '1'},
+        'basePath': '/api',
+        'consumes': ['application/json'],
+        'produces': ['application/json'],
+        'paths': paths,
+    }, **api), copy_api=False)
+    if handlers:
+        router.add_handlers(handlers)
+    return router
+
+
+def get_urlpatterns(router):
+    return [url(r'^api/', include(router.get_urls()))]
@@ -1,7 +1,15 @@
 from lepo.excs import RouterValidationError
+from lepo.router import LazyHandler
 
 
-def validate_router(router):
+def validate_router(router, import_handlers=False):
+    """
+    Check that there is a handler for every operation in the router's API.
+
+    :param import_handlers: Whether to import lazy handlers' modules to check them.
+                            This defeats the purpose of lazy handlers, so it's best left for development;
+                            otherwise their modules' sources are checked without importing them.
+    """
     errors = {}
     operations = set()
     for path in router.get_paths():
@@ -9,7 +17,12 @@ def validate_router(router):
             operations.add(operation.id)
     for operation in operations:
         try:
-            router.get_handler(operation)
+            handler = router.get_handler(operation)
+            if isinstance(handler, LazyHandler):
+                if import_handlers:
+                    handler.resolve()
+                else:
+                    handler.check()
         except Exception as e:
             errors[operation] = e
     if errors:
@@ -0,0 +1,87 @@
+import hashlib
+import os
+from functools import lru_cache
+
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.text import compress_string
+
+
+STATIC_ROOT = os.path.join(os.path.dirname(__file__), 'static', 'lepo_doc', 'swagger-ui')
+
+SWAGGER_UI_ASSETS = {
+    'swagger-ui-bundle.js': 'application/javascript; charset=utf-8',
+    'swagger-ui.css': 'text/css; charset=utf-8',
+}
+
+
+def accepts_gzip(accept_encoding):
+    """
+    Check whether an `Accept-Encoding` header value allows gzip, i.e. lists `gzip` (or `*`)
+    with a nonzero quality (`gzip;q=0` refuses it).
+
+    :type accept_encoding: str
+    :rtype: bool
+    """
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+class PrecompressedContent:
+    """
+    Content serialized and gzipped once, served with a strong ETag per representation
+    (the gzipped one's ends in `-gzip`, as the two differ byte for byte).
+    """
+
+    def __init__(self, content, content_type):
+        """
+        :type content: bytes
+        :type content_type: str
+        """
+        self.content = content
+        self.gzipped_content = compress_string(content)
+        self.content_type = content_type
+        self.hash = hashlib.sha1(content).hexdigest()
+        self.etag = '"%s"' % self.hash
+        self.gzipped_etag = '"%s-gzip"' % self.hash
+
+    def get_response(self, request, cache_control):
+        gzipped = accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        etag = (self.gzipped_etag if gzipped else self.etag)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            if gzipped:
+                response = HttpResponse(self.gzipped_content, content_type=self.content_type)
+                response['Content-Encoding'] = 'gzip'
+            else:
+                response = HttpResponse(self.content, content_type=self.content_type)
+            response['Content-Length'] = str(len(response.content))
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+@lru_cache(maxsize=None)
+def get_swagger_ui_asset(name):
+    """
+    Read and compress a bundled Swagger UI asset (once per process).
+
+    :rtype: PrecompressedContent
+    """
+    with open(os.path.join(STATIC_ROOT, name), 'rb') as infp:
+        return PrecompressedContent(infp.read(), SWAGGER_UI_ASSETS[name])
@@ -1,13 +1,34 @@
+import json
+
 from django.conf.urls import url
+from django.core.serializers.json import DjangoJSONEncoder
+
+from lepo_doc.precompressed import PrecompressedContent
 
 
-def get_docs_urls(router, namespace, docs_url='docs/?'):
+def get_docs_urls(router, namespace, docs_url='docs/?', spec_cache_control='no-cache'):
+    """
+    :param spec_cache_control: Cache-Control for the spec document. The default makes clients revalidate
+                               on every use, which is answered with a cheap 304 while the spec is unchanged.
+    """
     from . import views
     json_url_name = 'lepo_doc_%s' % id(router)
+    asset_url_name = 'lepo_doc_asset_%s' % id(router)
+    # The spec doesn't change after the router is built, so serialize and compress it only once
+    document = PrecompressedContent(
+        json.dumps(router.api, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8'),
+        content_type='application/json',
+    )
     return [
-        url('swagger\.json$', views.get_swagger_json, kwargs={'router': router}, name=json_url_name),
+        url('swagger\.json$', views.get_swagger_json, kwargs={
+            'router': router,
+            'document': document,
+            'cache_control': spec_cache_control,
+        }, name=json_url_name),
+        url('swagger-ui/(?P<name>[a-z.-]+)$', views.get_swagger_ui_asset_file, name=asset_url_name),
         url('%s$' % docs_url, views.render_docs, kwargs={
             'router': router,
             'json_url_name': '%s:%s' % (namespace, json_url_name),
+            'asset_url_name': '%s:%s' % (namespace, asset_url_name),
         }),
     ]
@@ -1,13 +1,47 @@
-from django.http import JsonResponse
+from django.http import Http404
 from django.shortcuts import render
 from django.urls import reverse
 
+from lepo_doc.precompressed import SWAGGER_UI_ASSETS, get_swagger_ui_asset
 
-def get_swagger_json(request, router):
-    return JsonResponse(router.api)
+# Asset URLs with the current content hash (see `get_asset_url()`) can be cached "forever";
+# others (unversioned, or from an earlier version) must be revalidated
+VERSIONED_ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+ASSET_CACHE_CONTROL = 'no-cache'
 
 
-def render_docs(request, router, json_url_name):
+def get_swagger_json(request, router, document, cache_control):
+    """
+    :type document: lepo_doc.precompressed.PrecompressedContent
+    """
+    return document.get_response(request, cache_control=cache_control)
+
+
+def get_swagger_ui_asset_file(request, name):
+    if name not in SWAGGER_UI_ASSETS:
+        raise Http404('No such asset')
+    asset = get_swagger_ui_asset(name)
+    versioned = (request.GET.get('v') == get_asset_version(asset))
+    return asset.get_response(
+        request,
+        cache_control=(VERSIONED_ASSET_CACHE_CONTROL if versioned else ASSET_CACHE_CONTROL),
+    )
+
+
+def get_asset_version(asset):
+    return asset.hash[:16]
+
+
+def get_asset_url(asset_url_name, name):
+    return '%s?v=%s' % (
+        reverse(asset_url_name, kwargs={'name': name}),
+        get_asset_version(get_swagger_ui_asset(name)),
+    )
+
+
+def render_docs(request, router, json_url_name, asset_url_name):
     return render(request, 'lepo_doc/swagger-ui.html', {
         'json_url': request.build_absolute_uri(reverse(json_url_name)),
+        'css_url': get_asset_url(asset_url_name, 'swagger-ui.css'),
+        'bundle_url': get_asset_url(asset_url_name, 'swagger-ui-bundle.js'),
     })
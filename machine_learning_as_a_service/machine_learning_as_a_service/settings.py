@@ -121,3 +121,99 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.11/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Local caches (parsed API spec etc.); must only be writable by trusted users
+
+CACHE_ROOT = os.environ.get('ML_CACHE_ROOT', os.path.join(BASE_DIR, 'var', 'cache'))
+
+LEPO_SPEC_CACHE_DIR = os.path.join(CACHE_ROOT, 'spec')
+
+# Cache for the results of data pipelines (see `data.pipeline`); None to disable
+
+DATA_PIPELINE_CACHE = 'default'
+
+DATA_PIPELINE_CACHE_TIMEOUT = 600
+
+# Whether to cache the intermediate results of data pipelines too, so that pipelines sharing steps share them
+
+DATA_PIPELINE_CACHE_INTERMEDIATE = True
+
+# Imported data with at most this fraction of nonzero values is stored sparse (see `data.sparse`)
+
+DATA_SPARSE_MAX_DENSITY = 0.1
+
+# Maximum number of features (i.e. largest feature index) of imported svmlight files
+
+DATA_SVMLIGHT_MAX_FEATURES = 1000000
+
+# When compacting imported data (see `data.compaction`), string columns with at most
+# this fraction of distinct values are stored as categoricals
+
+DATA_COMPACT_CATEGORY_THRESHOLD = 0.5
+
+# Number of rows to read at a time when importing CSV files
+
+DATA_CSV_CHUNK_SIZE = 100000
+
+# Seconds to wait for the server when fetching data to import from an URL
+
+DATA_FETCH_TIMEOUT = 30
+
+# Maximum size, in bytes, of data to append or import (as svmlight) from an URL
+
+DATA_FETCH_MAX_BYTES = 100 * 1024 * 1024
+
+# Number of rows to densify at a time when reading whole datasets in one pass (e.g. for sampling)
+
+DATA_READ_CHUNK_SIZE = 100000
+
+# Rows appended to datasets are stored as segments (see `data.segments`); once there are
+# DATA_SEGMENT_COMPACT_MIN_SEGMENTS segments of fewer than DATA_SEGMENT_COMPACT_MAX_ROWS rows,
+# consecutive ones are merged (in a background thread, if DATA_SEGMENT_COMPACT_IN_BACKGROUND is set)
+
+DATA_SEGMENT_COMPACT_MAX_ROWS = 100000
+
+DATA_SEGMENT_COMPACT_MIN_SEGMENTS = 8
+
+DATA_SEGMENT_COMPACT_IN_BACKGROUND = True
+
+# Where datasets are published for sharing between worker processes (see `data.sharing`);
+# None (the default) to disable.  A tmpfs directory (e.g. under /dev/shm) keeps them in RAM.  Datasets no process
+# has attached for DATA_SHARED_CACHE_MAX_IDLE seconds are deleted whenever a dataset is published
+# (and by `manage.py cleanup_shared_data`), but every dataset read meanwhile takes up space there,
+# so only enable this with room for the datasets in use at once.
+
+DATA_SHARED_CACHE_DIR = os.environ.get('DATA_SHARED_CACHE_DIR') or None
+
+DATA_SHARED_CACHE_MAX_IDLE = 3600
+
+# Where preprocessed feature matrices are cached (see `data.features`); None to disable
+
+DATA_FEATURE_CACHE_DIR = os.path.join(CACHE_ROOT, 'features')
+
+
+# Per-operation concurrency limits (see `lepo.admission`); limits may also be set in the API spec
+
+LEPO_ADMISSION = {
+    'LOCK_DIR': os.environ.get('LEPO_ADMISSION_LOCK_DIR', os.path.join(CACHE_ROOT, 'admission')),
+    'OPERATIONS': {},
+    'METRICS_SECRET': os.environ.get('LEPO_ADMISSION_METRICS_SECRET'),
+}
+
+
+# Limits for batch requests (see `lepo.batch`)
+
+LEPO_BATCH = {
+    'MAX_REQUESTS': 100,
+    'MAX_WORKERS': 8,
+}
+
+
+# Opt-in per-request profiling of API operations (see `lepo.profiling`)
+
+LEPO_PROFILING = {
+    'SECRET': os.environ.get('LEPO_PROFILING_SECRET'),
+    'SAMPLE_RATE': float(os.environ.get('LEPO_PROFILING_SAMPLE_RATE', 0)),
+    'PROFILER': os.environ.get('LEPO_PROFILING_PROFILER', 'cprofile'),
+}
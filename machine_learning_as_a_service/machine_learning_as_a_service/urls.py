@@ -15,21 +15,35 @@ Including another URLconf
 """
 from pkg_resources import resource_filename
 
+from django.conf import settings
 from django.conf.urls import include, url
 from django.contrib import admin
 
+from lepo.admission import get_admission_urls
+from lepo.batch import execute_batch
+from lepo.profiling import get_profiling_urls
 from lepo.router import Router
+from lepo.startup import startup_timer
 from lepo.validate import validate_router
 from lepo_doc.urls import get_docs_urls
 
-from data import views as data_views
+with startup_timer.step('load API spec'):
+    router = Router.from_file(
+        resource_filename(__name__, 'machine_learning_as_a_service-openapi_spec_v2.yaml'),
+        cache_dir=settings.LEPO_SPEC_CACHE_DIR,
+    )
 
-router = Router.from_file(resource_filename(__name__, 'machine_learning_as_a_service-openapi_spec_v2.yaml'))
-router.add_handlers(data_views)
-validate_router(router)
+with startup_timer.step('add and validate handlers'):
+    router.add_handlers({'execute_batch': execute_batch})
+    # Handler modules (and their heavy dependencies such as pandas) are imported on first use
+    router.add_handlers('data.views', lazy=True)
+    validate_router(router, import_handlers=settings.DEBUG)
 
-urlpatterns = [
-    url(r'^admin/', admin.site.urls),
-    url(r'^api/', include(router.get_urls(), 'api')),
-    url(r'^api/', include(get_docs_urls(router, 'api-docs'), 'api-docs')),
-]
+with startup_timer.step('build URL patterns'):
+    urlpatterns = [
+        url(r'^admin/', admin.site.urls),
+        url(r'^api/', include(router.get_urls(), 'api')),
+        url(r'^api/', include(get_docs_urls(router, 'api-docs'), 'api-docs')),
+        url(r'^api/', include(get_profiling_urls(), 'api-profiling')),
+        url(r'^api/', include(get_admission_urls(router), 'api-admission')),
+    ]
@@ -11,6 +11,9 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from lepo.startup import startup_timer
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "machine_learning_as_a_service.settings")
 
-application = get_wsgi_application()
+with startup_timer.step('django setup'):
+    application = get_wsgi_application()